@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+#
+# MH Extension - Blender AOV catalog
+# Precomputed table of the view layer render passes per Blender version and
+# render engine, and classification of the render layer pass sockets.
+#
+
+import logging
+from collections import namedtuple
+from types import MappingProxyType
+
+import bpy
+
+logger = logging.getLogger(__name__)
+
+# {(blender version, engine): MHAOVCatalog}
+_catalogs = {}
+
+
+def getAOVCatalog(viewLayer, knownNames, engine=None):
+    """
+    Return the AOV catalog for the current Blender version and render engine,
+    building it from the given view layer on first use.
+
+    Args:
+        viewLayer: Any view layer of the scene, used to reflect the pass properties
+        knownNames: Lowercase pass names the MH Extension knows how to connect
+        engine: Render engine, defaults to the engine of the current scene
+    """
+    engine = engine or bpy.context.scene.render.engine
+    key = (tuple(bpy.app.version), engine)
+    catalog = _catalogs.get(key)
+    if catalog is None:
+        catalog = MHAOVCatalog(viewLayer, engine, knownNames)
+        _catalogs[key] = catalog
+
+    return catalog
+
+
+def clearAOVCatalogs():
+    """Drop all catalogs, e.g. after render engine addons were (re)registered."""
+    _catalogs.clear()
+
+
+class MHAOVCatalog(object):
+    """
+    Table of pass display name -> RNA property path of a view layer.
+
+    The properties are reflected once with dir() on the view layer and on its
+    engine settings (layer.cycles / layer.eevee). Each entry keeps the owner
+    and attribute of its flag so enabled passes can be read in a single pass
+    over the table without rebuilding names or resolving paths.
+    """
+
+    # Passes stored outside the use_pass_* properties
+    extraAOVs = [
+        ("Denoising Data", "cycles.denoising_store_passes"),
+        ("Debug Samples", "cycles.pass_debug_sample_count"),
+    ]
+    nameOverrides = {
+        "Emit": "Emission",
+    }
+    engineSettings = {
+        "CYCLES": "cycles",
+        "BLENDER_EEVEE": "eevee",
+    }
+
+    def __init__(self, viewLayer, engine, knownNames):
+        self.engine = engine
+        parms = [x for x in dir(viewLayer) if x.startswith("use_pass_")]
+        settingsName = self.engineSettings.get(engine)
+        if settingsName:
+            settings = getattr(viewLayer, settingsName, None)
+            if settings is not None:
+                parms += [settingsName + "." + x for x in dir(settings) if x.startswith("use_pass_")]
+
+        aovs = [{"name": name, "parm": parm} for name, parm in self.extraAOVs]
+        for parm in parms:
+            name = self.getDisplayName(parm)
+            if name.lower() in knownNames:
+                aovs.append({"name": name, "parm": parm})
+
+        self.aovs = sorted(aovs, key=lambda x: x["name"])
+        self.aovsByName = {aov["name"]: aov for aov in self.aovs}
+        # [(name, owner attribute or "", flag attribute)]
+        self.accessors = []
+        for aov in self.aovs:
+            owner, _, attr = aov["parm"].rpartition(".")
+            self.accessors.append((aov["name"], owner, attr))
+
+        self.owners = sorted(set(owner for _, owner, _ in self.accessors if owner))
+        logger.debug("built AOV catalog for %s with %s passes" % (engine, len(self.aovs)))
+
+    def getDisplayName(self, parm):
+        name = parm.rpartition(".")[2].replace("use_pass_", "")
+        name = " ".join([x[0].upper() + x[1:] for x in name.split("_") if x])
+        return self.nameOverrides.get(name, name)
+
+    def getAOVs(self):
+        """Return [{"name", "parm"}] sorted by name."""
+        return list(self.aovs)
+
+    def getAOV(self, name):
+        return self.aovsByName.get(name)
+
+    def getEnabledAOVs(self, viewLayer):
+        """Return the names of the passes enabled on the view layer."""
+        owners = {"": viewLayer}
+        for owner in self.owners:
+            owners[owner] = getattr(viewLayer, owner, None)
+
+        aovNames = []
+        for name, owner, attr in self.accessors:
+            obj = owners[owner]
+            if obj is None:
+                continue
+
+            try:
+                val = getattr(obj, attr)
+            except AttributeError:
+                logger.debug("Couldn't access aov %s" % attr)
+                continue
+
+            if val:
+                aovNames.append(name)
+
+        return aovNames
+
+    def setAOVEnabled(self, viewLayer, name, enable=True):
+        """Toggle a pass on the view layer. Returns False if the pass is unknown."""
+        aov = self.getAOV(name)
+        if not aov:
+            return False
+
+        owner, _, attr = aov["parm"].rpartition(".")
+        obj = getattr(viewLayer, owner) if owner else viewLayer
+        setattr(obj, attr, enable)
+        return True
+
+
+# category: "main", "tech", "crypto" or "denoise"
+# outNode: key of the Prism output node the pass goes to, None if it isn't connected
+# slotTemplate: slot name, formatted with layer and padding ("####")
+# depth: color depth of the output node
+PassClass = namedtuple("PassClass", ["category", "outNode", "slotTemplate", "depth"])
+
+TECH_PASSES = frozenset(["Depth", "Normal", "UV", "Vector", "Mist", "Position"])
+CRYPTO_INDEXES = ("00", "01", "02")
+DENOISE_PASSES = ("Normal", "Albedo", "Depth")
+OUT_NODE_DEPTHS = {"main": "16", "tech": "32", "crypto": "32"}
+
+
+def classifyPass(socketName):
+    """Classify a render layer socket by name. Prefer MHPassClassification.getPass, which is precomputed."""
+    if socketName in TECH_PASSES:
+        category, outNode = "tech", "tech"
+    elif "Crypto" in socketName:
+        category = "crypto"
+        outNode = "crypto" if any(i in socketName for i in CRYPTO_INDEXES) else None
+    elif socketName.startswith("Denoising"):
+        category, outNode = "denoise", "main"
+    else:
+        category, outNode = "main", "main"
+
+    if outNode == "crypto":
+        # for Cryptos the slot has to be named like the pass.
+        slotTemplate = socketName
+    elif outNode:
+        slotName = "beauty" if socketName == "Image" else socketName
+        slotTemplate = "{layer}_%s/{layer}_%s.{padding}.exr" % (slotName, slotName)
+    else:
+        slotTemplate = None
+
+    return PassClass(category, outNode, slotTemplate, OUT_NODE_DEPTHS.get(outNode))
+
+
+class MHPassClassification(object):
+    """
+    Frozen table of render layer socket name -> PassClass, built once from
+    the AOV dict of the plugin (display name -> socket name). Also maps the
+    lowercase display names shown in the state UI to the class of their
+    socket.
+    """
+
+    def __init__(self, aovDict):
+        socketNames = set(["Image", "Alpha"])
+        for socketName in aovDict.values():
+            socketNames.add(socketName)
+            if "Crypto" in socketName:
+                socketNames.update(socketName + i for i in CRYPTO_INDEXES)
+            elif socketName == "Denoising":
+                socketNames.update("Denoising " + p for p in DENOISE_PASSES)
+
+        self.bySocket = MappingProxyType({name: classifyPass(name) for name in socketNames})
+        self.byAOV = MappingProxyType({
+            aovName: self.bySocket[socketName] for aovName, socketName in aovDict.items()
+        })
+
+    def getPass(self, socketName):
+        passClass = self.bySocket.get(socketName)
+        if passClass is None:
+            # Sockets unknown at load time, e.g. light groups or shader AOVs
+            passClass = classifyPass(socketName)
+
+        return passClass
+
+    def getAOV(self, aovName):
+        """Return the PassClass of an AOV by its display name (case insensitive)."""
+        passClass = self.byAOV.get(aovName.lower())
+        if passClass is None:
+            passClass = classifyPass(aovName)
+
+        return passClass
+
+
+SOCKET_CHANNELS = {"VALUE": 1, "VECTOR": 3, "RGBA": 4}
+
+
+def getSocketChannels(socket):
+    """Number of channels a render layer socket writes to an EXR."""
+    return SOCKET_CHANNELS.get(getattr(socket, "type", "RGBA"), 4)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# MH Extension - Batch publish worker
+# Runs in "blender -b <scene> --python <this file> -- --result <json>" and
+# publishes the MHRender states saved in the scene with the headless
+# publisher. Started by MHBatchPublishRunner.
+#
+
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+
+import bpy
+
+
+def parseArgs(argv):
+    # Blender passes the arguments after "--" to the script
+    argv = argv[argv.index("--") + 1:] if "--" in argv else []
+    parser = argparse.ArgumentParser(prog="Prism_BlenderMHExtension_BatchWorker")
+    parser.add_argument("--result", required=True, help="JSON file the publish results are written to")
+    parser.add_argument("--comment", default="")
+    parser.add_argument("--state", action="append", default=[], help="MHRender state to publish, all enabled ones if not given")
+    parser.add_argument("--version", default="next")
+    parser.add_argument("--no-save", action="store_true", help="Don't save the scene after a successful publish")
+    return parser.parse_args(argv)
+
+
+def getCore():
+    # The Prism core of the Blender startup integration, or a new one without UI
+    try:
+        import PrismInit
+        core = getattr(PrismInit, "pcore", None)
+        if core:
+            return core
+    except ImportError:
+        pass
+
+    prismRoot = os.getenv("PRISM_ROOT")
+    if prismRoot:
+        sys.path.insert(0, os.path.join(prismRoot, "Scripts"))
+
+    import PrismCore
+    return PrismCore.create(app="Blender", prismArgs=["noUI", "loadProject"])
+
+
+def readStateData(core):
+    buf = None
+    if hasattr(core.appPlugin, "sm_readStates"):
+        buf = core.appPlugin.sm_readStates(None)
+
+    if not buf and "PrismStates" in bpy.context.scene:
+        buf = bpy.context.scene["PrismStates"]
+
+    return json.loads(buf) if buf else {"states": []}
+
+
+def writeStateData(core, stateData):
+    buf = json.dumps(stateData, indent=4)
+    if hasattr(core.appPlugin, "sm_saveStates"):
+        core.appPlugin.sm_saveStates(None, buf)
+    else:
+        bpy.context.scene["PrismStates"] = buf
+
+
+def getStateClass(props):
+    return props.get("stateclass") or props.get("className")
+
+
+def publishScene(core, args, result):
+    from Prism_BlenderMHExtension_Publish import isStateEnabled
+
+    functions = core.getPlugin("MHExtension").blendFunctions
+    stateData = readStateData(core)
+    states = stateData.get("states", [])
+    layers = [s for s in states if getStateClass(s) == "MHrendLayer" and isStateEnabled(s)]
+    renders = [
+        s for s in states
+        if getStateClass(s) == "MHRender" and isStateEnabled(s) and (not args.state or s.get("stateName") in args.state)
+    ]
+    if not renders:
+        result["error"] = "no enabled MHRender state in the scene"
+        return
+
+    for props in renders:
+        # Keep the saved states in sync with the new paths, like the state widgets
+        hooks = {
+            "onLayerApplied": lambda index, path, transaction: layers[index].update(lastexportpath=path),
+            "onOutputName": lambda path, transaction, props=props: props.update(lastexportpath=path),
+        }
+        publisher = functions.createRenderPublisher(props, layers, comment=args.comment, hooks=hooks)
+        start = time.time()
+        report = publisher.execute(useVersion=args.version)
+        report["duration"] = time.time() - start
+        result["states"].append(report)
+        print("MHBatchPublish: %s - %s %s" % (report["stateName"], report["status"], report["message"]))
+
+    if all(r["status"] == "success" for r in result["states"]) and not args.no_save:
+        writeStateData(core, stateData)
+        bpy.ops.wm.save_mainfile()
+
+
+def main():
+    args = parseArgs(sys.argv)
+    result = {"scene": bpy.data.filepath, "states": [], "error": None}
+    try:
+        publishScene(getCore(), args, result)
+    except Exception:
+        result["error"] = traceback.format_exc()
+        print(result["error"])
+
+    with open(args.result, "w") as f:
+        json.dump(result, f, indent=4, default=str)
+
+    success = not result["error"] and all(r["status"] == "success" for r in result["states"])
+    sys.stdout.flush()
+    sys.exit(0 if success else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+#
+# MH Extension - Blender compositor helpers
+# Index of the Prism nodes in the scene compositor tree.
+#
+
+import os
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+RL_PREFIX = "Prism_RL_"
+OUT_PREFIX = "Prism_OUT_"
+OUT_SUFFIXES = {
+    "main": "_MainPasses",
+    "tech": "_TechPasses",
+    "crypto": "_CryptoMatte",
+}
+
+
+def getRLNodeName(layername):
+    return RL_PREFIX + layername
+
+
+# Prism_OUT_<layer>_<MainPasses|TechPasses|CryptoMatte>[_<variant>]
+OUT_NAME_PATTERN = re.compile(
+    r"^%s(.+)(%s)(?:_(.+))?$" % (OUT_PREFIX, "|".join(OUT_SUFFIXES.values()))
+)
+OUT_SUFFIX_KEYS = {suffix: key for key, suffix in OUT_SUFFIXES.items()}
+# exr_codec of new output nodes, what the "Default" codec writes
+DEFAULT_EXR_CODEC = "ZIP"
+
+
+def getOutNodeName(layername, key):
+    """
+    Return the output node name for a key. Keys are "main", "tech", "crypto"
+    or "<key>:<variant>" for the extra nodes of passes with another output
+    policy, e.g. "main:32bit_ZIP" -> Prism_OUT_<layer>_MainPasses_32bit_ZIP.
+    """
+    base, _, variant = key.partition(":")
+    name = OUT_PREFIX + layername + OUT_SUFFIXES[base]
+    if variant:
+        name += "_" + variant
+
+    return name
+
+
+def getOutNodeBasePath(folder, layername, key, fileFormat, padding):
+    """
+    Return the base_path of a Prism output node for the version folder of
+    its layer. Separate files nodes use the folder, their slots add the
+    AOV folders. Blender uses the base_path of multilayer nodes as file
+    prefix, so the cryptomatte and multilayer nodes get a file in their
+    own AOV folder: <folder>/<aov>/<aov>.<padding>.exr
+    """
+    if not folder:
+        return folder
+
+    if key == "crypto":
+        dirname, filename = layername + "_Cryptomatte", layername + "_CryptoMatte"
+    elif fileFormat == "OPEN_EXR_MULTILAYER":
+        dirname = filename = getOutNodeName(layername, key).replace(OUT_PREFIX, "", 1)
+    else:
+        return os.path.normpath(folder)
+
+    return os.path.normpath(os.path.join(folder, dirname, filename + "." + padding + ".exr"))
+
+
+def parseOutNodeName(name):
+    """Return (layername, key) of a Prism output node name or None."""
+    match = OUT_NAME_PATTERN.match(name)
+    if not match:
+        return None
+
+    layername, suffix, variant = match.groups()
+    key = OUT_SUFFIX_KEYS[suffix]
+    if variant:
+        key += ":" + variant
+
+    return layername, key
+
+
+class MHNodeTreeIndex(object):
+    """
+    Maps node names, layer -> Prism RL node and layer -> {main, tech, crypto
+    and their variants} output nodes of a compositor tree.
+
+    The index is built with a single walk over the tree and must be kept up
+    to date through addNode/removeNode when nodes are created or deleted
+    while it is in use. It is meant to live for one operation (a layer setup,
+    a relayout, a state deletion...), not across user edits of the tree.
+    """
+
+    def __init__(self, nodetree):
+        self.nodetree = nodetree
+        # Set when nodes were added, removed or resized and need a new layout
+        self.layoutDirty = False
+        self.rebuild()
+
+    def rebuild(self):
+        # {name: node}
+        self.nodes = {}
+        # All R_LAYERS nodes, including the ones not created by Prism
+        self.renderNodes = []
+        # {layername: Prism RL node}
+        self.rlNodes = {}
+        # {layername: {key: Prism output node}}
+        self.outNodes = {}
+        if self.nodetree is None:
+            return
+
+        for node in self.nodetree.nodes:
+            self._register(node)
+
+    def _register(self, node):
+        self.nodes[node.name] = node
+        if node.type == "R_LAYERS":
+            self.renderNodes.append(node)
+            if node.name == getRLNodeName(node.layer):
+                self.rlNodes[node.layer] = node
+        elif node.type == "OUTPUT_FILE":
+            parsed = parseOutNodeName(node.name)
+            if parsed:
+                self.outNodes.setdefault(parsed[0], {})[parsed[1]] = node
+
+    def hasNode(self, name):
+        return name in self.nodes
+
+    def getNode(self, name):
+        return self.nodes.get(name)
+
+    def getRLNode(self, layername):
+        return self.rlNodes.get(layername)
+
+    def getPrismRLNodes(self):
+        return list(self.rlNodes.values())
+
+    def getOutNodes(self, layername):
+        """Return {"main", "tech", "crypto": node or None} plus the variant nodes of the layer."""
+        outNodes = {key: None for key in OUT_SUFFIXES}
+        outNodes.update(self.outNodes.get(layername, {}))
+        return outNodes
+
+    def addNode(self, node):
+        """Register a node created after the index was built (after it got its final name/layer)."""
+        self._register(node)
+
+    def removeNode(self, node):
+        name = node.name
+        if node.type == "R_LAYERS":
+            self.renderNodes = [n for n in self.renderNodes if n.name != name]
+            if self.rlNodes.get(node.layer) is not None and self.rlNodes[node.layer].name == name:
+                del self.rlNodes[node.layer]
+        elif node.type == "OUTPUT_FILE":
+            parsed = parseOutNodeName(name)
+            if parsed:
+                self.outNodes.get(parsed[0], {}).pop(parsed[1], None)
+
+        self.nodes.pop(name, None)
+        self.nodetree.nodes.remove(node)
+
+
+def diffLayerGraph(index, spec):
+    """
+    Compare the desired compositor graph of a render layer with the tree and
+    return the minimal list of operations to apply. An empty list means the
+    tree already matches the description.
+
+    Args:
+        index: MHNodeTreeIndex of the tree
+        spec: Layer description, see Prism_BlenderMHExtension_Functions.describeLayerGraph
+
+    Returns:
+        List of tuples, the first item being the operation:
+            ("createRL",)
+            ("createOut", key)
+            ("removeOut", key)
+            ("setFormat", key, attribute, value)
+            ("setBasePath", key, path)
+            ("addSlot", key, slotname)
+            ("removeSlot", key, slotname)
+            ("link", key, passname, slotname)
+    """
+    if index.getRLNode(spec["layer"]) is None:
+        return [("createRL",)]
+
+    ops = []
+    outNodes = index.getOutNodes(spec["layer"])
+    for key, node in outNodes.items():
+        if node is not None and key not in spec["outputs"]:
+            ops.append(("removeOut", key))
+
+    for key, outSpec in spec["outputs"].items():
+        node = outNodes.get(key)
+        if not outSpec or not outSpec["slots"]:
+            if node is not None:
+                ops.append(("removeOut", key))
+            continue
+
+        inputs = {}
+        if node is None:
+            ops.append(("createOut", key))
+        else:
+            # No codec means the default one, so switching back to "Default" resets it
+            formatAttrs = [
+                ("file_format", outSpec["format"]),
+                ("color_depth", outSpec["depth"]),
+                ("exr_codec", outSpec.get("codec") or DEFAULT_EXR_CODEC),
+            ]
+
+            for attr, value in formatAttrs:
+                if getattr(node.format, attr) != value:
+                    ops.append(("setFormat", key, attr, value))
+
+            if outSpec["basePath"] is not None and node.base_path != outSpec["basePath"]:
+                ops.append(("setBasePath", key, outSpec["basePath"]))
+
+            inputs = {i.name: i for i in node.inputs}
+            wanted = set(slotname for slotname, _ in outSpec["slots"])
+            for name in inputs:
+                if name not in wanted:
+                    ops.append(("removeSlot", key, name))
+
+        for slotname, passname in outSpec["slots"]:
+            slot = inputs.get(slotname)
+            if slot is None:
+                ops.append(("addSlot", key, slotname))
+
+            # Slots linked from other nodes (e.g. a denoiser in between) are kept
+            if slot is None or not slot.is_linked:
+                ops.append(("link", key, passname, slotname))
+
+    return ops
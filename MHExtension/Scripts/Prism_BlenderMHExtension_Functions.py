@@ -1,4 +1,5 @@
 import os
+import re
 import sys
 import threading
 import platform
@@ -11,6 +12,7 @@ import tempfile
 import math
 import mathutils
 import json
+from contextlib import contextmanager
 
 import bpy
 
@@ -26,6 +28,18 @@ if eval(os.getenv("PRISM_DEBUG", "False")):
 
 import widget_import_scenedata
 from PrismUtils.Decorators import err_catcher as err_catcher
+from Prism_BlenderMHExtension_AOVs import getAOVCatalog, MHPassClassification, getSocketChannels
+from Prism_BlenderMHExtension_Compositor import MHNodeTreeIndex, diffLayerGraph, getOutNodeName, getOutNodeBasePath, DEFAULT_EXR_CODEC
+from Prism_BlenderMHExtension_OutputPolicy import MHOutputPolicy
+from Prism_BlenderMHExtension_Properties import MHLayerPropertyBinder
+from Prism_MHExtension_VersionAllocator import MHVersionAllocator
+from Prism_MHExtension_PublishTransaction import MHPublishTransaction
+from Prism_BlenderMHExtension_LocalRender import MHLocalRenderScheduler, getFrameRanges
+from Prism_MHExtension_FarmJobs import buildLayerJobGraph, MHLocalFarmManager, MHPrismFarmManager
+from Prism_BlenderMHExtension_Publish import MHRenderPublisher
+from Prism_MHExtension_BatchPublish import MHBatchPublishRunner
+from Prism_BlenderMHExtension_Layout import layoutNodeTree, needsLayout, getRLNodeHeight
+from Prism_BlenderMHExtension_UiRefresh import getLayerUiTracker, NODES
 
 logger = logging.getLogger(__name__)
 
@@ -75,6 +89,33 @@ class Prism_BlenderMHExtension_Functions(object):
             "Motion Blur":"use_motion_blur",
             "Denoising":"cycles.use_denoising",
         }
+        self.layerPropertyBinder = MHLayerPropertyBinder(self.layerProperties)
+        # Socket name -> category, output node, slot and depth, shared by the UI and the compositor setup
+        self.passClasses = MHPassClassification(self.AOVDict)
+        self.aovGroupColors = {
+            "tech": "#995233",
+            "main": "#365e99",
+            "crypto": "#429933",
+        }
+
+        # Node tree index of the running compositor operation, see nodeTreeOperation
+        self.nodeIndex = None
+        # Index reused between operations while the tree is unchanged, see getNodeIndex
+        self.cachedNodeIndex = None
+        self.cachedNodeIndexKey = None
+        self.uiTracker = getLayerUiTracker()
+        # Settings of the Prism output nodes of a layer, see describeLayerGraph
+        self.layerOutputModes = ["Separate Files", "Multilayer EXR"]
+        self.exrCodecs = ["Default", "ZIP", "PIZ", "DWAA"]
+        # Bit depth and codec come from the project output policy
+        self.outNodeSettings = {
+            "main": {"format": "OPEN_EXR", "color": (0.21, 0.37, 0.6)},
+            "tech": {"format": "OPEN_EXR", "color": (0.6, 0.32, 0.2)},
+            "crypto": {"format": "OPEN_EXR_MULTILAYER", "color": (0.26, 0.6, 0.2)},
+        }
+        self.outputPolicy = MHOutputPolicy(self.core)
+        # Render manager entry of the stand-in farm, see useFarmStandIn
+        self.farmStandInName = MHLocalFarmManager.name
 
         self.core.registerCallback("onStateDeleted", self.onStateDeleted, plugin=self)
 
@@ -172,10 +213,11 @@ class Prism_BlenderMHExtension_Functions(object):
     def sm_render_getRenderPasses(self, origin, layername):
         # Return the render passes if the render passes are not active, 
         # or in other words, return remaining render passes.
+        enabledAOVs = set(self.getViewLayerAOVs(layername))
         aovNames = [
             x["name"]
             for x in self.getAvailableAOVs(layername)
-            if x["name"] not in self.getViewLayerAOVs(layername)
+            if x["name"] not in enabledAOVs
         ]
         return aovNames
     
@@ -187,29 +229,22 @@ class Prism_BlenderMHExtension_Functions(object):
         passNames = self.getViewLayerAOVs(origin.cb_renderLayer.currentText())
         logger.debug("viewlayer aovs: %s" % passNames)
 
-        tech = []
-        main = []
-        crypto = []
-        for i in sorted(passNames, key=lambda s: s.lower()):
-            passname:str = self.AOVDict[i.lower()]
-            if self.compareTechPass(passname):
-                tech.append(i)
-            elif 'crypto' in passname.lower():
-                crypto.append(i)
-            else:
-                main.append(i)
-        passNames = tech + main + crypto
-
-        origin.lw_passes.addItems(passNames)
-        for index in range(origin.lw_passes.count()):
+        groupedPasses = self.sortAOVsByGroup(passNames)
+        origin.lw_passes.addItems([name for name, group in groupedPasses])
+        for index, (name, group) in enumerate(groupedPasses):
             item = origin.lw_passes.item(index)
-            i = item.text()
-            if i in tech:
-                item.setBackground(QColor("#995233"))
-            elif i in crypto:
-                item.setBackground(QColor("#429933"))
-            else:
-                item.setBackground(QColor("#365e99"))
+            item.setBackground(QColor(self.aovGroupColors[group]))
+
+    @err_catcher(name=__name__)
+    def sortAOVsByGroup(self, aovNames)->list:
+        # [(aovName, "tech"|"main"|"crypto")] ordered tech, main, crypto and by name
+        order = {"tech": 0, "main": 1, "crypto": 2}
+        grouped = []
+        for name in aovNames:
+            category = self.passClasses.getAOV(name).category
+            grouped.append((name, category if category in order else "main"))
+
+        return sorted(grouped, key=lambda x: (order[x[1]], x[0].lower()))
 
     @err_catcher(name=__name__)
     def sm_render_addRenderPass(self, origin, passName, steps, layername):
@@ -259,71 +294,81 @@ class Prism_BlenderMHExtension_Functions(object):
         return passNames
 
     @err_catcher(name=__name__)
-    def getViewLayerAOVs(self, layername)->list:
-        scene = bpy.context.scene
-        availableAOVs = self.getAvailableAOVs(layername)
-        # curlayer = bpy.context.window_manager.windows[0].view_layer
-        curlayer = scene.view_layers[layername]
-        aovNames = []
-        for aa in availableAOVs:
-            val = None
-            try:
-                val = operator.attrgetter(aa["parm"])(curlayer)
-            except AttributeError:
-                logging.debug("Couldn't access aov %s" % aa["parm"])
+    def getLayerAOVCatalog(self, layername):
+        # The catalog is built once per Blender version and render engine
+        curlayer = bpy.context.scene.view_layers[layername]
+        return getAOVCatalog(curlayer, self.AOVDict)
 
-            if val:
-                aovNames.append(aa["name"])
-
-        return aovNames
+    @err_catcher(name=__name__)
+    def getViewLayerAOVs(self, layername)->list:
+        curlayer = bpy.context.scene.view_layers[layername]
+        return self.getLayerAOVCatalog(layername).getEnabledAOVs(curlayer)
 
     @err_catcher(name=__name__)
     def getAvailableAOVs(self, layername)->list:
-        scene = bpy.context.scene
-        # curlayer = bpy.context.window_manager.windows[0].view_layer
-        curlayer = scene.view_layers[layername]
-        aovParms = [x for x in dir(curlayer) if x.startswith("use_pass_")]
-        # AOVs inside the cycles list
-        if self.isUsingCycles():
-            aovParms += [
-                "cycles." + x for x in dir(curlayer.cycles) if x.startswith("use_pass_")
-            ]
-        elif self.isUsingEevee():
-            aovParms += [
-                "eevee." + x for x in dir(curlayer.eevee) if x.startswith("use_pass_")
-            ]
-        aovs = [
-            {"name": "Denoising Data", "parm": "cycles.denoising_store_passes"},
-            {"name": "Debug Samples", "parm": "cycles.pass_debug_sample_count"},
-        ]
-        nameOverrides = {
-            "Emit": "Emission",
-        }
-        for aov in aovParms:
-            name = aov.replace("use_pass_", "").replace("cycles.", "").replace("eevee.","")
-            name = [x[0].upper() + x[1:] for x in name.split("_")]
-            name = " ".join(name)
-            name = nameOverrides[name] if name in nameOverrides else name
-            if(name.lower() in self.AOVDict.keys()):
-                aovs.append({"name": name, "parm": aov})
-
-        aovs = sorted(aovs, key=lambda x: x["name"])
-
-        return aovs
+        return self.getLayerAOVCatalog(layername).getAOVs()
 
     @err_catcher(name=__name__)
     def useNodeAOVs(self)->bool:
         return bool(self.getNodeAOVs())
 
     
+    @contextmanager
+    def nodeTreeOperation(self):
+        # Index the compositor tree once for the whole operation. Nested
+        # operations reuse the index of the outermost one.
+        if self.nodeIndex is not None:
+            yield self.nodeIndex
+            return
+
+        index = self.getNodeIndex()
+        index.layoutDirty = False
+        self.nodeIndex = index
+        try:
+            yield index
+            if index.layoutDirty:
+                layoutNodeTree(index)
+                index.layoutDirty = False
+        except BaseException:
+            # The index may be half updated
+            self.cachedNodeIndex = None
+            raise
+        finally:
+            self.nodeIndex = None
+
+        # The operation kept the index in sync with its edits
+        self.cachedNodeIndexKey = self.getNodeTreeKey(index.nodetree)
+
+    @err_catcher(name=__name__)
+    def getNodeTreeKey(self, nodetree):
+        # Changes with the tree, its node count and the Blender notifications
+        # of tree, scene, undo and file load updates
+        if nodetree is None:
+            return None
+
+        return (nodetree.as_pointer(), len(nodetree.nodes), self.uiTracker.generations[NODES])
+
+    @err_catcher(name=__name__)
+    def getNodeIndex(self):
+        if self.nodeIndex is not None:
+            return self.nodeIndex
+
+        # Outside of an operation the last index is reused until the tree changes
+        nodetree = bpy.context.scene.node_tree
+        key = self.getNodeTreeKey(nodetree)
+        if self.cachedNodeIndex is None or key is None or key != self.cachedNodeIndexKey:
+            self.cachedNodeIndex = MHNodeTreeIndex(nodetree)
+            self.cachedNodeIndexKey = key
+
+        return self.cachedNodeIndex
+
     @err_catcher(name=__name__)
     def getPatternedLayerNodes(self, pattern):
-        nodes = []
-        for node in bpy.context.scene.node_tree.nodes:
-            if node.type == 'R_LAYERS':
-                if node.name == pattern + node.layer:
-                    nodes.append(node)
-        return nodes
+        index = self.getNodeIndex()
+        if pattern == 'Prism_RL_':
+            return index.getPrismRLNodes()
+
+        return [n for n in index.renderNodes if n.name == pattern + n.layer]
 
     @err_catcher(name=__name__)
     def sortNodesByYposition(self, nodes:list)->list:
@@ -331,128 +376,39 @@ class Prism_BlenderMHExtension_Functions(object):
     
     @err_catcher(name=__name__)
     def getRLDimensions(self, renderlayernode)->float:
-        outs = [o for o in renderlayernode.outputs if o.enabled == True]
-        basedimension:float = 79
-        buffer:float = 100
-        outputdimension:float = 22
-
-        return (basedimension + buffer + (len(outs)*outputdimension))
-         
+        return getRLNodeHeight(renderlayernode)
 
     @err_catcher(name=__name__)
     def repositionRenderLayerNodes(self)->None:
-        nodes:list = self.getPatternedLayerNodes('Prism_RL_')
-        if len(nodes) > 0:
-            sorted_nodes:list = self.sortNodesByYposition(nodes)
-            y_offset:float = 0
-            current_y:float = sorted_nodes[0].location.y
-            current_x:float = sorted_nodes[0].location.x
-            for node in sorted_nodes:
-                layername:str = node.layer
-                node.location = mathutils.Vector((current_x,current_y))
-                self.repositionLayerOutNodes(layername=layername, in_node=node)
-                out_node_dimensions:float = 0.0
-                layernodesdict:dict = self.getLayerOutNodes(layername)
-                if layernodesdict['main']:
-                    out_node_dimensions += (75.27 + (len(layernodesdict['main'].inputs) * 22))
-                if layernodesdict['tech']:
-                    out_node_dimensions += (75.27 + (len(layernodesdict['tech'].inputs) * 22))
-                if layernodesdict['crypto']:
-                    out_node_dimensions += (75.27 + (len(layernodesdict['crypto'].inputs) * 22))
-                
-                max_dimension = out_node_dimensions
-                if self.getRLDimensions(node) > max_dimension:
-                    max_dimension = self.getRLDimensions(node)
-                
-                current_y -= max_dimension + y_offset
-
+        # The layout runs once when the outermost node tree operation ends
+        with self.nodeTreeOperation() as index:
+            index.layoutDirty = True
 
     @err_catcher(name=__name__)
     def repositionLayerOutNodes(self, layername:str, in_node=None)->None:
-        if not in_node:
-            in_node = self.getRLNode(layername)
-        layernodesdict:dict = self.getLayerOutNodes(layername)
-        out_node = layernodesdict['main']
-        ##Cambiar la pos de Tech, Main y Crypto en Y dependiendo del numero de inputs que tenga
-        ## las dimensiones de un Outnode son 69.0 (con un pequeño buffer es 75.27) + 22*el número de inputs 
-        x_offset = (in_node.width + 240)
-        y_offset = 100
-        
-        out_node.location = in_node.location + mathutils.Vector((x_offset,0.0))
-        if layernodesdict['tech']:
-            out_node_tech = layernodesdict['tech']
-            y_dimension = 75.27 + (len(out_node_tech.inputs)*22)# + y_offset
-            out_node_tech.location = in_node.location + mathutils.Vector((x_offset,0.0))
-            #Ponemos el OutNode en relacion al TechNode
-            out_node.location = out_node_tech.location + mathutils.Vector((0,-y_dimension))
-        if layernodesdict['crypto']:
-            out_node_Crypto = layernodesdict['crypto']
-            y_dimension = 75.27 + (len(out_node_Crypto.inputs)*22)
-            out_node_y_dimension = 75.27 + (len(out_node.inputs)*22)
-            out_node_Crypto.location = out_node.location + mathutils.Vector((0,-out_node_y_dimension))
+        # Output nodes are placed relative to their RL node as part of the full layout
+        self.repositionRenderLayerNodes()
 
     @err_catcher(name=__name__)
     def removeEmptyOutNodes(self, layername:str)->None:
-        layernodesdict:dict = self.getLayerOutNodes(layername)
+        index = self.getNodeIndex()
+        layernodesdict:dict = index.getOutNodes(layername)
         for node in list(layernodesdict.values()):
             if node:
                 if len(node.inputs) < 1:
-                    bpy.context.scene.node_tree.nodes.remove(node)
-
-    @err_catcher(name=__name__)
-    def removeAOVSlot(self, layernodes:dict, nodetype:str, slotname:str)->None:
-        if layernodes[nodetype]:
-            inputs = layernodes[nodetype].inputs
-            if slotname in inputs:
-                inputs.remove(inputs[slotname])
+                    index.removeNode(node)
+                    index.layoutDirty = True
 
     @err_catcher(name=__name__)
     def removeAOV(self, aovName:str, renderlayerName:str)->None:
-        if True:#self.useNodeAOVs():
-            nodeAovName:str = self.AOVDict[aovName.lower()]
-            layernodesdict:dict = self.getLayerOutNodes(renderlayerName)            
-            slotname:str = self.getSlotname(renderlayerName, nodeAovName)
-
-            if self.compareTechPass(nodeAovName):
-                self.removeAOVSlot(layernodesdict, 'tech', slotname)
-            elif self.isCryptoPass(nodeAovName):
-                # for Cryptos the slot has to be named like the pass.
-                cryptoindexes = ['00','01','02']
-                for cri in cryptoindexes:
-                    slotname = nodeAovName+cri
-                    self.removeAOVSlot(layernodesdict, 'crypto', slotname)
-            else:
-                if nodeAovName == "Denoising":
-                    denoisepasses = ['Normal','Albedo','Depth']
-                    for aov in denoisepasses:
-                        slotname = self.getSlotname(renderlayerName, nodeAovName+" "+aov)
-                        self.removeAOVSlot(layernodesdict, 'main', slotname)
-                else:
-                    self.removeAOVSlot(layernodesdict, 'main', slotname)
-        
         self.enableViewLayerAOV(aovName, renderlayerName, enable=False)
-
+        # The pass socket is gone from the RL node, reconciling drops its slots
+        self.reconcileLayerGraph(renderlayerName, create=False)
 
     @err_catcher(name=__name__)
     def enableViewLayerAOV(self, name, layername, enable=True):
-        aa = self.getAvailableAOVs(layername)
-        curAOV = [x for x in aa if x["name"] == name]
-        if not curAOV:
-            return
-
-        curAOV = curAOV[0]
-        
-        scene = bpy.context.scene
-        curlayer = scene.view_layers[layername]
-        
-        attrs = curAOV["parm"].split(".")
-        obj = curlayer
-        #Choose last index from splited string. example cycles.use_pass_volume_indirect we get use_pass_volume_indirect only.
-        for a in attrs[:-1]:
-            # here the obj becomes layer.cycles or layer.eevee where is applicable instead of just layer
-            obj = getattr(obj, a)
-
-        setattr(obj, attrs[-1], enable)
+        curlayer = bpy.context.scene.view_layers[layername]
+        self.getLayerAOVCatalog(layername).setAOVEnabled(curlayer, name, enable)
 
     @err_catcher(name=__name__)
     def setViewLayerPropertyState(self, parameter, layername, enable)->None:
@@ -465,6 +421,22 @@ class Prism_BlenderMHExtension_Functions(object):
             obj = getattr(obj, a)
         setattr(obj, attrs[-1], enable)
 
+    @err_catcher(name=__name__)
+    def syncLayerPropertyWidgets(self, layername, widgets)->int:
+        # Checkboxes {name: QCheckBox} <- view layer, without signal feedback
+        if layername not in bpy.context.scene.view_layers:
+            return 0
+
+        return self.layerPropertyBinder.syncWidgets(bpy.context.scene.view_layers[layername], widgets)
+
+    @err_catcher(name=__name__)
+    def pushLayerProperty(self, layername, name, value)->bool:
+        # Checkbox -> view layer, only if the value differs
+        if layername not in bpy.context.scene.view_layers:
+            return False
+
+        return self.layerPropertyBinder.pushValue(bpy.context.scene.view_layers[layername], name, value)
+
     @err_catcher(name=__name__)
     def getViewLayerPropertyState(self, parameter, layername)->bool:
         scene = bpy.context.scene
@@ -487,12 +459,7 @@ class Prism_BlenderMHExtension_Functions(object):
     ######___FUNCIONES_SETPASS___######
     @err_catcher(name=__name__)
     def nodeNameExists(self, node_name):
-        node_tree = bpy.context.scene.node_tree
-        # Iterate through all nodes in the node tree
-        for node in node_tree.nodes:
-            if node.name == node_name:
-                return True
-        return False
+        return self.getNodeIndex().hasNode(node_name)
 
     @err_catcher(name=__name__)
     def setUpOutNode(self, out_node, basepath, name, depth, node_color, fformat):
@@ -516,95 +483,19 @@ class Prism_BlenderMHExtension_Functions(object):
             aovname = "beauty"
         return layername + "_" + aovname + "/" + layername + "_" + aovname + "." + padding_string + ".exr"
 
-    @err_catcher(name=__name__)
-    def connectNodes(self, nodetree, layername, renderpass, out_node)->None:
-        if renderpass.is_linked:
-            return
-        aovname = renderpass.name
-        slotname = self.getSlotname(layername, aovname)
-        # for Cryptos the slot has to be named like the pass.
-        if "CryptoMatte" in out_node.label:
-            slotname = aovname
-        # if already slot exists, connect to existing.
-        inputs_by_name = [p.name for p in out_node.inputs]
-        if slotname in inputs_by_name:
-            if not out_node.inputs[slotname].is_linked:
-                slot = out_node.inputs[slotname]
-        else:
-            slot = out_node.file_slots.new(slotname)
-        links = nodetree.links
-        link = links.new(renderpass,slot)
-
-    @err_catcher(name=__name__)
-    def checkTechPasses(self, currentpasses)->bool:
-        for currentpass in currentpasses:
-            if self.compareTechPass(currentpass.name):
-                return True
-        return False
-    
     @err_catcher(name=__name__)
     def compareTechPass(self, currentpassname:str)->bool:
-        techPasses = ['Depth','Normal','UV','Vector','Mist','Position']
-        if currentpassname in techPasses:
-            return True
-        return False
-
-    @err_catcher(name=__name__)
-    def hasCryptoObj(self, passesbyname:list)->bool:
-        return 'CryptoObject00' in passesbyname
-    
-    @err_catcher(name=__name__)
-    def hasCryptoMat(self, passesbyname:list)->bool:
-        return 'CryptoMaterial00' in passesbyname
-    
-    @err_catcher(name=__name__)
-    def hasCryptoAsset(self, passesbyname:list)->bool:
-        return 'CryptoAsset00' in passesbyname
+        return self.passClasses.getPass(currentpassname).category == "tech"
 
     @err_catcher(name=__name__)
     def isCryptoPass(self, currentpassname:str)->bool:
-        return 'Crypto' in currentpassname
-
-    ## Output node making functions ##
-    @err_catcher(name=__name__)
-    def get_output_node(self, node_path:str, node_name:str, img_bitdepth:int, color, fformat:str):
-        nodetree = bpy.context.scene.node_tree
-        node_name = 'Prism_OUT_' + node_name
-        if self.nodeNameExists(node_name):
-            out_node = nodetree.nodes[node_name]
-        else:
-            out_node = nodetree.nodes.new(type='CompositorNodeOutputFile')
-            out_node = self.setUpOutNode(out_node, node_path, node_name, img_bitdepth, color, fformat)
-        return out_node
-
-    @err_catcher(name=__name__)
-    def get_MainOutode(self, allpath, layername):
-        out_node = self.get_output_node(allpath, layername+'_MainPasses', 16, (0.21, 0.37, 0.6), 'OPEN_EXR')
-        return out_node
-    
-    @err_catcher(name=__name__)
-    def get_TecOuthNode(self, allpath, layername):
-        out_node = self.get_output_node(allpath,layername+'_TechPasses', 32, (0.6, 0.32, 0.2), 'OPEN_EXR')
-        return out_node
-    
-    @err_catcher(name=__name__)
-    def get_CryptoOutNode(self, allpath, layername):
-        out_node = self.get_output_node(allpath + "/" + layername + "_CryptoMatte",layername+'_CryptoMatte', 32, (0.26, 0.6, 0.2), 'OPEN_EXR_MULTILAYER')
-        return out_node
-
-    @err_catcher(name=__name__)
-    def make_CryptoConnections(self, nodetree, layername, layerpass, out_node_Crypto):
-        cryptoindex = ['00','01','02']
-        for i in cryptoindex:
-            if i in layerpass.name:
-                self.connectNodes(nodetree, layername, layerpass, out_node_Crypto)
+        return self.passClasses.getPass(currentpassname).category == "crypto"
 
     @err_catcher(name=__name__)
     def lastRLlocation(self):
         lowest_y = float('inf')
         lowest_y_node = None
-        nodetree = bpy.context.scene.node_tree
-        rendernodes = [n for n in nodetree.nodes if n.type == 'R_LAYERS']
+        rendernodes = self.getNodeIndex().renderNodes
         if len(rendernodes) < 1:
             return None, mathutils.Vector((0,0))
         
@@ -619,12 +510,8 @@ class Prism_BlenderMHExtension_Functions(object):
     def getRLNode(self, layername, cancreate=True):
         nodename = 'Prism_RL_' + layername
         nodetree = bpy.context.scene.node_tree
-        rendernodes = [n for n in nodetree.nodes if n.type == 'R_LAYERS']
-        rendernode = None
-        for n in rendernodes:
-            if n.layer == layername:
-                if n.name == nodename:
-                    rendernode = n
+        index = self.getNodeIndex()
+        rendernode = index.getRLNode(layername)
 
         if not rendernode and cancreate:
             nodes:list = self.getPatternedLayerNodes('Prism_RL_')
@@ -643,6 +530,7 @@ class Prism_BlenderMHExtension_Functions(object):
             layer_node.label = "Prism RL " + layername
             layer_node.layer = layername
             layer_node.location = lowerloc + mathutils.Vector((0, -y_offset))
+            index.addNode(layer_node)
             rendernode = layer_node
 
         return rendernode
@@ -650,16 +538,10 @@ class Prism_BlenderMHExtension_Functions(object):
     # mute nodes if layer is disabled
     @err_catcher(name=__name__)
     def toggleLayerNodes(self, layername:str, toggle:bool)->None:
-        nodename = 'Prism_RL_' + layername
-        nodetree = bpy.context.scene.node_tree
-        rendernodes = [n for n in nodetree.nodes if n.type == 'R_LAYERS']
-        rendernode = None
-        for n in rendernodes:
-            if n.layer == layername:
-                if n.name == nodename:
-                    rendernode = n
+        index = self.getNodeIndex()
+        rendernode = index.getRLNode(layername)
         if rendernode:
-            layernodesdict:dict = self.getLayerOutNodes(layername)
+            layernodesdict:dict = index.getOutNodes(layername)
             for out_node in list(layernodesdict.values()):
                 if out_node:
                     out_node.mute = toggle
@@ -668,12 +550,48 @@ class Prism_BlenderMHExtension_Functions(object):
         if layername in self.getRenderLayers():
             bpy.context.scene.view_layers[layername].use = not toggle
 
+    @contextmanager
+    def layerRenderScope(self, layernames):
+        """
+        Render only the given view layers while the context runs: the other
+        view layers are disabled and their Prism nodes muted, as
+        toggleLayerNodes does for disabled states. Everything is restored
+        on exit.
+        """
+        viewLayers = bpy.context.scene.view_layers
+        index = self.getNodeIndex()
+        uses = {vl.name: vl.use for vl in viewLayers}
+        mutes = {}
+        for layername in uses:
+            nodes = [index.getRLNode(layername)] + list(index.getOutNodes(layername).values())
+            for node in nodes:
+                if node:
+                    mutes[node.name] = node.mute
+
+        try:
+            with self.nodeTreeOperation():
+                for layername in uses:
+                    self.toggleLayerNodes(layername, layername not in layernames)
+            yield
+        finally:
+            nodes = bpy.context.scene.node_tree.nodes
+            for name, mute in mutes.items():
+                node = nodes.get(name)
+                if node and node.mute != mute:
+                    node.mute = mute
+
+            for layername, use in uses.items():
+                if layername in viewLayers and viewLayers[layername].use != use:
+                    viewLayers[layername].use = use
+
     
     ##################################
     @err_catcher(name=__name__)
     def setUseNodes(self):
         # Ensure you're in the right context for the compositor
-        bpy.context.scene.use_nodes = True
+        # Only assigned when off, an assignment triggers a depsgraph update
+        if not bpy.context.scene.use_nodes:
+            bpy.context.scene.use_nodes = True
 
         # Access the compositor node tree
         node_tree = bpy.context.scene.node_tree
@@ -686,7 +604,13 @@ class Prism_BlenderMHExtension_Functions(object):
     ##FUNCION PRINCIPAL
     # !CallFromMHRendLayer
     @err_catcher(name=__name__)
-    def createOutputFromRL(self, layername, basepath = ""):
+    def createOutputFromRL(self, layername, basepath = "", outputMode=None, codec=None):
+        self.prepareCompositorTree()
+        # basepath is only used for new output nodes, existing paths are kept
+        self.reconcileLayerGraph(layername, newpath=basepath, outputMode=outputMode, codec=codec)
+
+    @err_catcher(name=__name__)
+    def prepareCompositorTree(self)->None:
         if not bpy.context.scene.use_nodes:
             bpy.context.scene.use_nodes = True
             nodetree = bpy.context.scene.node_tree
@@ -696,44 +620,469 @@ class Prism_BlenderMHExtension_Functions(object):
                 if defaultNode.type == 'R_LAYERS':
                     if defaultNode.name == 'Render Layers':
                         nodetree.nodes.remove(defaultNode)
-        
-        nodetree = bpy.context.scene.node_tree
-        n = self.getRLNode(layername)
-        if n.type == 'R_LAYERS':
-            in_node = n
-            allpath = basepath
-            out_node = self.get_MainOutode(allpath, layername)
-            enabled_passes = [p for p in in_node.outputs if p.enabled]
-            passes_by_name = [p.name for p in enabled_passes]
-            techEnabled = self.checkTechPasses(enabled_passes)
-            cryptoOEnabled = self.hasCryptoObj(passes_by_name)
-            cryptoMEnabled = self.hasCryptoMat(passes_by_name)
-            cryptoAEnabled = self.hasCryptoAsset(passes_by_name)
-            ##Checar si hay nodos que cuenten como TechPasses
-            if techEnabled:
-                out_node_tech = self.get_TecOuthNode(allpath, layername)
-            #Checar los Cryptomattes
-            if cryptoOEnabled or cryptoMEnabled or cryptoAEnabled:
-                out_node_Crypto = self.get_CryptoOutNode(allpath, layername)    
-
-            ##Hacer las conexiones
-            for o in enabled_passes:
-                if self.compareTechPass(o.name):
-                    self.connectNodes(nodetree, layername, o, out_node_tech)
-                elif self.isCryptoPass(o.name):
-                    self.make_CryptoConnections(nodetree, layername, o, out_node_Crypto)
+
+    @err_catcher(name=__name__)
+    def getLayerOutputMode(self, layername)->str:
+        # The compositor tree is the reference, multilayer main/tech nodes mean "Multilayer EXR"
+        outNodes = self.getNodeIndex().getOutNodes(layername)
+        for key in ["main", "tech"]:
+            if outNodes[key] and outNodes[key].format.file_format == 'OPEN_EXR_MULTILAYER':
+                return "Multilayer EXR"
+
+        return "Separate Files"
+
+    @err_catcher(name=__name__)
+    def describeLayerGraph(self, layername, basepath=None, newpath="", outputMode=None, codec=None)->dict:
+        """
+        Describe the desired Prism compositor graph of a render layer: the
+        output nodes with their format and the slot and pass of every
+        enabled RL node output. Requires the Prism RL node of the layer.
+
+        Args:
+            layername: Render layer name
+            basepath: Base path of the output nodes, None leaves paths as they are
+            newpath: Base path of output nodes that have to be created
+            outputMode: "Separate Files" or "Multilayer EXR", None keeps the current mode
+            codec: EXR codec of the main and tech nodes, None or "Default" uses the output policy
+
+        Returns:
+            {"layer": layername, "outputs": {"main"|"tech"|"crypto": None or
+            {"name", "format", "depth", "color", "codec", "basePath", "newPath",
+            "slots": [(slotname, passname)]}}}, plus "<key>:<variant>" outputs
+            for the passes whose output policy differs from their node
+        """
+        if outputMode is None:
+            outputMode = self.getLayerOutputMode(layername)
+        multilayer = outputMode == "Multilayer EXR"
+        if codec == "Default":
+            codec = None
+
+        rlNode = self.getNodeIndex().getRLNode(layername)
+        padding = '#' * self.core.framePadding
+
+        # Default depth/codec of the main, tech and crypto nodes
+        nodePolicies = {}
+        for key in self.outNodeSettings:
+            depth, keyCodec = self.outputPolicy.getCategoryPolicy(key)
+            if codec and key != "crypto":
+                keyCodec = codec
+            nodePolicies[key] = (depth, keyCodec)
+
+        # {key: [(slotname, passname)]}, passes with another policy than their
+        # node go to a "<key>:<depth>bit[_<codec>]" variant node
+        slots = {"main": [], "tech": [], "crypto": []}
+        policies = dict(nodePolicies)
+        if rlNode:
+            for o in rlNode.outputs:
+                if not o.enabled:
+                    continue
+
+                passClass = self.passClasses.getPass(o.name)
+                if not passClass.outNode:
+                    continue
+
+                if multilayer or passClass.outNode == "crypto":
+                    # layers of a multilayer EXR are named like the pass
+                    slotname = o.name
                 else:
-                    self.connectNodes(nodetree, layername, o, out_node)
-                
-            # self.repositionLayerOutNodes(layername)
-            self.repositionRenderLayerNodes()
+                    slotname = passClass.slotTemplate.format(layer=layername, padding=padding)
+
+                key = passClass.outNode
+                depth, passCodec = self.outputPolicy.resolve(o.name, passClass.category)
+                if codec and key != "crypto":
+                    passCodec = codec
+                if (depth, passCodec) != nodePolicies[key]:
+                    key += ":%sbit" % depth + ("_" + passCodec if passCodec else "")
+                    policies[key] = (depth, passCodec)
+
+                slots.setdefault(key, []).append((slotname, o.name))
+
+        outputs = {}
+        for key, keySlots in slots.items():
+            if not keySlots:
+                outputs[key] = None
+                continue
+
+            base = key.partition(":")[0]
+            depth, keyCodec = policies[key]
+            outSpec = dict(
+                self.outNodeSettings[base],
+                name=getOutNodeName(layername, key),
+                depth=depth,
+                codec=keyCodec,
+                basePath=basepath,
+                newPath=newpath,
+                slots=keySlots,
+            )
+            if multilayer and base != "crypto":
+                outSpec["format"] = "OPEN_EXR_MULTILAYER"
+
+            # Same paths as setOutputsPaths assigns when publishing
+            outSpec["newPath"] = getOutNodeBasePath(newpath, layername, key, outSpec["format"], padding)
+            if basepath is not None:
+                outSpec["basePath"] = getOutNodeBasePath(basepath, layername, key, outSpec["format"], padding)
+
+            outputs[key] = outSpec
+
+        return {"layer": layername, "outputs": outputs}
+
+    @err_catcher(name=__name__)
+    def getRenderPixelCount(self)->int:
+        render = bpy.context.scene.render
+        scale = render.resolution_percentage / 100.0
+        return int(render.resolution_x * scale) * int(render.resolution_y * scale)
+
+    @err_catcher(name=__name__)
+    def getLayerStorageReport(self, layername, outputMode=None, codec=None)->list:
+        """
+        Estimate what the Prism output nodes of a layer write per frame.
+
+        Returns:
+            [{"layer", "node", "passes", "files", "depth", "codec",
+            "rawBytes", "estimatedBytes"}], one entry per output node.
+            estimatedBytes applies a typical compression ratio of the codec.
+        """
+        rlNode = self.getNodeIndex().getRLNode(layername)
+        if not rlNode:
+            return []
+
+        spec = self.describeLayerGraph(layername, outputMode=outputMode, codec=codec)
+        return self.getSpecStorageRows(rlNode, spec, self.getRenderPixelCount())
+
+    def getSpecStorageRows(self, rlNode, spec, pixels)->list:
+        sockets = {o.name: o for o in rlNode.outputs if o.enabled}
+        rows = []
+        for key, outSpec in spec["outputs"].items():
+            if not outSpec:
+                continue
+
+            bytesPerChannel = 4 if outSpec["depth"] == "32" else 2
+            rawBytes = 0
+            for slotname, passname in outSpec["slots"]:
+                rawBytes += pixels * getSocketChannels(sockets[passname]) * bytesPerChannel
+
+            rows.append({
+                "layer": spec["layer"],
+                "node": outSpec["name"],
+                "passes": len(outSpec["slots"]),
+                "files": 1 if outSpec["format"] == "OPEN_EXR_MULTILAYER" else len(outSpec["slots"]),
+                "depth": outSpec["depth"],
+                "codec": outSpec["codec"] or "Default",
+                "rawBytes": rawBytes,
+                "estimatedBytes": self.outputPolicy.estimateCompressedBytes(rawBytes, outSpec["codec"]),
+            })
+
+        return rows
+
+    @err_catcher(name=__name__)
+    def estimateLayerOutputIO(self, layername, outputMode=None, codec=None)->dict:
+        """
+        Estimate the files and bytes written per frame by the Prism output
+        nodes of a layer in the given output mode.
+
+        Returns:
+            {"files": int, "bytes": int (uncompressed), "estimatedBytes": int}
+        """
+        rows = self.getLayerStorageReport(layername, outputMode=outputMode, codec=codec)
+        return {
+            "files": sum(r["files"] for r in rows),
+            "bytes": sum(r["rawBytes"] for r in rows),
+            "estimatedBytes": sum(r["estimatedBytes"] for r in rows),
+        }
+
+    @err_catcher(name=__name__)
+    def getStorageReport(self, layerOptions=None)->dict:
+        """
+        Storage and throughput estimate of several layers before rendering.
+
+        Args:
+            layerOptions: {layername: {"outputMode": ..., "codec": ...}}, defaults to all view layers
+
+        Returns:
+            {"rows": [...], "files", "rawBytes", "estimatedBytes" per frame, "frames", "sequenceBytes"}
+        """
+        if layerOptions is None:
+            layerOptions = {layername: {} for layername in self.getRenderLayers()}
+
+        rows = []
+        with self.nodeTreeOperation():
+            for layername, options in layerOptions.items():
+                rows += self.getLayerStorageReport(layername, **options)
+
+        scene = bpy.context.scene
+        frames = scene.frame_end - scene.frame_start + 1
+        estimatedBytes = sum(r["estimatedBytes"] for r in rows)
+        return {
+            "rows": rows,
+            "files": sum(r["files"] for r in rows),
+            "rawBytes": sum(r["rawBytes"] for r in rows),
+            "estimatedBytes": estimatedBytes,
+            "frames": frames,
+            "sequenceBytes": estimatedBytes * frames,
+        }
+
+    @err_catcher(name=__name__)
+    def formatStorageReport(self, report)->str:
+        mb = 1024.0 * 1024.0
+        lines = []
+        for r in report["rows"]:
+            lines.append(
+                "%s: %s passes, %s files, %s bit %s, %.1f MB (%.1f MB raw)"
+                % (r["node"].replace("Prism_OUT_", ""), r["passes"], r["files"], r["depth"], r["codec"], r["estimatedBytes"] / mb, r["rawBytes"] / mb)
+            )
+
+        lines.append("")
+        lines.append("Per frame: %s files, ~%.1f MB (%.1f MB uncompressed)" % (report["files"], report["estimatedBytes"] / mb, report["rawBytes"] / mb))
+        lines.append("Scene range (%s frames): ~%.2f GB" % (report["frames"], report["sequenceBytes"] / mb / 1024.0))
+        return "\n".join(lines)
+
+    @err_catcher(name=__name__)
+    def auditRenderPasses(self, layerOptions=None)->dict:
+        """
+        Inspect every view layer, enabled pass, Prism output node and slot of
+        the scene in one pass over the compositor tree, e.g. before a submit.
+
+        Args:
+            layerOptions: {layername: {"outputMode": ..., "codec": ...}} of the
+                layers rendered by Prism states, defaults to all view layers
+
+        Returns:
+            {
+                "layers": {layername: {
+                    "rendered": view layer renders (view_layer.use),
+                    "hasNodes": layer has Prism output nodes,
+                    "outNodes": [node names],
+                    "notConnected": [enabled passes not linked to any Prism output],
+                    "disabledConnected": [Prism slots linked from a disabled pass],
+                    "unlinkedSlots": [Prism slots without input],
+                    "pendingOps": number of graph operations to bring the nodes up to date,
+                    "files", "rawBytes", "estimatedBytes": per frame,
+                }},
+                "missingNodes": [rendered layers without Prism output nodes],
+                "files", "rawBytes", "estimatedBytes": per frame, all layers,
+            }
+        """
+        scene = bpy.context.scene
+        viewLayers = scene.view_layers
+        if layerOptions is None:
+            layerOptions = {layer.name: {} for layer in viewLayers}
+
+        pixels = self.getRenderPixelCount()
+        audit = {"layers": {}, "missingNodes": [], "files": 0, "rawBytes": 0, "estimatedBytes": 0}
+        with self.nodeTreeOperation() as index:
+            # {(RL node name, socket name)} linked to a Prism output node
+            linked = set()
+            if index.nodetree is not None:
+                for link in index.nodetree.links:
+                    if link.to_node.type == "OUTPUT_FILE" and link.to_node.name.startswith("Prism_OUT_"):
+                        linked.add((link.from_node.name, link.from_socket.name))
+
+            for layername, options in layerOptions.items():
+                if layername not in viewLayers:
+                    logger.warning("render layer doesn't exist: %s" % layername)
+                    continue
+
+                rlNode = index.getRLNode(layername)
+                outNodes = [n for n in index.getOutNodes(layername).values() if n]
+                info = {
+                    "rendered": viewLayers[layername].use,
+                    "hasNodes": bool(outNodes),
+                    "outNodes": [n.name for n in outNodes],
+                    "notConnected": [],
+                    "disabledConnected": [],
+                    "unlinkedSlots": [],
+                    "pendingOps": 0,
+                    "files": 0,
+                    "rawBytes": 0,
+                    "estimatedBytes": 0,
+                }
+                audit["layers"][layername] = info
+                if info["rendered"] and not outNodes:
+                    audit["missingNodes"].append(layername)
+
+                if not rlNode:
+                    continue
+
+                for o in rlNode.outputs:
+                    isLinked = (rlNode.name, o.name) in linked
+                    if o.enabled and not isLinked and self.passClasses.getPass(o.name).outNode:
+                        info["notConnected"].append(o.name)
+                    elif not o.enabled and isLinked:
+                        info["disabledConnected"].append(o.name)
+
+                for node in outNodes:
+                    info["unlinkedSlots"] += [i.name for i in node.inputs if not i.is_linked]
+
+                spec = self.describeLayerGraph(layername, **options)
+                info["pendingOps"] = len(diffLayerGraph(index, spec))
+                for row in self.getSpecStorageRows(rlNode, spec, pixels):
+                    for key in ("files", "rawBytes", "estimatedBytes"):
+                        info[key] += row[key]
+                        audit[key] += row[key]
+
+        return audit
+
+    @err_catcher(name=__name__)
+    def formatRenderPassAudit(self, audit)->str:
+        mb = 1024.0 * 1024.0
+        lines = []
+        for layername, info in audit["layers"].items():
+            issues = []
+            if layername in audit["missingNodes"]:
+                issues.append("no output nodes")
+            if info["notConnected"]:
+                issues.append("not connected: " + ", ".join(info["notConnected"]))
+            if info["disabledConnected"]:
+                issues.append("disabled but connected: " + ", ".join(info["disabledConnected"]))
+            if info["unlinkedSlots"]:
+                issues.append("%s unlinked slots" % len(info["unlinkedSlots"]))
+            if info["pendingOps"]:
+                issues.append("nodes out of date (%s changes)" % info["pendingOps"])
+
+            lines.append(
+                "%s: %s files, ~%.1f MB per frame%s"
+                % (layername, info["files"], info["estimatedBytes"] / mb, (" - " + "; ".join(issues)) if issues else "")
+            )
+
+        lines.append("")
+        lines.append("Per frame: %s files, ~%.1f MB (%.1f MB uncompressed)" % (audit["files"], audit["estimatedBytes"] / mb, audit["rawBytes"] / mb))
+        return "\n".join(lines)
+
+    @err_catcher(name=__name__)
+    def validateLayerGraph(self, layername)->list:
+        # Operations needed to bring the layer nodes up to date, [] when they are
+        index = self.getNodeIndex()
+        return diffLayerGraph(index, self.describeLayerGraph(layername))
+
+    @err_catcher(name=__name__)
+    def reconcileLayerGraph(self, layername, basepath=None, create=True, relayout=True, newpath=None, outputMode=None, codec=None)->list:
+        """
+        Bring the Prism nodes of a render layer to the described graph,
+        touching only what differs. Returns the applied operations.
+
+        Args:
+            layername: Render layer name
+            basepath: Base path enforced on the output nodes, None keeps existing paths
+            create: Create the RL node if the layer has none
+            relayout: Reposition the Prism nodes if nodes were added, removed or resized
+            newpath: Base path of newly created output nodes, defaults to basepath
+            outputMode: "Separate Files" or "Multilayer EXR", None keeps the current mode
+            codec: EXR codec of the main and tech nodes, None keeps it
+        """
+        with self.nodeTreeOperation() as index:
+            if index.getRLNode(layername) is None:
+                if not create:
+                    return []
+
+                self.getRLNode(layername)
+                ops = [("createRL",)]
+            else:
+                ops = []
+
+            if newpath is None:
+                newpath = basepath or ""
+            spec = self.describeLayerGraph(layername, basepath, newpath=newpath, outputMode=outputMode, codec=codec)
+            layerOps = diffLayerGraph(index, spec)
+            self.applyLayerGraphDiff(layername, spec, layerOps)
+            ops += layerOps
+            if relayout and needsLayout(ops):
+                index.layoutDirty = True
+
+        return ops
+
+    @err_catcher(name=__name__)
+    def applyLayerGraphDiff(self, layername, spec, ops)->None:
+        nodetree = bpy.context.scene.node_tree
+        index = self.getNodeIndex()
+        sockets = {o.name: o for o in index.getRLNode(layername).outputs if o.enabled}
+        outNodes = index.getOutNodes(layername)
+        for op in ops:
+            action, key = op[0], op[1]
+            outSpec = spec["outputs"].get(key)
+            node = outNodes.get(key)
+            if action == "createOut":
+                path = outSpec["basePath"]
+                if path is None:
+                    path = outSpec["newPath"]
+
+                node = nodetree.nodes.new(type='CompositorNodeOutputFile')
+                node = self.setUpOutNode(node, path, outSpec["name"], outSpec["depth"], outSpec["color"], outSpec["format"])
+                node.format.exr_codec = outSpec["codec"] or DEFAULT_EXR_CODEC
+                index.addNode(node)
+                outNodes[key] = node
+            elif action == "removeOut":
+                index.removeNode(node)
+                outNodes[key] = None
+            elif action == "setFormat":
+                setattr(node.format, op[2], op[3])
+            elif action == "setBasePath":
+                node.base_path = op[2]
+            elif action == "addSlot":
+                node.file_slots.new(op[2])
+            elif action == "removeSlot":
+                node.inputs.remove(node.inputs[op[2]])
+            elif action == "link":
+                nodetree.links.new(sockets[op[2]], node.inputs[op[3]])
+
+    # !CallFromMHRender
+    @err_catcher(name=__name__)
+    def setupLayersOutputs(self, layernames=None, basepath="", layerOptions=None)->dict:
+        """
+        Create or update the RL node, output nodes, slots and links of
+        several render layers in one pass over the compositor tree. Output
+        nodes without passes are removed and the layout is computed once at
+        the end, only if nodes were added, removed or resized.
+
+        Args:
+            layernames: Render layers to set up, defaults to all view layers
+            basepath: Base path of the new output nodes
+            layerOptions: Optional {layername: {"outputMode": ..., "codec": ...}}
+
+        Returns:
+            Dict with the names of the "created", "reused" and "removed" nodes
+        """
+        existingLayers = self.getRenderLayers()
+        if layernames is None:
+            layernames = existingLayers
+
+        result = {"created": [], "reused": [], "removed": []}
+        self.prepareCompositorTree()
+        with self.nodeTreeOperation() as index:
+            before = set(index.nodes)
+            for layername in layernames:
+                if layername not in existingLayers:
+                    logger.warning("render layer doesn't exist: %s" % layername)
+                    continue
+
+                outNames = {k: n.name for k, n in index.getOutNodes(layername).items() if n}
+                options = (layerOptions or {}).get(layername, {})
+                ops = self.reconcileLayerGraph(layername, newpath=basepath, **options)
+                for op in ops:
+                    if op[0] == "removeOut":
+                        result["removed"].append(outNames[op[1]])
+
+                layerNodes = [index.getRLNode(layername)] + list(index.getOutNodes(layername).values())
+                for node in layerNodes:
+                    if not node:
+                        continue
+
+                    if node.name in before:
+                        result["reused"].append(node.name)
+                    else:
+                        result["created"].append(node.name)
+
+        logger.debug(
+            "set up %s layers: %s nodes created, %s reused, %s removed"
+            % (len(layernames), len(result["created"]), len(result["reused"]), len(result["removed"]))
+        )
+        return result
 
     ###########################
 
     ######___FUNCIONES_PATH___######
     # !CallFromMHRendLayer
     @err_catcher(name=__name__)
-    def setOutputsPaths(self, layername, basepath):
+    def setOutputsPaths(self, layername, basepath, transaction=None):
         nodetree = bpy.context.scene.node_tree        
         framepadding = self.core.framePadding
         padding_string = str('#' * framepadding)
@@ -742,11 +1091,14 @@ class Prism_BlenderMHExtension_Functions(object):
             node = value
             if node and node.type == 'OUTPUT_FILE':
                 # Remove the AOV beauty from the base path
-                allpath = os.path.dirname(os.path.normpath(basepath + "\\"))
-                if key == 'crypto':
-                    allpath = os.path.normpath(os.path.join(allpath, layername + "_Cryptomatte", layername + "_CryptoMatte." + padding_string + ".exr"))
+                folder = os.path.dirname(os.path.normpath(basepath + "\\"))
+                allpath = getOutNodeBasePath(folder, layername, key, node.format.file_format, padding_string)
 
-                node.base_path = allpath
+                # Only touch nodes whose path actually changes
+                if transaction:
+                    transaction.setAttr(node, "base_path", allpath)
+                elif node.base_path != allpath:
+                    node.base_path = allpath
 
 
     ###########################
@@ -758,23 +1110,8 @@ class Prism_BlenderMHExtension_Functions(object):
   
     @err_catcher(name=__name__)
     def getLayerOutNodes(self, layername) -> dict:
-        nodetree = bpy.context.scene.node_tree
-        outnodes = {
-            'main':None,
-            'tech':None,
-            'crypto':None,
-            }
-        nodename = 'Prism_OUT_' + layername + '_MainPasses'
-        if self.nodeNameExists(nodename):
-            outnodes['main'] = nodetree.nodes[nodename]
-        nodename = 'Prism_OUT_' + layername + '_TechPasses'
-        if self.nodeNameExists(nodename):
-            outnodes['tech'] = nodetree.nodes[nodename]
-        nodename = 'Prism_OUT_' + layername + '_CryptoMatte'
-        if self.nodeNameExists(nodename):
-            outnodes['crypto'] = nodetree.nodes[nodename]
-
-        return outnodes
+        # {'main': node or None, 'tech': node or None, 'crypto': node or None}
+        return self.getNodeIndex().getOutNodes(layername)
 
 
     ######################################
@@ -782,36 +1119,244 @@ class Prism_BlenderMHExtension_Functions(object):
     #######   MHRenderFunctions   ########
     #                                    #
     ######################################
+    @err_catcher(name=__name__)
+    def createVersionAllocator(self):
+        # One allocator per publish, versions are computed from its snapshot of the render roots
+        return MHVersionAllocator(self.core)
+
+    @err_catcher(name=__name__)
+    def createPublishTransaction(self, name=""):
+        return MHPublishTransaction(name)
+
+    @err_catcher(name=__name__)
+    def saveRenderSceneCopy(self, name=None)->str:
+        """
+        Save a copy of the current scene, with the render settings of the
+        publish applied, for background render processes. The open scene
+        keeps its file path and unsaved state.
+        """
+        folder = os.path.join(tempfile.gettempdir(), "PrismMHRender")
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        if not name:
+            name = os.path.splitext(os.path.basename(bpy.data.filepath))[0] or "untitled"
+        path = os.path.join(folder, "%s_%s.blend" % (name, time.strftime("%Y%m%d_%H%M%S")))
+        bpy.ops.wm.save_as_mainfile(filepath=path, copy=True, relative_remap=True)
+        return path
+
+    @err_catcher(name=__name__)
+    def getLayerOutputTemplates(self, layername, folder=None)->list:
+        """
+        Return the absolute file path templates (with "#") the Prism output
+        nodes of a layer write, or would write with their paths set to the
+        version folder.
+        """
+        templates = []
+        for key, node in self.getLayerOutNodes(layername).items():
+            if not node or node.mute:
+                continue
+
+            basePath = node.base_path
+            if folder:
+                basePath = getOutNodeBasePath(folder, layername, key, node.format.file_format, "#" * self.core.framePadding)
+
+            if node.format.file_format == "OPEN_EXR_MULTILAYER":
+                templates.append(bpy.path.abspath(basePath))
+            else:
+                for slot in node.file_slots:
+                    templates.append(bpy.path.abspath(os.path.join(basePath, slot.path)))
+
+        return templates
+
+    def resolveFramePath(self, template, frame)->str:
+        # Blender replaces the last run of "#" with the padded frame, or appends 4 digits
+        hashes = re.findall(r"#+", template)
+        if hashes:
+            run = hashes[-1]
+            idx = template.rfind(run)
+            path = template[:idx] + str(frame).zfill(len(run)) + template[idx + len(run):]
+        else:
+            path = template + str(frame).zfill(4)
+
+        if not path.lower().endswith(".exr"):
+            path += ".exr"
+
+        return os.path.normpath(path)
+
+    @err_catcher(name=__name__)
+    def getLayerFrameFiles(self, layername, frame)->list:
+        """Return the files the Prism output nodes of a layer write for a frame."""
+        return [self.resolveFramePath(t, frame) for t in self.getLayerOutputTemplates(layername)]
+
+    @err_catcher(name=__name__)
+    def scanRenderedFrames(self, layernames, frames, checkHeader=True, folders=None)->set:
+        """
+        Return the frames for which every file of the Prism output nodes of
+        the layers exists, isn't empty and, with checkHeader, starts with the
+        EXR magic number. Each output folder is listed once.
+        folders ({layername: version folder}) scans other versions than the
+        ones the nodes point to.
+        """
+        folders = folders or {}
+        with self.nodeTreeOperation():
+            templates = []
+            for layername in layernames:
+                templates += self.getLayerOutputTemplates(layername, folder=folders.get(layername))
+
+        if not templates:
+            return set()
+
+        # {folder: {normcased file name: size}}
+        listings = {}
+        complete = set()
+        for frame in frames:
+            for template in templates:
+                path = self.resolveFramePath(template, frame)
+                folder, filename = os.path.split(path)
+                if folder not in listings:
+                    listings[folder] = self.getFolderFileSizes(folder)
+
+                if not listings[folder].get(os.path.normcase(filename)):
+                    break
+
+                if checkHeader and not self.hasExrHeader(path):
+                    break
+            else:
+                complete.add(frame)
+
+        return complete
+
+    def getFolderFileSizes(self, folder)->dict:
+        try:
+            return {os.path.normcase(e.name): e.stat().st_size for e in os.scandir(folder) if e.is_file()}
+        except OSError:
+            return {}
+
+    def hasExrHeader(self, path)->bool:
+        try:
+            with open(path, "rb") as f:
+                return f.read(4) == b"\x76\x2f\x31\x01"
+        except OSError:
+            return False
+
+    @err_catcher(name=__name__)
+    def isFrameRendered(self, layernames, frame)->bool:
+        return frame in self.scanRenderedFrames(layernames, [frame])
+
+    @err_catcher(name=__name__)
+    def formatFrameExpression(self, frames)->str:
+        """Return the shortest Prism frame expression for the frames, e.g. "1001-1010,1015"."""
+        return ",".join(str(a) if a == b else "%s-%s" % (a, b) for a, b in getFrameRanges(frames))
+
+    @err_catcher(name=__name__)
+    def createLocalRenderScheduler(self, scenePath, frames, chunkSize=10, workers=2, isFrameDone=None)->MHLocalRenderScheduler:
+        return MHLocalRenderScheduler(
+            bpy.app.binary_path, scenePath, frames, chunkSize=chunkSize, workers=workers, isFrameDone=isFrameDone
+        )
+
+    @err_catcher(name=__name__)
+    def createFarmJobGraph(self, jobName, layernames, frames, framesPerTask=1, masterJob=True)->list:
+        return buildLayerJobGraph(jobName, layernames, frames, framesPerTask=framesPerTask, masterJob=masterJob)
+
+    def useFarmStandIn(self)->bool:
+        # The stand-in manager is offered when enabled for the project or with PRISM_MH_FARM_STANDIN=1
+        if os.getenv("PRISM_MH_FARM_STANDIN") == "1":
+            return True
+
+        return bool(self.core.getConfig("MHExtension", "farmStandIn", config="project"))
+
+    @err_catcher(name=__name__)
+    def createLocalFarmManager(self, runners=None)->MHLocalFarmManager:
+        return MHLocalFarmManager(runners)
+
+    @err_catcher(name=__name__)
+    def createPrismFarmManager(self, plugin, submitLayer)->MHPrismFarmManager:
+        return MHPrismFarmManager(plugin, submitLayer)
+
     @err_catcher(name=__name__)
     def sm_render_preSubmit(self, origin, rSettings):
+        resolution = None
         if origin.chb_resOverride.isChecked():
-            rSettings["width"] = bpy.context.scene.render.resolution_x
-            rSettings["height"] = bpy.context.scene.render.resolution_y
-            bpy.context.scene.render.resolution_x = origin.sp_resWidth.value()
-            bpy.context.scene.render.resolution_y = origin.sp_resHeight.value()
+            resolution = [origin.sp_resWidth.value(), origin.sp_resHeight.value()]
+
+        self.applyRenderOutputSettings(rSettings, origin.curCam, origin.cb_format.currentText(), resolution=resolution)
 
-        imgFormat = origin.cb_format.currentText()        
+    @err_catcher(name=__name__)
+    def applyRenderOutputSettings(self, rSettings, camera, extension, resolution=None):
+        """Set the output path, format, camera and resolution of the render, keeping the previous values in rSettings."""
+        scene = bpy.context.scene
+        if resolution:
+            rSettings["width"] = scene.render.resolution_x
+            rSettings["height"] = scene.render.resolution_y
+            scene.render.resolution_x = int(resolution[0])
+            scene.render.resolution_y = int(resolution[1])
+
+        imgFormat = extension
         if imgFormat == ".jpg":
             fileFormat = "JPEG"
 
-        rSettings["prev_start"] = bpy.context.scene.frame_start
-        rSettings["prev_end"] = bpy.context.scene.frame_end
-        rSettings["fileformat"] = bpy.context.scene.render.image_settings.file_format
-        rSettings["overwrite"] = bpy.context.scene.render.use_overwrite
-        rSettings["fileextension"] = bpy.context.scene.render.use_file_extension
-        rSettings["resolutionpercent"] = bpy.context.scene.render.resolution_percentage
+        rSettings["prev_start"] = scene.frame_start
+        rSettings["prev_end"] = scene.frame_end
+        rSettings["fileformat"] = scene.render.image_settings.file_format
+        rSettings["overwrite"] = scene.render.use_overwrite
+        rSettings["fileextension"] = scene.render.use_file_extension
+        rSettings["resolutionpercent"] = scene.render.resolution_percentage
         rSettings["origOutputName"] = rSettings["outputName"]
-        bpy.context.scene["PrismIsRendering"] = True
-        bpy.context.scene.render.filepath = rSettings["outputName"]
-        bpy.context.scene.render.image_settings.file_format = fileFormat
-        bpy.context.scene.render.use_overwrite = True
-        bpy.context.scene.render.use_file_extension = False
-        bpy.context.scene.render.resolution_percentage = 100
-        bpy.context.scene.camera = bpy.context.scene.objects[origin.curCam]
+        scene["PrismIsRendering"] = True
+        scene.render.filepath = rSettings["outputName"]
+        scene.render.image_settings.file_format = fileFormat
+        scene.render.use_overwrite = True
+        scene.render.use_file_extension = False
+        scene.render.resolution_percentage = 100
+        scene.camera = scene.objects[camera]
 
         if not os.path.exists(os.path.dirname(rSettings["outputName"])):
             os.makedirs(os.path.dirname(rSettings["outputName"]))
 
+    @err_catcher(name=__name__)
+    def restoreRenderSettings(self, rSettings):
+        # Counterpart of applyRenderOutputSettings for renders without the State Manager
+        scene = bpy.context.scene
+        if "width" in rSettings:
+            scene.render.resolution_x = rSettings["width"]
+            scene.render.resolution_y = rSettings["height"]
+
+        if "prev_start" in rSettings:
+            scene.frame_start = rSettings["prev_start"]
+            scene.frame_end = rSettings["prev_end"]
+
+        if "fileformat" in rSettings:
+            scene.render.image_settings.file_format = rSettings["fileformat"]
+            scene.render.use_overwrite = rSettings["overwrite"]
+            scene.render.use_file_extension = rSettings["fileextension"]
+            scene.render.resolution_percentage = rSettings["resolutionpercent"]
+
+        scene["PrismIsRendering"] = False
+
+    @err_catcher(name=__name__)
+    def renderFrames(self, frames):
+        """Render frames in this Blender session, one animation render per consecutive range."""
+        scene = bpy.context.scene
+        try:
+            for startFrame, endFrame in getFrameRanges(frames):
+                scene.frame_start = startFrame
+                scene.frame_end = endFrame
+                bpy.ops.render.render(animation=True)
+        except Exception as e:
+            return "render failed: %s" % e
+
+        return "Result=Success"
+
+    @err_catcher(name=__name__)
+    def createRenderPublisher(self, renderProps, layers, comment="", hooks=None)->MHRenderPublisher:
+        return MHRenderPublisher(self.core, self, renderProps, layers, comment=comment, hooks=hooks)
+
+    @err_catcher(name=__name__)
+    def createBatchPublishRunner(self, scenes, workers=2, comment="", **kwargs)->MHBatchPublishRunner:
+        # The scenes are published with the Blender that is running
+        return MHBatchPublishRunner(bpy.app.binary_path, scenes, workers=workers, comment=comment, **kwargs)
+
 
     ######################################
     #                                    #
@@ -822,24 +1367,26 @@ class Prism_BlenderMHExtension_Functions(object):
     @err_catcher(name=__name__)
     def onStateDeleted(self, stateManager, state, *args, **kwargs)->None:
         if state.className == "MHrendLayer":
+            state.disconnectStateManager()
             layername = state.cb_renderLayer.currentText()
-            try:
-                rlnode = bpy.context.scene.node_tree.nodes['Prism_RL_' + layername]
-            except:
-                rlnode = None
+            if bpy.context.scene.node_tree is None:
+                return
+
+            rlnode = bpy.context.scene.node_tree.nodes.get('Prism_RL_' + layername)
             if rlnode:
                 message = f"Delete nodes asociated with this Layer?"
                 result = self.core.popupQuestion(
                     message,
                     title="Create new Layer?",
                 )
-                if result == "Yes":                    
-                    layernodesdict:dict = self.getLayerOutNodes(layername)
-                    for l in list(layernodesdict.values()):
-                        if l:
-                            bpy.context.scene.node_tree.nodes.remove(l)
-                    bpy.context.scene.node_tree.nodes.remove(rlnode)
-                    self.repositionRenderLayerNodes()
+                if result == "Yes":
+                    with self.nodeTreeOperation() as index:
+                        layernodesdict:dict = index.getOutNodes(layername)
+                        for l in list(layernodesdict.values()):
+                            if l:
+                                index.removeNode(l)
+                        index.removeNode(rlnode)
+                        self.repositionRenderLayerNodes()
             
     ##########################################
     #                                        #
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+# MH Extension - Compositor layout
+# Positions of the Prism render layer and output nodes, computed in one pass
+# over the node tree index.
+#
+
+import logging
+
+import mathutils
+
+logger = logging.getLogger(__name__)
+
+# Node heights are estimated from the socket count, node.dimensions is only
+# valid after the node editor has drawn the node.
+RL_BASE_HEIGHT = 79.0
+RL_BUFFER = 100.0
+OUT_BASE_HEIGHT = 75.27
+SOCKET_HEIGHT = 22.0
+OUT_X_GAP = 240.0
+
+# Top to bottom order of the output nodes next to their RL node, variants last
+OUT_ORDER = ("tech", "main", "crypto")
+
+# Graph operations (see Prism_BlenderMHExtension_Compositor.diffLayerGraph)
+# that change the size or number of nodes. Links, paths and formats don't.
+STRUCTURAL_OPS = frozenset(["createRL", "createOut", "removeOut", "addSlot", "removeSlot"])
+
+
+def needsLayout(ops):
+    return any(op[0] in STRUCTURAL_OPS for op in ops)
+
+
+def getRLNodeHeight(node):
+    outputs = sum(1 for o in node.outputs if o.enabled)
+    return RL_BASE_HEIGHT + RL_BUFFER + outputs * SOCKET_HEIGHT
+
+
+def getOutNodeHeight(node):
+    return OUT_BASE_HEIGHT + len(node.inputs) * SOCKET_HEIGHT
+
+
+def sortOutKeys(keys):
+    return [k for k in OUT_ORDER if k in keys] + sorted(k for k in keys if k not in OUT_ORDER)
+
+
+def computeLayout(index):
+    """
+    Return {node name: (x, y)} for all Prism RL nodes and their output nodes.
+
+    The RL nodes keep their top to bottom order and are stacked under the
+    topmost one, each layer taking the height of its RL node or of its
+    stacked output nodes, whichever is taller. Every node is visited once.
+    """
+    rlNodes = sorted(index.getPrismRLNodes(), key=lambda n: n.location.y, reverse=True)
+    if not rlNodes:
+        return {}
+
+    positions = {}
+    x = rlNodes[0].location.x
+    y = rlNodes[0].location.y
+    for rlNode in rlNodes:
+        positions[rlNode.name] = (x, y)
+        outX = x + rlNode.width + OUT_X_GAP
+        outNodes = {k: n for k, n in index.getOutNodes(rlNode.layer).items() if n is not None}
+        outHeight = 0.0
+        for key in sortOutKeys(outNodes):
+            node = outNodes[key]
+            positions[node.name] = (outX, y - outHeight)
+            outHeight += getOutNodeHeight(node)
+
+        y -= max(outHeight, getRLNodeHeight(rlNode))
+
+    return positions
+
+
+def applyLayout(index, positions):
+    """Move the nodes whose position changed. Returns the number of moved nodes."""
+    moved = 0
+    for name, (x, y) in positions.items():
+        node = index.getNode(name)
+        if node is None:
+            continue
+
+        if node.location.x != x or node.location.y != y:
+            node.location = mathutils.Vector((x, y))
+            moved += 1
+
+    return moved
+
+
+def layoutNodeTree(index):
+    moved = applyLayout(index, computeLayout(index))
+    logger.debug("compositor layout: moved %s nodes" % moved)
+    return moved
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#
+# MH Extension - Local render scheduler
+# Renders a saved scene in frame chunks with several background Blender
+# processes.
+#
+
+import os
+import re
+import queue
+import logging
+import threading
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# Blender prints "Fra:<n> ..." while rendering a frame and "Time: ..." once it is saved
+FRAME_PATTERN = re.compile(r"^Fra:(\d+)\s")
+FRAME_DONE_PATTERN = re.compile(r"^\s*Time:\s")
+
+
+def getFrameRanges(frames):
+    """Return the consecutive runs of the frames as (first, last) tuples, e.g. [1, 2, 3, 7] -> [(1, 3), (7, 7)]."""
+    ranges = []
+    for frame in sorted(set(frames)):
+        if ranges and frame == ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], frame)
+        else:
+            ranges.append((frame, frame))
+
+    return ranges
+
+
+def formatFrameList(frames):
+    """Return a Blender -f argument for the frames, e.g. [1, 2, 3, 7] -> "1..3,7"."""
+    return ",".join(str(a) if a == b else "%s..%s" % (a, b) for a, b in getFrameRanges(frames))
+
+
+def splitFrameChunks(frames, chunkSize):
+    """Split the frames in chunks of at most chunkSize frames, keeping the frame order."""
+    frames = sorted(set(frames))
+    chunkSize = max(1, int(chunkSize))
+    return [frames[i:i + chunkSize] for i in range(0, len(frames), chunkSize)]
+
+
+class MHLocalRenderScheduler(object):
+    """
+    Renders frames of a saved .blend with N "blender -b" worker processes.
+
+    The frames are split in chunks that the workers pull from a queue, so
+    fast chunks don't wait on slow ones. Frames for which isFrameDone
+    returns True are skipped, which lets an interrupted render resume.
+    Each worker gets cpu_count / N render threads to avoid oversubscribing
+    the machine.
+
+        scheduler = MHLocalRenderScheduler(blender, scene, frames, workers=2)
+        scheduler.start()
+        while scheduler.isRunning():
+            progress = scheduler.getProgress()
+        result = scheduler.getResult()
+    """
+
+    def __init__(self, blenderPath, scenePath, frames, chunkSize=10, workers=2, isFrameDone=None, threadsPerWorker=None):
+        self.blenderPath = blenderPath
+        self.scenePath = scenePath
+        self.workers = max(1, int(workers))
+        if threadsPerWorker is None:
+            threadsPerWorker = max(1, (os.cpu_count() or 1) // self.workers)
+
+        self.threadsPerWorker = threadsPerWorker
+        frames = sorted(set(frames))
+        self.skippedFrames = [f for f in frames if isFrameDone and isFrameDone(f)]
+        skipped = set(self.skippedFrames)
+        self.frames = [f for f in frames if f not in skipped]
+        self.chunks = splitFrameChunks(self.frames, chunkSize)
+
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.threads = []
+        self.processes = []
+        self.doneFrames = set()
+        # [(chunk, returncode, last output lines)]
+        self.failedChunks = []
+        self.canceled = False
+
+    def getCommand(self, chunk):
+        return [
+            self.blenderPath,
+            "-b", self.scenePath,
+            "-t", str(self.threadsPerWorker),
+            "-f", formatFrameList(chunk),
+        ]
+
+    def start(self):
+        for chunk in self.chunks:
+            self.queue.put(chunk)
+
+        for idx in range(min(self.workers, len(self.chunks))):
+            thread = threading.Thread(target=self._work, name="MHLocalRender%s" % idx, daemon=True)
+            self.threads.append(thread)
+            thread.start()
+
+        logger.debug(
+            "local render: %s frames in %s chunks on %s workers, %s frames skipped"
+            % (len(self.frames), len(self.chunks), len(self.threads), len(self.skippedFrames))
+        )
+
+    def _work(self):
+        while not self.canceled:
+            try:
+                chunk = self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+            self._renderChunk(chunk)
+
+    def _renderChunk(self, chunk):
+        kwargs = {}
+        if os.name == "nt":
+            kwargs["creationflags"] = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+
+        try:
+            proc = subprocess.Popen(
+                self.getCommand(chunk),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True,
+                errors="replace",
+                **kwargs
+            )
+        except OSError as e:
+            with self.lock:
+                self.failedChunks.append((chunk, None, [str(e)]))
+            return
+
+        with self.lock:
+            self.processes.append(proc)
+
+        current = None
+        tail = []
+        for line in proc.stdout:
+            tail = (tail + [line.rstrip()])[-20:]
+            match = FRAME_PATTERN.match(line)
+            if match:
+                current = int(match.group(1))
+            elif current is not None and FRAME_DONE_PATTERN.match(line):
+                with self.lock:
+                    self.doneFrames.add(current)
+
+        proc.wait()
+        with self.lock:
+            self.processes.remove(proc)
+            if proc.returncode == 0 and not self.canceled:
+                self.doneFrames.update(chunk)
+            else:
+                self.failedChunks.append((chunk, proc.returncode, tail))
+
+    def isRunning(self):
+        return any(t.is_alive() for t in self.threads)
+
+    def wait(self, timeout=None):
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def cancel(self):
+        self.canceled = True
+        with self.lock:
+            processes = list(self.processes)
+
+        for proc in processes:
+            try:
+                proc.terminate()
+            except OSError:
+                pass
+
+    def getProgress(self):
+        """Return (rendered frames, frames to render)."""
+        with self.lock:
+            return len(self.doneFrames), len(self.frames)
+
+    def getResult(self):
+        """Return "Result=Success", "Execute Canceled: ..." or an error message, like the Prism render functions."""
+        if self.canceled:
+            return "Execute Canceled: %s of %s frames rendered" % self.getProgress()
+
+        if self.failedChunks:
+            lines = []
+            for chunk, returncode, tail in self.failedChunks:
+                lines.append("frames %s failed (exit code %s):" % (formatFrameList(chunk), returncode))
+                lines += tail[-5:]
+
+            return "\n".join(lines)
+
+        return "Result=Success"
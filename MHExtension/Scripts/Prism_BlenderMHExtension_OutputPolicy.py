@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+#
+# MH Extension - Output policy
+# Project configurable bit depth and EXR codec per pass category or pass name.
+#
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Built-in policy, matches the historical output nodes (16 bit main, 32 bit tech/crypto, default codec)
+DEFAULT_POLICY = {
+    "categories": {
+        "main": {"depth": "16", "codec": None},
+        "denoise": {"depth": "16", "codec": None},
+        "tech": {"depth": "32", "codec": None},
+        "crypto": {"depth": "32", "codec": None},
+    },
+    "passes": {},
+}
+
+LOSSLESS_CODECS = ("NONE", "ZIP", "ZIPS", "PIZ", "RLE")
+
+# Rough size of a compressed CG render relative to the raw pixels, used for estimates only
+CODEC_RATIOS = {
+    None: 0.5,
+    "NONE": 1.0,
+    "ZIP": 0.5,
+    "ZIPS": 0.55,
+    "PIZ": 0.45,
+    "RLE": 0.8,
+    "PXR24": 0.35,
+    "B44": 0.35,
+    "B44A": 0.35,
+    "DWAA": 0.15,
+    "DWAB": 0.15,
+}
+
+
+class MHOutputPolicy(object):
+    """
+    Resolves the bit depth and EXR codec of a render pass.
+
+    The policy is read from the project config, category "MHExtension",
+    key "outputPolicy":
+
+        {
+            "categories": {"main": {"depth": "16", "codec": "DWAA"}, "tech": {"codec": "ZIP"}},
+            "passes": {"Depth": {"depth": "32", "codec": "ZIP"}}
+        }
+
+    Pass entries win over category entries, missing values fall back to the
+    built-in policy. Cryptomatte passes are never given a lossy codec.
+    """
+
+    def __init__(self, core):
+        self.core = core
+        self.projectPath = None
+        self.policy = None
+
+    def getPolicy(self):
+        """Return the merged policy, reloaded when the current project changes."""
+        projectPath = getattr(self.core, "projectPath", None)
+        if self.policy is None or projectPath != self.projectPath:
+            self.projectPath = projectPath
+            self.policy = self.loadPolicy()
+
+        return self.policy
+
+    def loadPolicy(self):
+        policy = {
+            "categories": {k: dict(v) for k, v in DEFAULT_POLICY["categories"].items()},
+            "passes": {},
+        }
+        try:
+            projectPolicy = self.core.getConfig("MHExtension", "outputPolicy", config="project") or {}
+        except Exception as e:
+            logger.warning("Couldn't read the output policy from the project config: %s" % e)
+            projectPolicy = {}
+
+        for category, settings in (projectPolicy.get("categories") or {}).items():
+            policy["categories"].setdefault(category, {"depth": "16", "codec": None}).update(self.normalize(settings))
+
+        for passname, settings in (projectPolicy.get("passes") or {}).items():
+            policy["passes"][passname] = self.normalize(settings)
+
+        return policy
+
+    def normalize(self, settings):
+        result = {}
+        if settings.get("depth"):
+            result["depth"] = str(settings["depth"])
+        if "codec" in settings:
+            codec = settings["codec"]
+            result["codec"] = codec.upper() if codec and codec.lower() != "default" else None
+
+        return result
+
+    def invalidate(self):
+        self.policy = None
+
+    def getCategoryPolicy(self, category):
+        """Return (depth, codec) of a pass category."""
+        settings = self.getPolicy()["categories"].get(category) or DEFAULT_POLICY["categories"]["main"]
+        return settings.get("depth", "16"), settings.get("codec")
+
+    def resolve(self, passname, category):
+        """Return (depth, codec) for a render layer pass."""
+        depth, codec = self.getCategoryPolicy(category)
+        override = self.getPolicy()["passes"].get(passname)
+        if override:
+            depth = override.get("depth", depth)
+            codec = override.get("codec", codec)
+
+        if category == "crypto" and codec not in LOSSLESS_CODECS + (None,):
+            logger.debug("Ignoring lossy codec %s for cryptomatte pass %s" % (codec, passname))
+            codec = None
+
+        return depth, codec
+
+    def estimateCompressedBytes(self, rawBytes, codec):
+        return int(rawBytes * CODEC_RATIOS.get(codec, 0.5))
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# MH Extension - View layer property binder
+# Keeps the property checkboxes of the MHrendLayer states and the view layer
+# properties in sync without feedback writes.
+#
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MHLayerPropertyBinder(object):
+    """
+    Binds display names to view layer property paths, e.g.
+    {"Denoising": "cycles.use_denoising"}.
+
+    The paths are split once into (owner attribute, flag attribute). Owners
+    are resolved once per sync and never kept between calls, RNA pointers
+    of a view layer don't survive undo or file loads.
+
+    Values are only written when they differ: widgets are updated with their
+    signals blocked and Blender properties are compared before assignment,
+    so a sync doesn't trigger RNA updates or depsgraph evaluations.
+    """
+
+    def __init__(self, properties):
+        # [(name, owner attribute or "", flag attribute)]
+        self.accessors = []
+        for name, path in properties.items():
+            owner, _, attr = path.rpartition(".")
+            self.accessors.append((name, owner, attr))
+
+        self.accessorsByName = {a[0]: a for a in self.accessors}
+        self.owners = sorted(set(owner for _, owner, _ in self.accessors if owner))
+
+    def resolveOwners(self, viewLayer):
+        owners = {"": viewLayer}
+        for owner in self.owners:
+            obj = viewLayer
+            for attr in owner.split("."):
+                obj = getattr(obj, attr, None)
+                if obj is None:
+                    break
+
+            owners[owner] = obj
+
+        return owners
+
+    def readValues(self, viewLayer):
+        """Return {name: bool} of all bound properties available on the view layer."""
+        owners = self.resolveOwners(viewLayer)
+        values = {}
+        for name, owner, attr in self.accessors:
+            obj = owners[owner]
+            if obj is None or not hasattr(obj, attr):
+                continue
+
+            values[name] = bool(getattr(obj, attr))
+
+        return values
+
+    def syncWidgets(self, viewLayer, widgets):
+        """
+        Update checkboxes from the view layer without emitting their signals.
+
+        Args:
+            viewLayer: Blender view layer
+            widgets: {name: QCheckBox}
+
+        Returns:
+            Number of checkboxes that changed
+        """
+        changed = 0
+        for name, value in self.readValues(viewLayer).items():
+            widget = widgets.get(name)
+            if widget is None or widget.isChecked() == value:
+                continue
+
+            blocked = widget.blockSignals(True)
+            try:
+                widget.setChecked(value)
+            finally:
+                widget.blockSignals(blocked)
+
+            changed += 1
+
+        return changed
+
+    def pushValue(self, viewLayer, name, value):
+        """Write a property to the view layer if it differs. Returns True if it was written."""
+        accessor = self.accessorsByName.get(name)
+        if not accessor:
+            return False
+
+        _, owner, attr = accessor
+        obj = self.resolveOwners(viewLayer)[owner] if owner else viewLayer
+        if obj is None:
+            logger.debug("view layer property not available: %s" % name)
+            return False
+
+        if bool(getattr(obj, attr)) == bool(value):
+            return False
+
+        setattr(obj, attr, bool(value))
+        return True
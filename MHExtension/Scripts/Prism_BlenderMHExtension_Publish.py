@@ -0,0 +1,715 @@
+# -*- coding: utf-8 -*-
+#
+# MH Extension - Headless MHRender publish
+# The MHRender publish working on the settings dicts of the states
+# (getStateProps), without the State Manager widgets.
+#
+
+import os
+import platform
+import logging
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPE = "3drenders"
+
+
+def getBool(props, key, default=False):
+    # The states save booleans as "True"/"False"
+    value = props.get(key, default)
+    if isinstance(value, str):
+        return value == "True"
+
+    return bool(value)
+
+
+def isStateEnabled(props):
+    # stateenabled is the Qt check state value, 0 = unchecked
+    return props.get("stateenabled", 2) != 0
+
+
+class MHRenderPublisher(object):
+    """
+    Publishes an MHRender state and its MHrendLayer states from their
+    settings: allocates the layer versions, assigns the output node paths,
+    writes the version info, then renders or submits.
+
+    The MHRender and MHrendLayer states are adapters over it, a batch
+    publish uses it directly from a background Blender.
+
+    Args:
+        core: Prism core
+        functions: Prism_BlenderMHExtension_Functions
+        renderProps: getStateProps of the MHRender state
+        layers: getStateProps of the enabled MHrendLayer states
+        comment: Publish comment
+        hooks: Optional callables for the steps that need the State Manager:
+            state: State passed to the Prism callbacks and path generation
+            layerStates: {layer index: state} passed to the layer path generation
+            confirmMissingNodes(layernames) -> bool, continue with layers without nodes (default True)
+            onLayerApplied(index, path, transaction): a layer got a new output path
+            onOutputName(outputName, transaction): the render got its output path
+            applyRenderPreset(rSettings)
+            saveScene(): save the scene before rendering
+            submit(rSettings, details, handleMaster) -> result, farm submission
+            render(rSettings) -> result, local render (default renderLocal)
+            undoRenderSettings(rSettings) (default functions.restoreRenderSettings)
+    """
+
+    versionResolveThreads = 8
+
+    def __init__(self, core, functions, renderProps=None, layers=None, comment="", hooks=None):
+        self.core = core
+        self.functions = functions
+        self.renderProps = renderProps or {}
+        self.layers = list(layers or [])
+        self.comment = comment
+        self.hooks = hooks or {}
+        self.state = self.hooks.get("state")
+
+    def getContext(self, props=None):
+        """
+        Return the entity a state renders for: its custom context when the
+        state uses one (contextType "Custom"), else the entity of the scene
+        file, like the getCurrentContext of the states.
+
+        Args:
+            props: getStateProps of the state, the MHRender state by default
+        """
+        if props is None:
+            props = self.renderProps
+
+        context = None
+        if props.get("contextType") == "Custom":
+            context = props.get("customContext")
+
+        if not context:
+            context = self.core.getScenefileData(self.core.getCurrentFileName())
+
+        context = dict(context)
+        context.pop("username", None)
+        context.pop("user", None)
+        return context
+
+    def getFrameRange(self, props):
+        """Return (startFrame, endFrame) of the range type of the settings, or the frame list of an expression."""
+        rangeType = props.get("rangeType", "Scene")
+        startFrame = None
+        endFrame = None
+        if rangeType == "Scene":
+            if hasattr(self.core.appPlugin, "getFrameRange"):
+                startFrame, endFrame = self.core.appPlugin.getFrameRange(self.state)
+            else:
+                startFrame = 1001
+                endFrame = 1100
+        elif rangeType == "Shot":
+            context = self.getContext(props)
+            if context.get("type") == "shot" and "sequence" in context:
+                frange = self.core.entities.getShotRange(context)
+                if frange:
+                    startFrame, endFrame = frange
+        elif rangeType == "Single Frame":
+            if hasattr(self.core.appPlugin, "getCurrentFrame"):
+                startFrame = self.core.appPlugin.getCurrentFrame()
+            else:
+                startFrame = 1001
+        elif rangeType == "Custom":
+            startFrame = props.get("startframe")
+            endFrame = props.get("endframe")
+        elif rangeType == "Expression":
+            return self.core.resolveFrameExpression(props.get("frameExpression", ""))
+
+        startFrame = None if startFrame in [None, ""] else int(startFrame)
+        endFrame = None if endFrame in [None, ""] else int(endFrame)
+        return startFrame, endFrame
+
+    def getLayerOptions(self):
+        # {layername: output options} like MHRender.getLayerStatesOptions
+        layerOptions = {}
+        for props in self.layers:
+            layerOptions.setdefault(props.get("renderlayer", ""), {
+                "outputMode": props.get("outputmode"),
+                "codec": props.get("exrcodec"),
+            })
+
+        return layerOptions
+
+    def isUsingMasterVersion(self, masterAction):
+        if not self.core.mediaProducts.getUseMaster():
+            return False
+
+        return masterAction != "Don't update master"
+
+    def handleMasterVersion(self, masterAction, outputName):
+        if not self.isUsingMasterVersion(masterAction):
+            return
+
+        if masterAction == "Set as master":
+            self.core.mediaProducts.updateMasterVersion(outputName)
+        elif masterAction == "Add to master":
+            self.core.mediaProducts.addToMasterVersion(outputName)
+
+    ##################
+    #     Layers     #
+    ##################
+
+    def updatesVersion(self, props, keepcurrentV=False):
+        # "Don't update version" keeps the current paths of a layer that has some
+        return not ((getBool(props, "dontupdateversion") or keepcurrentV) and props.get("lastexportpath") is not None)
+
+    def getLayerJob(self, props, useVersion="next", state=None):
+        """Everything the version resolution of a layer needs, None if it has no identifier or context."""
+        if not props.get("taskname"):
+            return
+
+        # Each layer state may have its own custom context
+        context = self.getContext(props)
+        if "type" not in context:
+            return
+
+        return {
+            "stateName": props.get("stateName", ""),
+            "layername": props.get("renderlayer", ""),
+            "context": context,
+            "task": props["taskname"],
+            "extension": props.get("outputFormat", ".exr"),
+            "location": props.get("curoutputpath", "global"),
+            "singleFrame": props.get("rangeType") == "Single Frame",
+            "comment": self.comment,
+            "version": useVersion if useVersion != "next" else None,
+            "sourceScene": self.core.getCurrentFileName(),
+            "mediaType": MEDIA_TYPE,
+            "state": state,
+        }
+
+    def generateLayerPath(self, job):
+        return self.core.mediaProducts.generateMediaProductPath(
+            entity=job["context"],
+            task=job["task"],
+            extension=job["extension"],
+            framePadding="",
+            comment=job["comment"],
+            version=job["version"],
+            location=job["location"],
+            singleFrame=job["singleFrame"],
+            returnDetails=True,
+            mediaType=job["mediaType"],
+            state=job.get("state"),
+        )
+
+    def resolveLayerJob(self, job, allocator=None, transaction=None):
+        """
+        Resolve the version and output path of a layer job and write its
+        version info. Only touches the filesystem, no Blender data, so
+        several layers can be resolved in worker threads.
+
+        Args:
+            job: Dict from getLayerJob
+            allocator: Optional MHVersionAllocator shared by the layers of a publish
+            transaction: Optional MHPublishTransaction recording the created folders and files
+
+        Returns:
+            {"outputName", "outputPath", "expandedOutputPath", "version"} or {"error": str}
+        """
+        try:
+            if allocator and job["version"] is None:
+                version = allocator.allocate(lambda v: self.generateLayerPath(dict(job, version=v)))
+                if version:
+                    job = dict(job, version=version)
+
+            outputPathData = self.generateLayerPath(job)
+            outputName = outputPathData["path"]
+            outputPath = os.path.dirname(outputName)
+            hVersion = outputPathData["version"]
+            expandedOutputPath = os.path.expandvars(outputPath)
+            outLength = len(outputName)
+            if platform.system() == "Windows" and os.getenv("PRISM_IGNORE_PATH_LENGTH") != "1" and outLength > 255:
+                return {"error": (
+                    "The outputpath is longer than 255 characters (%s), which is not supported on Windows. Please shorten the outputpath by changing the comment, taskname or projectpath."
+                    % outLength
+                )}
+
+            if transaction:
+                transaction.makedirs(os.path.dirname(expandedOutputPath))
+            elif not os.path.exists(os.path.dirname(expandedOutputPath)):
+                os.makedirs(os.path.dirname(expandedOutputPath), exist_ok=True)
+
+            details = job["context"].copy()
+            if "filename" in details:
+                del details["filename"]
+
+            if "extension" in details:
+                del details["extension"]
+
+            details["version"] = hVersion
+            details["sourceScene"] = job["sourceScene"]
+            details["identifier"] = job["task"]
+            details["comment"] = job["comment"]
+
+            if job["mediaType"] == "3drenders":
+                infopath = os.path.dirname(expandedOutputPath)
+            else:
+                infopath = expandedOutputPath
+
+            if transaction:
+                infoFolder = infopath if os.path.isdir(infopath) else os.path.dirname(infopath)
+                with transaction.trackFiles(infoFolder):
+                    self.core.saveVersionInfo(filepath=infopath, details=details)
+            else:
+                self.core.saveVersionInfo(filepath=infopath, details=details)
+        except Exception as e:
+            return {"error": "Couldn't resolve the output version: %s" % e}
+
+        return {
+            "outputName": outputName,
+            "outputPath": outputPath,
+            "expandedOutputPath": expandedOutputPath,
+            "version": hVersion,
+        }
+
+    def applyLayerJob(self, job, resolved, transaction=None):
+        """
+        Assign a resolved output path to the layer output nodes. Must run on
+        the main thread. The master version is updated after the render,
+        see updateLayerMasters.
+
+        Returns:
+            ("Result=Success" or " - error - <reason>", last export path or None)
+        """
+        if "error" in resolved:
+            return " - error - " + resolved["error"], None
+
+        outputName = resolved["outputName"]
+        expandedOutputPath = resolved["expandedOutputPath"]
+        self.functions.setOutputsPaths(job["layername"], expandedOutputPath, transaction=transaction)
+
+        # the aov is necesary for prism logic, we have to remove it fo some of our operations.
+        outputpathnoaov = os.path.join(os.path.dirname(expandedOutputPath), os.path.basename(outputName))
+
+        pathassigned = True
+        for node in self.functions.getLayerOutNodes(job["layername"]).values():
+            if node and os.path.dirname(expandedOutputPath) not in node.base_path:
+                pathassigned = False
+
+        if not pathassigned:
+            return " - error - The outputpath was not assigned to nodes.", outputpathnoaov
+
+        return "Result=Success", outputpathnoaov
+
+    def getResumeVersions(self, frames):
+        """
+        Return {layer index: version} of the layers that update their version
+        and whose last version (lastexportpath) has some but not all of the
+        frames, e.g. from a publish that failed while rendering. With "Skip
+        rendered frames" these layers render into that version again.
+        """
+        allocator = self.functions.createVersionAllocator()
+        frames = set(frames)
+        versions = {}
+        for index, props in enumerate(self.layers):
+            lastPath = props.get("lastexportpath")
+            if not lastPath or not self.updatesVersion(props):
+                continue
+
+            folder = os.path.dirname(os.path.expandvars(lastPath))
+            intVersion = allocator.getIntVersion(os.path.basename(folder))
+            job = self.getLayerJob(props, state=self.hooks.get("layerStates", {}).get(index))
+            if intVersion is None or not job or not os.path.isdir(folder):
+                continue
+
+            # The identifier or context may have changed since
+            version = allocator.getVersionName(intVersion)
+            outputName = os.path.expandvars(self.generateLayerPath(dict(job, version=version))["path"])
+            if os.path.normcase(os.path.dirname(os.path.dirname(outputName))) != os.path.normcase(folder):
+                continue
+
+            layername = job["layername"]
+            complete = self.functions.scanRenderedFrames([layername], frames, folders={layername: folder})
+            if complete and len(complete) < len(frames):
+                versions[index] = version
+
+        return versions
+
+    def updateLayerVersions(self, useVersion="next", keepcurrentV=False, transaction=None, resumeVersions=None):
+        """
+        Give every layer that updates its version the next version, from one
+        listing of the render roots, and assign the paths to its nodes. The
+        versions are resolved in worker threads, the nodes are updated on
+        the main thread in one pass. The layers of resumeVersions
+        (getResumeVersions) keep their version.
+
+        Returns:
+            [{"index", "stateName", "layername", "result", "version", "path", "outputName", "masterVersion"}]
+        """
+        jobs = []
+        results = []
+        for index, props in enumerate(self.layers):
+            if not self.updatesVersion(props, keepcurrentV):
+                continue
+
+            job = self.getLayerJob(
+                props,
+                useVersion=(resumeVersions or {}).get(index, useVersion),
+                state=self.hooks.get("layerStates", {}).get(index),
+            )
+            if not job:
+                results.append({
+                    "index": index,
+                    "stateName": props.get("stateName", ""),
+                    "layername": props.get("renderlayer", ""),
+                    "result": " - error - no identifier is given.",
+                    "version": None,
+                    "path": None,
+                    "outputName": None,
+                    "masterVersion": props.get("masterVersion"),
+                })
+                continue
+
+            jobs.append((index, props, job))
+
+        if not jobs:
+            return results
+
+        allocator = self.functions.createVersionAllocator()
+        workers = max(1, min(self.versionResolveThreads, len(jobs)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            resolved = list(pool.map(lambda j: self.resolveLayerJob(j[2], allocator=allocator, transaction=transaction), jobs))
+
+        onLayerApplied = self.hooks.get("onLayerApplied")
+        with self.functions.nodeTreeOperation():
+            for (index, props, job), res in zip(jobs, resolved):
+                # Once frames are rendered into the version a rollback keeps the layer on it
+                folder = os.path.dirname(res["expandedOutputPath"]) if "error" not in res else None
+                with transaction.keepIfRendered(folder) if transaction and folder else nullcontext():
+                    result, path = self.applyLayerJob(job, res, transaction=transaction)
+                    if path and onLayerApplied:
+                        onLayerApplied(index, path, transaction)
+
+                results.append({
+                    "index": index,
+                    "stateName": job["stateName"],
+                    "layername": job["layername"],
+                    "result": result,
+                    "version": res.get("version"),
+                    "path": path,
+                    "outputName": res.get("outputName"),
+                    "masterVersion": props.get("masterVersion"),
+                })
+
+        return results
+
+    def getLayerMasters(self, layerResults):
+        # [(masterAction, outputName)] of the layers that got a new version
+        return [
+            (r["masterVersion"], os.path.expandvars(r["outputName"]))
+            for r in layerResults
+            if r["result"] == "Result=Success" and r["outputName"]
+        ]
+
+    def updateLayerMasters(self, layerMasters):
+        # Only once the layers are rendered, a failed publish must not move the masters
+        for masterAction, outputName in layerMasters:
+            self.handleMasterVersion(masterAction, outputName)
+
+    ##################
+    #     Render     #
+    ##################
+
+    def getOutputName(self, useVersion="next"):
+        """Return (outputName, outputFolder, version) of the render, None without identifier or context."""
+        props = self.renderProps
+        context = self.getContext(props)
+        if not props.get("taskname") or "type" not in context:
+            return
+
+        outputPathData = self.core.mediaProducts.generateMediaProductPath(
+            entity=context,
+            task=props["taskname"],
+            extension=props.get("outputFormat", ".jpg"),
+            framePadding="",
+            comment=self.comment,
+            version=useVersion if useVersion != "next" else None,
+            location=props.get("curoutputpath", "global"),
+            aov="JPGseq",
+            singleFrame=props.get("rangeType") == "Single Frame",
+            returnDetails=True,
+            mediaType=MEDIA_TYPE,
+            state=self.state,
+        )
+        return outputPathData["path"], os.path.dirname(outputPathData["path"]), outputPathData["version"]
+
+    def getRenderFrames(self, rSettings):
+        if rSettings["rangeType"] == "Expression":
+            return list(rSettings["frames"])
+
+        return list(range(int(rSettings["startFrame"]), int(rSettings["endFrame"]) + 1))
+
+    def applyResumeScan(self, rSettings):
+        """
+        Remove the frames already rendered for all layers from rSettings.
+        Returns False if there is nothing left to render.
+        """
+        frames = self.getRenderFrames(rSettings)
+        complete = self.functions.scanRenderedFrames(list(self.getLayerOptions()), frames)
+        if not complete:
+            return True
+
+        remaining = [f for f in frames if f not in complete]
+        rSettings["skippedFrames"] = sorted(complete)
+        if not remaining:
+            return False
+
+        rSettings["rangeType"] = "Expression"
+        rSettings["frames"] = remaining
+        rSettings["frameExpression"] = self.functions.formatFrameExpression(remaining)
+        return True
+
+    def renderLocal(self, rSettings):
+        # Default local render: background processes or this Blender session
+        props = self.renderProps
+        frames = self.getRenderFrames(rSettings)
+        if props.get("localrendermode") == "Background Processes":
+            scenePath = self.functions.saveRenderSceneCopy()
+            scheduler = self.functions.createLocalRenderScheduler(
+                scenePath,
+                frames,
+                chunkSize=int(props.get("localchunksize", 10)),
+                workers=int(props.get("localworkers", 2)),
+                isFrameDone=set(rSettings.get("skippedFrames", [])).__contains__,
+            )
+            scheduler.start()
+            scheduler.wait()
+            try:
+                os.remove(scenePath)
+            except OSError:
+                pass
+
+            return scheduler.getResult()
+
+        return self.functions.renderFrames(frames)
+
+    def execute(self, useVersion="next", keepcurrentV=False):
+        """
+        Publish the render. Everything changed before rendering is recorded
+        in a transaction and reverted if the publish fails.
+
+        Returns:
+            {
+                "stateName", "status": "success", "error" or "paused",
+                "message": error message, "result": render or submission result,
+                "outputName", "version", "layers": updateLayerVersions results,
+                "skippedFrames", "rolledBack": bool, "timings": [(span, seconds)],
+            }
+        """
+        report = {
+            "stateName": self.renderProps.get("stateName", ""),
+            "status": "error",
+            "message": "",
+            "result": None,
+            "outputName": None,
+            "version": None,
+            "layers": [],
+            "skippedFrames": [],
+            "rolledBack": False,
+            "timings": [],
+        }
+        transaction = self.functions.createPublishTransaction(report["stateName"])
+        try:
+            self.executePublish(transaction, report, useVersion=useVersion, keepcurrentV=keepcurrentV)
+        except Exception:
+            transaction.rollback()
+            report["rolledBack"] = True
+            raise
+        finally:
+            report["timings"] = list(transaction.timings)
+
+        if report["status"] in ["success", "paused"]:
+            transaction.commit()
+        else:
+            transaction.rollback()
+            report["rolledBack"] = True
+
+        return report
+
+    def fail(self, report, message):
+        report["status"] = "error"
+        report["message"] = message
+        return report
+
+    def executePublish(self, transaction, report, useVersion="next", keepcurrentV=False):
+        props = self.renderProps
+        rangeType = props.get("rangeType", "Scene")
+        frames = self.getFrameRange(props)
+        if rangeType != "Expression":
+            startFrame, endFrame = frames
+        else:
+            startFrame = None
+            endFrame = None
+
+        if frames is None or frames == [] or frames[0] is None:
+            return self.fail(report, "Framerange is invalid")
+
+        if rangeType == "Single Frame":
+            endFrame = startFrame
+
+        fileName = self.core.getCurrentFileName()
+        audit = self.functions.auditRenderPasses(self.getLayerOptions())
+        nonodes = [l for l in self.getLayerOptions() if not audit["layers"].get(l, {}).get("hasNodes")]
+        if nonodes and not self.hooks.get("confirmMissingNodes", lambda layernames: True)(nonodes):
+            return self.fail(report, "Some Layers had no nodes.")
+
+        # Update the versions
+        if useVersion != "next":
+            keepcurrentV = True
+
+        # Before any version is bumped, a layer rendered in part goes on in its last version
+        resumeVersions = {}
+        if getBool(props, "skiprendered", True) and not keepcurrentV:
+            renderFrames = self.getRenderFrames({
+                "rangeType": rangeType, "frames": frames, "startFrame": startFrame, "endFrame": endFrame
+            })
+            with transaction.span("resume versions"):
+                resumeVersions = self.getResumeVersions(renderFrames)
+
+        with transaction.span("layer versions"):
+            report["layers"] = self.updateLayerVersions(
+                keepcurrentV=keepcurrentV, transaction=transaction, resumeVersions=resumeVersions
+            )
+
+        layerErrors = [r["stateName"] + r["result"] for r in report["layers"] if " - error - " in r["result"]]
+        if layerErrors:
+            # Rendering now would write into the previous versions of these layers
+            return self.fail(report, "Couldn't update the layer versions:\n" + "\n".join(layerErrors))
+
+        if not props.get("taskname"):
+            return self.fail(report, "no identifier is given. Skipped the activation of this state.")
+
+        camera = props.get("currentcam")
+        if camera in [None, "None"] or (camera != "Current View" and not self.core.appPlugin.isNodeValid(self.state, camera)):
+            return self.fail(report, "no camera is selected. Skipping activation of this state.")
+
+        outputData = self.getOutputName(useVersion=useVersion)
+        if not outputData:
+            return self.fail(report, "Couldn't generate the outputpath.")
+
+        outputName, outputPath, hVersion = outputData
+        report["outputName"] = outputName
+        report["version"] = hVersion
+        expandedOutputPath = os.path.expandvars(outputPath)
+        outLength = len(outputName)
+        if platform.system() == "Windows" and os.getenv("PRISM_IGNORE_PATH_LENGTH") != "1" and outLength > 255:
+            return self.fail(report, (
+                "The outputpath is longer than 255 characters (%s), which is not supported on Windows. Please shorten the outputpath by changing the comment, taskname or projectpath."
+                % outLength
+            ))
+
+        transaction.makedirs(os.path.dirname(expandedOutputPath))
+
+        details = self.getContext(props)
+        details.pop("filename", None)
+        details.pop("extension", None)
+        details["version"] = hVersion
+        details["sourceScene"] = fileName
+        details["identifier"] = props["taskname"]
+        details["comment"] = self.comment
+
+        infopath = os.path.dirname(expandedOutputPath)
+        infoFolder = infopath if os.path.isdir(infopath) else os.path.dirname(infopath)
+        with transaction.trackFiles(infoFolder):
+            self.core.saveVersionInfo(filepath=infopath, details=details)
+
+        if self.hooks.get("onOutputName"):
+            self.hooks["onOutputName"](outputName, transaction)
+
+        rSettings = {
+            "outputName": outputName,
+            "startFrame": startFrame,
+            "endFrame": endFrame,
+            "frames": frames,
+            "rangeType": rangeType,
+            # Kept for a paused render, see MHRender.executePausedRender
+            "layerMasters": self.getLayerMasters(report["layers"]),
+        }
+
+        if getBool(props, "renderpresetoverride") and self.hooks.get("applyRenderPreset"):
+            self.hooks["applyRenderPreset"](rSettings)
+
+        transaction.makedirs(os.path.expandvars(os.path.dirname(rSettings["outputName"])))
+        undoRenderSettings = self.hooks.get("undoRenderSettings", self.functions.restoreRenderSettings)
+        # Restored after the render, or by the rollback if the publish stops before
+        settingsRestored = []
+        transaction.recordUndo("render settings", lambda: settingsRestored or undoRenderSettings(rSettings))
+        resOverride = props.get("resoverride")
+        if isinstance(resOverride, str):
+            resOverride = eval(resOverride)
+
+        with transaction.span("pre submit"):
+            self.functions.applyRenderOutputSettings(
+                rSettings,
+                camera=camera,
+                extension=props.get("outputFormat", ".jpg"),
+                resolution=resOverride[1:] if resOverride and resOverride[0] else None,
+            )
+
+        result = self.core.callback("preRender", state=self.state, scenefile=fileName, settings=rSettings)
+        for res in result or []:
+            if isinstance(res, dict) and res.get("cancel", False):
+                return self.fail(report, res.get("details", "preRender hook returned False"))
+
+        if not os.path.exists(os.path.expandvars(os.path.dirname(rSettings["outputName"]))):
+            os.makedirs(os.path.expandvars(os.path.dirname(rSettings["outputName"])))
+
+        if self.hooks.get("saveScene"):
+            with transaction.span("save scene"):
+                self.hooks["saveScene"]()
+
+        if self.core.getConfig("globals", "backupScenesOnPublish", config="project"):
+            with transaction.span("backup scene"):
+                self.core.entities.backupScenefile(os.path.expandvars(os.path.dirname(rSettings["outputName"])), bufferMinutes=0)
+
+        renderNeeded = True
+        if getBool(props, "skiprendered", True):
+            with transaction.span("resume scan"):
+                renderNeeded = self.applyResumeScan(rSettings)
+                report["skippedFrames"] = rSettings.get("skippedFrames", [])
+
+        updateMaster = True
+        if not renderNeeded:
+            # Every frame of every layer is already on disk
+            result = "Result=Success"
+        elif getBool(props, "submitrender"):
+            handleMaster = "media" if self.isUsingMasterVersion(props.get("masterVersion")) else False
+            submit = self.hooks.get("submit")
+            with transaction.span("submit"):
+                if submit:
+                    result = submit(rSettings, details, handleMaster)
+                else:
+                    result = "farm submission needs the render farm plugin of the State Manager"
+            updateMaster = False
+        else:
+            with transaction.span("render"):
+                result = self.hooks.get("render", self.renderLocal)(rSettings)
+
+        undoRenderSettings(rSettings)
+        settingsRestored.append(True)
+        report["result"] = result
+        if result == "publish paused":
+            report["status"] = "paused"
+            return report
+
+        if "Result=Success" in result:
+            # A farm can't run this after its jobs, the layer masters follow the submission there
+            self.updateLayerMasters(rSettings["layerMasters"])
+            if updateMaster:
+                self.handleMasterVersion(props.get("masterVersion"), os.path.expandvars(outputName))
+
+        self.core.callback("postRender", state=self.state, scenefile=fileName, settings=rSettings, result=result)
+
+        if "Result=Success" in result:
+            report["status"] = "success"
+        else:
+            self.fail(report, result)
+
+        return report
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# MH Extension - Lazy state UI refresh
+# Turns Blender notifications into invalidations of the MHrendLayer state
+# UIs, so only the state that is shown does the costly refresh.
+#
+
+import logging
+import weakref
+
+import bpy
+
+logger = logging.getLogger(__name__)
+
+# Topics of the invalidations
+LAYERS = "layers"  # view layers added, removed or renamed
+PASSES = "passes"  # passes or properties of a view layer changed
+NODES = "nodes"  # the compositor tree may have changed, see getNodeIndex
+TOPICS = (LAYERS, PASSES, NODES)
+
+_tracker = None
+
+
+class MHLayerUiTracker(object):
+    """
+    Keeps a generation counter per topic, bumped by Blender notifications:
+    - depsgraph_update_post: the view layer names of the scene changed
+      (compared to the last update, so other scene edits are ignored),
+      and the scene or a node tree was updated (nodes)
+    - undo_post/redo_post: the node pointers were replaced (nodes)
+    - msgbus: a view layer property changed in the Blender UI, which
+      covers the pass and layer property toggles
+    - load_post: a scene was opened, everything is invalid
+
+    A state remembers the generations of its last full refresh and is
+    stale when they differ. Listeners are called with the topic and are
+    held weakly. A deleted state removes its listener (removeListener),
+    the widget may be gone before the Python object.
+
+    msgbus doesn't notify changes made by Python, the states refresh
+    themselves after their own edits.
+    """
+
+    def __init__(self):
+        self.generations = dict.fromkeys(TOPICS, 0)
+        self.listeners = []
+        self.layerNames = None
+        self.owner = object()
+        self.registered = False
+
+    def register(self):
+        if self.registered:
+            return
+
+        # Handlers of a tracker from before a plugin reload
+        for handlers, name in [
+            (bpy.app.handlers.depsgraph_update_post, "MHLayerUiTracker.onDepsgraphUpdate"),
+            (bpy.app.handlers.load_post, "MHLayerUiTracker.onLoadPost"),
+            (bpy.app.handlers.undo_post, "MHLayerUiTracker.onUndo"),
+            (bpy.app.handlers.redo_post, "MHLayerUiTracker.onUndo"),
+        ]:
+            for handler in [h for h in handlers if getattr(h, "__qualname__", "") == name]:
+                handlers.remove(handler)
+
+        bpy.app.handlers.depsgraph_update_post.append(self.onDepsgraphUpdate)
+        bpy.app.handlers.load_post.append(self.onLoadPost)
+        bpy.app.handlers.undo_post.append(self.onUndo)
+        bpy.app.handlers.redo_post.append(self.onUndo)
+        self.subscribe()
+        self.registered = True
+
+    def unregister(self):
+        if not self.registered:
+            return
+
+        for handlers, func in [
+            (bpy.app.handlers.depsgraph_update_post, self.onDepsgraphUpdate),
+            (bpy.app.handlers.load_post, self.onLoadPost),
+            (bpy.app.handlers.undo_post, self.onUndo),
+            (bpy.app.handlers.redo_post, self.onUndo),
+        ]:
+            if func in handlers:
+                handlers.remove(func)
+
+        bpy.msgbus.clear_by_owner(self.owner)
+        self.registered = False
+
+    def subscribe(self):
+        # Subscriptions are dropped when a file is loaded, see onLoadPost
+        bpy.msgbus.clear_by_owner(self.owner)
+        keys = [bpy.types.ViewLayer]
+        if hasattr(bpy.types, "CyclesRenderLayerSettings"):
+            keys.append(bpy.types.CyclesRenderLayerSettings)
+
+        for key in keys:
+            bpy.msgbus.subscribe_rna(key=key, owner=self.owner, args=(PASSES,), notify=self.invalidate)
+
+        bpy.msgbus.subscribe_rna(key=(bpy.types.ViewLayer, "name"), owner=self.owner, args=(LAYERS,), notify=self.invalidate)
+
+    @bpy.app.handlers.persistent
+    def onDepsgraphUpdate(self, scene, depsgraph=None):
+        if depsgraph is None or depsgraph.id_type_updated("NODETREE") or depsgraph.id_type_updated("SCENE"):
+            self.invalidate(NODES)
+
+        layerNames = tuple(layer.name for layer in scene.view_layers)
+        if layerNames != self.layerNames:
+            if self.layerNames is not None:
+                self.invalidate(LAYERS)
+
+            self.layerNames = layerNames
+
+    @bpy.app.handlers.persistent
+    def onUndo(self, *args):
+        self.invalidate(NODES)
+
+    @bpy.app.handlers.persistent
+    def onLoadPost(self, *args):
+        self.layerNames = None
+        self.subscribe()
+        for topic in TOPICS:
+            self.invalidate(topic)
+
+    def invalidate(self, topic):
+        self.generations[topic] += 1
+        dead = []
+        for ref in list(self.listeners):
+            listener = ref()
+            if listener is None:
+                dead.append(ref)
+                continue
+
+            try:
+                listener(topic)
+            except Exception:
+                logger.exception("the layer UI listener %s failed on %s" % (listener, topic))
+
+        if dead:
+            self.listeners = [ref for ref in self.listeners if ref not in dead]
+
+    def getGenerations(self):
+        return dict(self.generations)
+
+    def isStale(self, generations, topics=TOPICS):
+        return any(generations.get(topic) != self.generations[topic] for topic in topics)
+
+    def addListener(self, method):
+        """Call method(topic) on invalidations, method is a bound method held weakly."""
+        self.listeners.append(weakref.WeakMethod(method))
+
+    def removeListener(self, method):
+        self.listeners = [ref for ref in self.listeners if ref() not in [None, method]]
+
+
+def getLayerUiTracker():
+    """Return the tracker of this Blender session, registered on first use."""
+    global _tracker
+    if _tracker is None:
+        _tracker = MHLayerUiTracker()
+        _tracker.register()
+
+    return _tracker
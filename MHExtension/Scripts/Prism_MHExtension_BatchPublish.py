@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+#
+# MH Extension - Batch publish runner
+# Publishes the MHRender states of many scenes with a bounded pool of
+# background Blender processes and gathers a report.
+#
+#   python Prism_MHExtension_BatchPublish.py --blender <blender> --workers 4 --report report.json <scenes or folders>
+#
+
+import os
+import sys
+import glob
+import json
+import time
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Prism_BlenderMHExtension_BatchWorker.py")
+
+
+def getShotName(scene):
+    return os.path.splitext(os.path.basename(scene))[0]
+
+
+def findScenes(paths):
+    """Return the .blend files of the paths, folders are searched (not recursively)."""
+    scenes = []
+    for path in paths:
+        if os.path.isdir(path):
+            scenes += sorted(glob.glob(os.path.join(path, "*.blend")))
+        else:
+            scenes.append(path)
+
+    return scenes
+
+
+class MHBatchPublishRunner(object):
+    """
+    Publishes the MHRender states saved in each scene, every scene in its
+    own "blender -b" process with at most `workers` processes at a time.
+    The processes run Prism_BlenderMHExtension_BatchWorker.py, which loads
+    the states of the scene and executes them with MHRenderPublisher.
+
+        runner = MHBatchPublishRunner(blender, scenes, workers=4, comment="sequence publish")
+        report = runner.run()
+        print(formatReport(report))
+    """
+
+    def __init__(self, blenderPath, scenes, workers=2, comment="", stateNames=None, useVersion="next", saveScenes=True, timeout=None):
+        self.blenderPath = blenderPath
+        self.scenes = list(scenes)
+        self.workers = max(1, int(workers))
+        self.comment = comment
+        self.stateNames = list(stateNames or [])
+        self.useVersion = useVersion
+        self.saveScenes = saveScenes
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.processes = []
+        self.canceled = False
+
+    def getCommand(self, scene, resultPath):
+        cmd = [
+            self.blenderPath,
+            "-b", scene,
+            "--python", WORKER_SCRIPT,
+            "--",
+            "--result", resultPath,
+            "--comment", self.comment,
+            "--version", self.useVersion,
+        ]
+        for stateName in self.stateNames:
+            cmd += ["--state", stateName]
+
+        if not self.saveScenes:
+            cmd.append("--no-save")
+
+        return cmd
+
+    def publishScene(self, scene):
+        """Publish one scene and return its report entry."""
+        entry = {
+            "scene": scene,
+            "shot": getShotName(scene),
+            "status": "error",
+            "error": None,
+            "returncode": None,
+            "duration": 0.0,
+            "states": [],
+            "versions": {},
+            "log": [],
+        }
+        if self.canceled:
+            entry["error"] = "canceled"
+            return entry
+
+        handle, resultPath = tempfile.mkstemp(prefix="MHBatchPublish_", suffix=".json")
+        os.close(handle)
+        kwargs = {}
+        if os.name == "nt":
+            kwargs["creationflags"] = getattr(subprocess, "CREATE_NO_WINDOW", 0)
+
+        start = time.time()
+        try:
+            proc = subprocess.Popen(
+                self.getCommand(scene, resultPath),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True,
+                errors="replace",
+                **kwargs
+            )
+        except OSError as e:
+            entry["error"] = str(e)
+            os.remove(resultPath)
+            return entry
+
+        with self.lock:
+            self.processes.append(proc)
+
+        timer = None
+        if self.timeout:
+            timer = threading.Timer(self.timeout, proc.kill)
+            timer.start()
+
+        tail = []
+        for line in proc.stdout:
+            tail = (tail + [line.rstrip()])[-50:]
+
+        proc.wait()
+        if timer:
+            timer.cancel()
+
+        with self.lock:
+            self.processes.remove(proc)
+
+        entry["duration"] = time.time() - start
+        entry["returncode"] = proc.returncode
+        entry["log"] = tail
+        try:
+            with open(resultPath, "r") as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            result = {"error": "blender exited with code %s without writing a result" % proc.returncode, "states": []}
+        finally:
+            os.remove(resultPath)
+
+        entry["states"] = result.get("states", [])
+        entry["error"] = result.get("error")
+        # Per state, several states may publish the same layers
+        for state in entry["states"]:
+            key = state["stateName"]
+            count = 1
+            while key in entry["versions"]:
+                count += 1
+                key = "%s (%s)" % (state["stateName"], count)
+
+            entry["versions"][key] = {
+                "version": state.get("version"),
+                "layers": {layer["layername"]: layer.get("version") for layer in state.get("layers", [])},
+            }
+
+        if not entry["error"] and proc.returncode == 0 and all(s["status"] == "success" for s in entry["states"]):
+            entry["status"] = "success"
+
+        logger.debug("batch publish: %s %s in %.1fs" % (entry["shot"], entry["status"], entry["duration"]))
+        return entry
+
+    def run(self, onSceneDone=None):
+        """
+        Publish all scenes and return the report:
+            {"scenes": [entries in scene order], "workers", "duration", "succeeded", "failed"}
+
+        Args:
+            onSceneDone: Optional callable(entry), called from the worker threads
+        """
+        start = time.time()
+
+        def publish(scene):
+            entry = self.publishScene(scene)
+            if onSceneDone:
+                onSceneDone(entry)
+
+            return entry
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            entries = list(pool.map(publish, self.scenes))
+
+        return {
+            "scenes": entries,
+            "workers": self.workers,
+            "duration": time.time() - start,
+            "succeeded": len([e for e in entries if e["status"] == "success"]),
+            "failed": len([e for e in entries if e["status"] != "success"]),
+        }
+
+    def cancel(self):
+        self.canceled = True
+        with self.lock:
+            processes = list(self.processes)
+
+        for proc in processes:
+            try:
+                proc.terminate()
+            except OSError:
+                pass
+
+
+def formatStateVersions(stateName, versions):
+    # "Render v0003 (fg v0003, bg v0002)"
+    layers = ", ".join("%s %s" % (k, v) for k, v in versions["layers"].items())
+    return "%s %s" % (stateName, versions["version"]) + (" (%s)" % layers if layers else "")
+
+
+def formatReport(report):
+    lines = ["%-24s %-8s %9s  %s" % ("Shot", "Status", "Time", "Versions / Error")]
+    for entry in report["scenes"]:
+        if entry["status"] == "success":
+            info = "; ".join(formatStateVersions(stateName, v) for stateName, v in entry["versions"].items())
+        else:
+            messages = [s["message"] for s in entry["states"] if s.get("message")]
+            info = (entry["error"] or "; ".join(messages) or "failed").strip().splitlines()[-1]
+
+        lines.append("%-24s %-8s %8.1fs  %s" % (entry["shot"], entry["status"], entry["duration"], info))
+
+    lines.append(
+        "%s of %s scenes published in %.1fs with %s processes"
+        % (report["succeeded"], len(report["scenes"]), report["duration"], report["workers"])
+    )
+    return "\n".join(lines)
+
+
+def writeReport(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=4, default=str)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Publish the MHRender states of many Blender scenes.")
+    parser.add_argument("scenes", nargs="+", help=".blend files or folders containing them")
+    parser.add_argument("--blender", default=os.getenv("PRISM_BLENDER_PATH", "blender"))
+    parser.add_argument("--workers", type=int, default=2, help="Scenes published at the same time")
+    parser.add_argument("--comment", default="")
+    parser.add_argument("--state", action="append", default=[], help="MHRender state to publish, all enabled ones if not given")
+    parser.add_argument("--version", default="next")
+    parser.add_argument("--no-save", action="store_true", help="Don't save the scenes after publishing")
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds after which a scene is aborted")
+    parser.add_argument("--report", help="JSON file for the full report")
+    args = parser.parse_args(argv)
+
+    runner = MHBatchPublishRunner(
+        args.blender,
+        findScenes(args.scenes),
+        workers=args.workers,
+        comment=args.comment,
+        stateNames=args.state,
+        useVersion=args.version,
+        saveScenes=not args.no_save,
+        timeout=args.timeout,
+    )
+    report = runner.run(onSceneDone=lambda e: print("%s: %s" % (e["shot"], e["status"])))
+    print(formatReport(report))
+    if args.report:
+        writeReport(report, args.report)
+
+    return 0 if not report["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+#
+# MH Extension - Master Version Dependency Index
+# Project-level SQLite index of master versions, their source versions and
+# the files referenced by generated USD masters.
+#
+
+import os
+import re
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class MHDependencyIndex(object):
+    """
+    Keeps track of which version every master points to and which files the
+    generated .usda masters reference, so reverse lookups ("what depends on
+    this product") and staleness checks don't need to crawl the project.
+
+    The database lives in <pipeline folder>/MHExtension/dependencies.db.
+    Paths are stored normalized (forward slashes, lower case on Windows).
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS masters (
+            masterPath TEXT PRIMARY KEY,
+            productDir TEXT,
+            product TEXT,
+            entity TEXT,
+            sourcePath TEXT,
+            sourceVersion TEXT,
+            updated REAL
+        );
+        CREATE TABLE IF NOT EXISTS refs (
+            masterPath TEXT,
+            refPath TEXT,
+            PRIMARY KEY (masterPath, refPath)
+        );
+        CREATE TABLE IF NOT EXISTS versions (
+            productDir TEXT,
+            version TEXT,
+            intVersion INTEGER,
+            path TEXT,
+            PRIMARY KEY (productDir, version)
+        );
+        CREATE INDEX IF NOT EXISTS refs_refPath ON refs (refPath);
+        CREATE INDEX IF NOT EXISTS masters_sourcePath ON masters (sourcePath);
+        CREATE INDEX IF NOT EXISTS versions_intVersion ON versions (productDir, intVersion);
+    """
+
+    def __init__(self, core):
+        self.core = core
+        self.lock = threading.Lock()
+        self.connections = {}
+
+    def getDatabasePath(self):
+        """Return the index path for the current project or None without a project."""
+        pipelineFolder = self.core.projects.getPipelineFolder()
+        if not pipelineFolder:
+            return
+
+        return os.path.join(pipelineFolder, "MHExtension", "dependencies.db")
+
+    def getConnection(self):
+        dbPath = self.getDatabasePath()
+        if not dbPath:
+            return
+
+        with self.lock:
+            conn = self.connections.get(dbPath)
+            if conn is None:
+                if not os.path.exists(os.path.dirname(dbPath)):
+                    os.makedirs(os.path.dirname(dbPath))
+
+                # Several artists write to the index on the project share. The
+                # default rollback journal keeps it consistent if a process dies
+                # mid-write (an in-memory journal doesn't, WAL needs shared memory).
+                # The connection is shared between threads, every use takes self.lock.
+                conn = sqlite3.connect(dbPath, timeout=10, check_same_thread=False)
+                conn.executescript(self.schema)
+                self.connections[dbPath] = conn
+
+        return conn
+
+    def normPath(self, path):
+        path = os.path.normpath(os.path.expandvars(path)).replace("\\", "/")
+        if os.name == "nt":
+            path = path.lower()
+
+        return path
+
+    def getProductDir(self, path):
+        """
+        Return the product folder of a version/master file, assuming the
+        <product>/<version>/<file> layout Prism uses for products.
+        """
+        return self.normPath(os.path.dirname(os.path.dirname(path)))
+
+    def getIntVersion(self, version):
+        getInt = getattr(self.core.products, "getIntVersionFromVersionName", None)
+        if getInt:
+            intVersion = getInt(version)
+            if intVersion is not None:
+                return intVersion
+
+        match = re.search(r"(\d+)", version or "")
+        return int(match.group(1)) if match else None
+
+    def recordVersion(self, path, version):
+        """Record that a version of a product exists (called on export and master updates)."""
+        conn = self.getConnection()
+        if not conn or not version or version == "master":
+            return
+
+        with self.lock, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO versions (productDir, version, intVersion, path) VALUES (?, ?, ?, ?)",
+                (self.getProductDir(path), version, self.getIntVersion(version), self.normPath(path)),
+            )
+
+    def recordMaster(self, masterPath, sourcePath, sourceVersion, product=None, entity=None, refs=None):
+        """
+        Record (or replace) a master, the version it points to and the files
+        it references. If refs is None they are read from the master when it
+        is a .usda file.
+        """
+        conn = self.getConnection()
+        if not conn:
+            return
+
+        if refs is None:
+            refs = self.readUsdReferences(masterPath)
+
+        masterKey = self.normPath(masterPath)
+        masterDir = os.path.dirname(masterPath)
+        refPaths = set(self.normPath(os.path.join(masterDir, ref)) for ref in refs)
+
+        with self.lock, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO masters (masterPath, productDir, product, entity, sourcePath, sourceVersion, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (masterKey, self.getProductDir(masterPath), product, entity, self.normPath(sourcePath), sourceVersion, time.time()),
+            )
+            conn.execute("DELETE FROM refs WHERE masterPath = ?", (masterKey,))
+            conn.executemany(
+                "INSERT OR IGNORE INTO refs (masterPath, refPath) VALUES (?, ?)",
+                [(masterKey, refPath) for refPath in refPaths],
+            )
+
+        if sourceVersion:
+            self.recordVersion(sourcePath, sourceVersion)
+
+    def readUsdReferences(self, path):
+        """Return all asset paths (@...@) authored in a .usda file."""
+        if not path.lower().endswith(".usda") or not os.path.exists(path):
+            return []
+
+        try:
+            with open(path, "r", encoding="utf-8", errors="ignore") as f:
+                content = f.read()
+        except Exception as e:
+            logger.warning("Could not read USD references from %s: %s" % (path, e))
+            return []
+
+        return re.findall(r"@([^@]+)@", content)
+
+    def getDependents(self, path, recursive=True):
+        """
+        Return the masters that reference the given file, its product folder
+        (any master of the product) or its master.
+
+        Args:
+            path: Path of a version file, master file or product folder
+            recursive: Also return masters depending on those masters
+
+        Returns:
+            List of normalized master paths
+        """
+        conn = self.getConnection()
+        if not conn:
+            return []
+
+        result = []
+        pending = [self.normPath(path)]
+        seen = set(pending)
+        while pending:
+            key = pending.pop(0)
+            with self.lock:
+                rows = conn.execute(
+                    "SELECT masterPath FROM refs WHERE refPath = ? OR refPath LIKE ? "
+                    "UNION SELECT masterPath FROM masters WHERE sourcePath = ?",
+                    (key, key.rstrip("/") + "/%", key),
+                ).fetchall()
+
+            for (masterPath,) in rows:
+                if masterPath in seen:
+                    continue
+
+                seen.add(masterPath)
+                result.append(masterPath)
+                if recursive:
+                    pending.append(masterPath)
+
+        return result
+
+    def getStaleMasters(self):
+        """
+        Return the masters whose source version is older than the latest
+        version recorded for their product.
+
+        Returns:
+            List of dicts with masterPath, product, sourceVersion and latestVersion
+        """
+        conn = self.getConnection()
+        if not conn:
+            return []
+
+        with self.lock:
+            rows = conn.execute(
+                """
+                SELECT m.masterPath, m.product, m.sourceVersion, v.version, v.intVersion
+                FROM masters m
+                JOIN versions v ON v.productDir = m.productDir
+                WHERE v.intVersion = (SELECT MAX(intVersion) FROM versions WHERE productDir = m.productDir)
+                """
+            ).fetchall()
+
+        stale = []
+        for masterPath, product, sourceVersion, latestVersion, latestInt in rows:
+            sourceInt = self.getIntVersion(sourceVersion)
+            if sourceInt is not None and latestInt is not None and sourceInt < latestInt:
+                stale.append({
+                    "masterPath": masterPath,
+                    "product": product,
+                    "sourceVersion": sourceVersion,
+                    "latestVersion": latestVersion,
+                })
+
+        return stale
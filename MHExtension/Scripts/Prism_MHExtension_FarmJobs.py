@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+#
+# MH Extension - Farm job graph
+# One render job per layer plus a dependent master job, and the managers
+# that submit them.
+#
+
+import logging
+import itertools
+
+logger = logging.getLogger(__name__)
+
+
+class MHFarmJob(object):
+    """
+    A job of the graph. kind is "render" (renders layername for frames, in
+    tasks of framesPerTask frames) or "master" (updates the master version
+    once its dependencies are done). dependencies are job names.
+    """
+
+    def __init__(self, name, kind, layername=None, frames=None, framesPerTask=1, dependencies=None):
+        self.name = name
+        self.kind = kind
+        self.layername = layername
+        self.frames = sorted(set(frames or []))
+        self.framesPerTask = max(1, int(framesPerTask))
+        self.dependencies = list(dependencies or [])
+        self.jobId = None
+        self.result = None
+
+    def getTasks(self):
+        """Return the frame lists of the tasks of the job."""
+        return [self.frames[i:i + self.framesPerTask] for i in range(0, len(self.frames), self.framesPerTask)]
+
+    def __repr__(self):
+        return "MHFarmJob(%s, %s, %s frames, deps=%s)" % (self.name, self.kind, len(self.frames), self.dependencies)
+
+
+def buildLayerJobGraph(jobName, layernames, frames, framesPerTask=1, masterJob=True):
+    """
+    Return the jobs of a per layer submission, in submission order: one
+    render job per layer and, with masterJob, a master job depending on
+    all of them.
+    """
+    jobs = []
+    for layername in layernames:
+        jobs.append(MHFarmJob(
+            "%s_%s" % (jobName, layername), "render", layername=layername, frames=frames, framesPerTask=framesPerTask
+        ))
+
+    if masterJob and jobs:
+        jobs.append(MHFarmJob("%s_master" % jobName, "master", dependencies=[j.name for j in jobs]))
+
+    return jobs
+
+
+class MHFarmManager(object):
+    """Submits a job graph. Subclasses implement submitJob."""
+
+    name = ""
+
+    def submitJobs(self, jobs):
+        """
+        Submit the jobs in order, passing the ids of their dependencies.
+        Returns "Result=Success" or the first error.
+        """
+        byName = {}
+        for job in jobs:
+            missing = [d for d in job.dependencies if d not in byName or byName[d].jobId is None]
+            if missing:
+                return "job %s depends on jobs that weren't submitted: %s" % (job.name, ", ".join(missing))
+
+            dependencyIds = [byName[d].jobId for d in job.dependencies]
+            job.result = self.submitJob(job, dependencyIds)
+            if not job.result or "Result=Success" not in job.result:
+                return "couldn't submit %s: %s" % (job.name, job.result)
+
+            byName[job.name] = job
+
+        return "Result=Success"
+
+    def submitJob(self, job, dependencyIds):
+        """Submit one job and set job.jobId. Returns "Result=Success" or an error."""
+        raise NotImplementedError
+
+
+class MHLocalFarmManager(MHFarmManager):
+    """
+    Stand-in farm, keeps the submitted graph in memory so a per layer
+    submission can be checked without a render manager, and can run it on
+    this machine in dependency order.
+
+    Args:
+        runners: {job kind: callable(job) -> "Result=Success" or error}
+    """
+
+    name = "MH Local (stand-in)"
+
+    def __init__(self, runners=None):
+        self.runners = runners or {}
+        self.counter = itertools.count(1)
+        # [(jobId, job, dependencyIds)]
+        self.queue = []
+        # {jobId: "Result=Success", error or "skipped"}
+        self.results = {}
+
+    def submitJob(self, job, dependencyIds):
+        known = set(jobId for jobId, _, _ in self.queue)
+        unknown = [d for d in dependencyIds if d not in known]
+        if unknown:
+            return "unknown dependencies: %s" % ", ".join(unknown)
+
+        job.jobId = "local-%s" % next(self.counter)
+        self.queue.append((job.jobId, job, list(dependencyIds)))
+        logger.debug("stand-in farm: queued %s as %s (%s tasks)" % (job.name, job.jobId, len(job.getTasks())))
+        return "Result=Success"
+
+    def run(self):
+        """
+        Run the queued jobs in submission order, which respects the
+        dependencies. Jobs whose dependencies failed are skipped, like a
+        farm would keep them pending. Returns "Result=Success" or the errors.
+        """
+        errors = []
+        for jobId, job, dependencyIds in self.queue:
+            if jobId in self.results:
+                continue
+
+            if any(self.results.get(d) != "Result=Success" for d in dependencyIds):
+                self.results[jobId] = "skipped"
+                errors.append("%s: skipped, a dependency failed" % job.name)
+                continue
+
+            runner = self.runners.get(job.kind)
+            result = runner(job) if runner else "Result=Success"
+            self.results[jobId] = result if result and "Result=Success" in result else (result or "failed")
+            if self.results[jobId] != "Result=Success":
+                errors.append("%s: %s" % (job.name, self.results[jobId]))
+
+        return "\n".join(errors) if errors else "Result=Success"
+
+
+class MHPrismFarmManager(MHFarmManager):
+    """
+    Submits the render jobs through the Prism render farm plugin of the
+    state. submitLayer(job, dependencyIds, handleMaster) does the actual
+    submission and returns (result, jobId).
+
+    Prism farm plugins only handle master updates as a dependent job of a
+    submission, so the master job is attached to the last render job, which
+    gets the ids of all other render jobs as dependencies. The plugin has to
+    take a dependencies argument and return a JobID for every job.
+    """
+
+    def __init__(self, plugin, submitLayer):
+        self.plugin = plugin
+        self.name = getattr(plugin, "pluginName", "")
+        self.submitLayer = submitLayer
+        self.pendingMaster = None
+        # {job name: farm job id or None} of the submitted render jobs
+        self.renderJobIds = {}
+
+    def submitJobs(self, jobs):
+        renderJobs = [j for j in jobs if j.kind == "render"]
+        masterJobs = [j for j in jobs if j.kind == "master"]
+        self.pendingMaster = masterJobs[0] if masterJobs else None
+        self.renderJobIds = {}
+        result = super(MHPrismFarmManager, self).submitJobs(renderJobs)
+        if self.pendingMaster and renderJobs and renderJobs[-1].jobId is not None:
+            self.pendingMaster.jobId = renderJobs[-1].jobId
+            self.pendingMaster.result = result
+
+        return result
+
+    def submitJob(self, job, dependencyIds):
+        isLast = self.pendingMaster is not None and job.name == self.pendingMaster.dependencies[-1]
+        if isLast:
+            # The master update rides on this job, it must wait for the other layers
+            missing = [name for name, jobId in self.renderJobIds.items() if jobId is None]
+            if missing:
+                return "no job id was returned for %s, the master update can't wait for it" % ", ".join(missing)
+
+            dependencyIds = list(dependencyIds) + [i for i in self.renderJobIds.values() if i not in dependencyIds]
+
+        result, jobId = self.submitLayer(job, dependencyIds, isLast)
+        self.renderJobIds[job.name] = jobId
+        job.jobId = jobId or job.name
+        return result
@@ -14,6 +14,7 @@ from PrismUtils.Decorators import err_catcher
 
 from Prism_MHExtension_Integration import Prism_MHExtension_Integration
 from Prism_MHExtension_Products import Prism_MHExtension_Products
+from Prism_MHExtension_StateSaves import commitStateSaves
 
 logger = logging.getLogger(__name__)
 
@@ -43,9 +44,14 @@ class Prism_MHExtension_Functions(object):
         self.core.registerCallback("userSettings_loadUI", self.onUserSettings_loadUI, plugin=self)
         self.core.registerCallback("onStateManagerOpen", self.onStateManagerOpen, plugin=self)
         self.core.registerCallback("pluginLoaded", self.onPluginLoaded, plugin=self)
+        # Deferred state saves must be in the scene before it is written
+        self.core.registerCallback("preSaveScene", commitStateSaves, plugin=self)
+        self.core.registerCallback("postPublish", commitStateSaves, plugin=self)
 
         # Register callback for ProductBrowser (delegate to products manager)
         self.core.registerCallback("onProductBrowserOpen", self.productsManager.onProductBrowserOpen, plugin=self.plugin)
+        # Record exported versions in the master dependency index
+        self.core.registerCallback("postExport", self.productsManager.onPostExport, plugin=self.plugin)
 
         self.core.registerCallback("userSettings_saveSettings",self.userSettings_saveSettings,plugin=self.plugin,)
         self.core.registerCallback("userSettings_loadSettings",self.userSettings_loadSettings,plugin=self.plugin,)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+#
+# MH Extension - Icon Registry
+# Process-wide cache for the custom icons used by the MH Extension
+#
+
+import os
+import logging
+import threading
+
+from qtpy.QtCore import *
+from qtpy.QtGui import *
+from qtpy.QtWidgets import *
+
+logger = logging.getLogger(__name__)
+
+_registry = None
+
+
+def getIconRegistry(core):
+    """
+    Return the process-wide icon registry, creating it on first use.
+    """
+    global _registry
+    if _registry is None:
+        _registry = MHIconRegistry(core)
+
+    return _registry
+
+
+class MHIconRegistry(object):
+    """
+    Resolves and tints the MH Extension icons once per (path, theme color, size).
+
+    Icon files are resolved, decoded into QImages and tinted with the text
+    color of the palette in a background thread when the plugin loads, QImage
+    is safe to use off the UI thread. QIcon/QPixmap objects can only be
+    created on the UI thread, getIcon turns the prepared image into an icon
+    on first use and caches it. Icons whose image isn't ready yet are tinted
+    through core.media.getColoredIcon instead. The caches are dropped and the
+    images prepared again whenever the theme color changes.
+    """
+
+    def __init__(self, core):
+        self.core = core
+        self.iconsPath = os.path.join(
+            os.path.dirname(os.path.dirname(__file__)),
+            "Integrations",
+            "Icons"
+        )
+
+        self.lock = threading.Lock()
+        # {filename: absolute path or None if missing}
+        self.iconPaths = {}
+        # {(path, themeColor, size): QIcon}
+        self.icons = {}
+        # {(path, themeColor): tinted QImage}, filled by the preload thread
+        self.images = {}
+        self.themeColor = None
+        self.preloadThread = None
+
+    def preload(self, filenames=None):
+        """
+        Resolve, decode and tint the given icon files (all icons in the icons
+        folder by default) in a background thread, so the first Product
+        Browser refresh doesn't decode or tint them. Must be called on the UI
+        thread, which reads the theme color.
+        """
+        if self.preloadThread and self.preloadThread.is_alive():
+            return
+
+        self.preloadThread = threading.Thread(
+            target=self._preloadFiles, args=(filenames, self.getThemeColor()), name="MHIconPreload", daemon=True
+        )
+        self.preloadThread.start()
+
+    def _preloadFiles(self, filenames, themeColor):
+        try:
+            if filenames is None:
+                filenames = [f for f in os.listdir(self.iconsPath) if f.lower().endswith((".svg", ".png"))]
+
+            for filename in filenames:
+                path = self.resolveIconPath(filename)
+                if not path or themeColor is None:
+                    continue
+
+                image = self.loadTintedImage(path, themeColor)
+                if image is not None:
+                    with self.lock:
+                        self.images[(path, themeColor)] = image
+        except Exception as e:
+            logger.debug("Icon preload failed: %s" % e)
+
+    def loadTintedImage(self, path, themeColor):
+        """Return the icon decoded into a QImage and tinted with the theme color, None if it can't be read."""
+        image = QImageReader(path).read()
+        if image.isNull():
+            return None
+
+        image = image.convertToFormat(QImage.Format_ARGB32_Premultiplied)
+        painter = QPainter(image)
+        painter.setCompositionMode(QPainter.CompositionMode_SourceIn)
+        painter.fillRect(image.rect(), QColor(themeColor))
+        painter.end()
+        return image
+
+    def resolveIconPath(self, filename):
+        """
+        Return the absolute path of an icon in the MH Extension icons folder,
+        or None if it doesn't exist. Results are cached.
+        """
+        with self.lock:
+            if filename in self.iconPaths:
+                return self.iconPaths[filename]
+
+        path = os.path.join(self.iconsPath, filename)
+        if not os.path.exists(path):
+            logger.warning("Icon not found at: %s" % path)
+            path = None
+
+        with self.lock:
+            self.iconPaths[filename] = path
+
+        return path
+
+    def getThemeColor(self):
+        """Return a key identifying the current UI theme (text color of the app palette)."""
+        app = QApplication.instance()
+        if not app:
+            return None
+
+        return app.palette().color(QPalette.Text).name()
+
+    def getIcon(self, filename, size=None):
+        """
+        Return the tinted QIcon for an icon file, or None if the file is missing.
+        Must be called on the UI thread.
+
+        Args:
+            filename: Icon file name inside the MH Extension icons folder
+            size: Optional edge length in pixels to rasterize the icon at
+        """
+        path = self.resolveIconPath(filename)
+        if not path:
+            return None
+
+        themeColor = self.getThemeColor()
+        if themeColor != self.themeColor:
+            # The first call only records the theme the preload used
+            if self.themeColor is not None:
+                logger.debug("Theme changed, clearing icon cache")
+                self.invalidate()
+                self.preload()
+
+            self.themeColor = themeColor
+
+        key = (path, themeColor, size)
+        icon = self.icons.get(key)
+        if icon is None:
+            with self.lock:
+                image = self.images.get((path, themeColor))
+
+            if image is not None:
+                icon = QIcon(QPixmap.fromImage(image))
+            else:
+                icon = self.core.media.getColoredIcon(path)
+
+            if size:
+                icon = QIcon(icon.pixmap(size, size))
+
+            self.icons[key] = icon
+
+        return icon
+
+    def invalidate(self):
+        """Drop all cached icons and images. Resolved paths are kept."""
+        self.icons = {}
+        with self.lock:
+            self.images = {}
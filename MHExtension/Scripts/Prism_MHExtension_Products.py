@@ -5,6 +5,8 @@
 #
 
 import os
+import re
+import time
 import inspect
 import logging
 import shutil
@@ -17,6 +19,9 @@ from qtpy.QtWidgets import *
 
 from PrismUtils.Decorators import err_catcher
 
+from Prism_MHExtension_Icons import getIconRegistry
+from Prism_MHExtension_DependencyIndex import MHDependencyIndex
+
 logger = logging.getLogger(__name__)
 
 
@@ -37,19 +42,37 @@ class Prism_MHExtension_Products:
             "Icons"
         )
 
+        # Memoized stored product groups per entity: {entityKey: {productName: group}}
+        self.productGroupCache = {}
+        # Entity of the last refresh, the memo only spans refreshes of the same entity
+        self.productGroupEntity = None
+
+        # Project-level index of masters and what they reference
+        self.dependencyIndex = MHDependencyIndex(core)
+
+        # Process-wide icon cache, warmed in the background while Prism loads
+        self.iconRegistry = getIconRegistry(core)
+        self.iconRegistry.preload()
+
     @err_catcher(name=__name__)
     def onProductBrowserOpen(self, productBrowser):
         """
-        Callback when ProductBrowser opens. Monkey patches the updateIdentifiers method
-        to automatically group usdlayer_* products under ASSET products.
+        Callback when ProductBrowser opens. Monkey patches the getIdentifiers method
+        to automatically group usdlayer_* products under ASSET products (in memory,
+        see applyProductGrouping) and times every updateIdentifiers refresh.
         ASSET will appear as both a selectable product AND a group containing usdlayer items.
         """
         logger.debug("ProductBrowser opened - applying ASSET grouping logic")
 
+        # Groups may have been edited since the last browser was open
+        self.clearProductGroupCache()
+
         # Store the original updateIdentifiers method
         original_updateIdentifiers = productBrowser.updateIdentifiers
         # Store the original createGroupItems method
         original_createGroupItems = productBrowser.createGroupItems
+        # Store the original getIdentifiers method
+        original_getIdentifiers = productBrowser.getIdentifiers
 
         # Wrapper for createGroupItems to handle ASSET as both item and group
         def custom_createGroupItems(identifiers):
@@ -69,74 +92,171 @@ class Prism_MHExtension_Products:
                 assetGroupItem.setText(0, "ASSET")
 
                 # Set custom icon for ASSET
-                iconPath = os.path.join(self.iconsPath, "addasset.svg")
-                if os.path.exists(iconPath):
-                    icon = self.core.media.getColoredIcon(iconPath)
+                icon = self.getCustomProductIcon("ASSET")
+                if icon:
                     assetGroupItem.setIcon(0, icon)
-                    logger.debug(f"Set custom icon for ASSET from: {iconPath}")
-                else:
-                    logger.warning(f"ASSET icon not found at: {iconPath}")
 
                 logger.debug("Modified ASSET to be both group and selectable product")
 
             return groups, groupItems
 
-        # Create wrapper function that adds our custom grouping logic
+        # Group usdlayer_* products under ASSET in memory every time the browser
+        # reads its identifiers, instead of writing group configs on each refresh
+        def custom_getIdentifiers(*args, **kwargs):
+            identifiers = original_getIdentifiers(*args, **kwargs)
+            entity = getattr(productBrowser, "getCurrentEntity", lambda: None)()
+            return self.applyProductGrouping(identifiers, entity=entity)
+
+        # Resolve once how the original updateIdentifiers has to be called
+        # (Prism versions differ in whether it takes an 'item' parameter)
+        call_updateIdentifiers = self._resolveUpdateIdentifiersAdapter(original_updateIdentifiers)
+
+        # Create wrapper function that times every refresh
         def custom_updateIdentifiers(item=None, restoreSelection=False):
-            # Get all identifiers before modification
-            identifiers = productBrowser.getIdentifiers()
-
-            # Auto-group usdlayer_* products under ASSET
-            hasUsdLayers = False
-            for identifierName in list(identifiers.keys()):
-                # Check if this is a usdlayer_* product
-                if identifierName.startswith("usdlayer_"):
-                    hasUsdLayers = True
-                    # Check if ASSET product exists in the same entity
-                    if "ASSET" in identifiers:
-                        # Set the group for this usdlayer product
-                        self.core.products.setProductsGroup(
-                            [identifiers[identifierName]],
-                            group="ASSET"
-                        )
-                        logger.debug(f"Auto-grouped {identifierName} under ASSET")
-
-            # If ASSET has usdlayer children, mark it as a group to prevent duplicate
-            # The custom_createGroupItems will convert it to a hybrid item/group
-            if hasUsdLayers and "ASSET" in identifiers:
-                # Mark ASSET as a group so it won't appear as a standalone item
-                # It will only appear through the group item created in custom_createGroupItems
-                self.core.products.setProductsGroup(
-                    [identifiers["ASSET"]],
-                    group="ASSET"  # Group it under itself
-                )
-                logger.debug("Marked ASSET as group to prevent duplicate display")
+            startTime = time.perf_counter()
 
-            # Call the original updateIdentifiers method
-            # Handle both function signatures (with or without 'item' parameter)
             try:
-                sig = inspect.signature(original_updateIdentifiers)
-                params = list(sig.parameters.keys())
-
-                # Call with appropriate parameters based on signature
-                if 'item' in params:
-                    original_updateIdentifiers(item=item, restoreSelection=restoreSelection)
-                else:
-                    original_updateIdentifiers(restoreSelection=restoreSelection)
-            except:
-                # Fallback: try calling with just restoreSelection
-                try:
-                    original_updateIdentifiers(restoreSelection=restoreSelection)
-                except:
-                    # Last resort: call with no arguments
-                    original_updateIdentifiers()
+                call_updateIdentifiers(item, restoreSelection)
+            except Exception:
+                # Keep the original exception for the callers and err_catcher
+                logger.warning(
+                    "Product Browser refresh failed in updateIdentifiers (item=%s, restoreSelection=%s)"
+                    % (item, restoreSelection)
+                )
+                raise
 
-        # Replace both methods with our custom versions
+            logger.debug("Product Browser refresh took %.1f ms" % ((time.perf_counter() - startTime) * 1000))
+
+        # Replace the methods with our custom versions
+        productBrowser.getIdentifiers = custom_getIdentifiers
         productBrowser.createGroupItems = custom_createGroupItems
         productBrowser.updateIdentifiers = custom_updateIdentifiers
 
         logger.debug("Product browser patches applied successfully")
 
+    def _resolveUpdateIdentifiersAdapter(self, updateIdentifiers):
+        """
+        Inspect the signature of the original updateIdentifiers once and return
+        a callable(item, restoreSelection) that forwards only supported arguments.
+        """
+        try:
+            params = inspect.signature(updateIdentifiers).parameters
+        except (TypeError, ValueError):
+            logger.debug("Couldn't inspect updateIdentifiers, forwarding all arguments")
+            return lambda item, restoreSelection: updateIdentifiers(item=item, restoreSelection=restoreSelection)
+
+        acceptsKwargs = any(p.kind == inspect.Parameter.VAR_KEYWORD for p in params.values())
+        if "item" in params or acceptsKwargs:
+            return lambda item, restoreSelection: updateIdentifiers(item=item, restoreSelection=restoreSelection)
+        elif "restoreSelection" in params:
+            return lambda item, restoreSelection: updateIdentifiers(restoreSelection=restoreSelection)
+        else:
+            return lambda item, restoreSelection: updateIdentifiers()
+
+    @err_catcher(name=__name__)
+    def getProductGrouping(self, identifiers):
+        """
+        Compute the group every product of an entity should be displayed in.
+        Returns a dict {productName: group} for the products that get auto-grouped.
+        """
+        if "ASSET" not in identifiers:
+            return {}
+
+        grouping = {}
+        for identifierName in identifiers:
+            if self.isGroupableProduct(identifierName) == "ASSET":
+                grouping[identifierName] = "ASSET"
+
+        # If ASSET has usdlayer children, mark it as a group to prevent duplicate
+        # The custom_createGroupItems will convert it to a hybrid item/group
+        if grouping:
+            grouping["ASSET"] = "ASSET"
+
+        return grouping
+
+    @err_catcher(name=__name__)
+    def applyProductGrouping(self, identifiers, entity=None):
+        """
+        Apply the auto-grouping to the identifiers in memory (view only) and
+        persist group configs only for products whose stored group differs.
+
+        The stored groups are memoized while the same entity is refreshed, so
+        repeated refreshes don't read or write any config files once they are
+        in sync. Switching the entity drops its memo, groups edited elsewhere
+        are read again, and products that appeared since are read before
+        anything is written.
+        """
+        grouping = self.getProductGrouping(identifiers)
+        if not grouping:
+            return identifiers
+
+        entityKey = self.getEntityCacheKey(entity, identifiers)
+        if entityKey is None:
+            # Unknown entity, read the stored groups every time
+            storedGroups = {}
+        else:
+            if entityKey != self.productGroupEntity:
+                self.productGroupCache.pop(entityKey, None)
+                self.productGroupEntity = entityKey
+
+            storedGroups = self.productGroupCache.setdefault(entityKey, {})
+
+        for identifierName in grouping:
+            if identifierName not in storedGroups:
+                storedGroups[identifierName] = self.getStoredProductGroup(identifiers[identifierName])
+
+        outdated = [name for name, group in grouping.items() if storedGroups.get(name) != group]
+        for identifierName in outdated:
+            self.core.products.setProductsGroup(
+                [identifiers[identifierName]],
+                group=grouping[identifierName]
+            )
+            storedGroups[identifierName] = grouping[identifierName]
+            logger.debug(f"Auto-grouped {identifierName} under {grouping[identifierName]}")
+
+        for identifierName, group in grouping.items():
+            if isinstance(identifiers[identifierName], dict):
+                identifiers[identifierName]["group"] = group
+
+        return identifiers
+
+    @err_catcher(name=__name__)
+    def getStoredProductGroup(self, product):
+        """Read the group a product currently has stored in its config."""
+        getGroup = getattr(self.core.products, "getGroupFromProduct", None)
+        if getGroup:
+            return getGroup(product)
+
+        return product.get("group") if isinstance(product, dict) else None
+
+    @err_catcher(name=__name__)
+    def getEntityCacheKey(self, entity, identifiers):
+        """
+        Build a hashable key from the identifying fields of the entity the
+        identifiers belong to, the first product stands in without entity.
+        Returns None and logs a warning if there is nothing to identify it by.
+        """
+        if not entity:
+            entity = next(iter(identifiers.values()), None)
+
+        if not isinstance(entity, dict):
+            logger.warning("Product groups of %r aren't memoized, it isn't an entity" % (entity,))
+            return None
+
+        keys = ["type", "asset_path", "sequence", "shot", "episode"]
+        entityKey = tuple((key, str(entity[key])) for key in keys if entity.get(key) is not None)
+        if not entityKey:
+            logger.warning("Product groups of %r aren't memoized, the entity has no identifying fields" % (entity,))
+            return None
+
+        return entityKey
+
+    @err_catcher(name=__name__)
+    def clearProductGroupCache(self):
+        """Forget the memoized product groups, e.g. after groups were edited manually."""
+        self.productGroupCache = {}
+        self.productGroupEntity = None
+
     @err_catcher(name=__name__)
     def getCustomProductIcon(self, productName):
         """
@@ -149,11 +269,7 @@ class Prism_MHExtension_Products:
         }
 
         if productName in iconMapping:
-            iconPath = os.path.join(self.iconsPath, iconMapping[productName])
-            if os.path.exists(iconPath):
-                return self.core.media.getColoredIcon(iconPath)
-            else:
-                logger.warning(f"Icon not found for {productName} at: {iconPath}")
+            return self.iconRegistry.getIcon(iconMapping[productName])
 
         return None
 
@@ -201,9 +317,14 @@ class Prism_MHExtension_Products:
             # Not a USD file OR user disabled USD reference mode - use original behavior
             reason = f"Non-USD file {ext}" if not isUsdFile else f"USD references disabled in settings"
             logger.debug(f"{reason}, using original updateMasterVersion")
-            return self.core.plugins.callUnpatchedFunction(
+            masterPath = self.core.plugins.callUnpatchedFunction(
                 self.core.products.updateMasterVersion, path
             )
+            if masterPath:
+                data = self.core.paths.getCachePathData(path)
+                self.recordMasterDependencies(masterPath, path, data, refs=[])
+
+            return masterPath
 
         logger.debug(f"USD file detected ({ext}), creating reference-based master version")
 
@@ -278,12 +399,18 @@ class Prism_MHExtension_Products:
         # Read metadata from source file if it exists (for proper metadata)
         metadata = self._extractUsdMetadata(path)
 
+        # ASSET masters also aggregate the current master of every usdlayer_* product
+        layerRefs = []
+        if productName == "ASSET":
+            layerRefs = self._getUsdLayerMasterRefs(data, location, masterDir)
+
         # Create USD reference file content
         usdContent = self._generateUsdReferenceFile(
             relPath=relPath,
             defaultPrim=defaultPrim,
             metadata=metadata,
-            sourceVersion=origVersion
+            sourceVersion=origVersion,
+            layerRefs=layerRefs,
         )
 
         # Write the USD reference file
@@ -348,9 +475,177 @@ class Prism_MHExtension_Products:
             logger.debug(f"Copied additional file: {file}")
 
         self.core.configs.clearCache(path=masterInfoPath)
+        self.recordMasterDependencies(masterPath, path, data)
         self.core.callback(name="masterVersionUpdated", args=[masterPath])
+
+        # A new usdlayer master changes what the ASSET aggregate has to reference
+        if productName.startswith("usdlayer_"):
+            self.updateAssetAggregate(data, location)
+
         return masterPath
 
+    @err_catcher(name=__name__)
+    def updateAssetAggregate(self, entity, location):
+        """
+        Regenerate the ASSET master of an entity so it references the current
+        master of every usdlayer_* product next to the ASSET versioned file.
+
+        Only the ASSET master is touched and the file is only rewritten when its
+        content actually changes. Entities without an ASSET master are skipped.
+
+        Args:
+            entity: Entity/product data of the product whose master changed
+            location: Product location used for the master paths
+
+        Returns:
+            The ASSET master path if it was rewritten, None otherwise
+        """
+        assetData = entity.copy()
+        assetData["product"] = "ASSET"
+        assetMasterPath = self.core.products.generateProductPath(
+            entity=assetData,
+            task="ASSET",
+            extension=".usda",
+            version="master",
+            location=location,
+        )
+        if not assetMasterPath or not os.path.exists(assetMasterPath):
+            logger.debug("no ASSET master to aggregate for: %s" % (entity.get("asset") or entity.get("shot")))
+            return
+
+        with open(assetMasterPath, "r", encoding="utf-8", errors="ignore") as f:
+            content = f.read()
+
+        masterRefs = self._readUsdMasterReferences(content)
+        primMatch = re.search(r'defaultPrim\s*=\s*"([^"]+)"', content)
+        if not masterRefs or not primMatch or "Generated by Prism Pipeline - MH Extension" not in content:
+            logger.debug("ASSET master was not generated by the MH Extension, skipping aggregate: %s" % assetMasterPath)
+            return
+
+        # By convention the ASSET versioned file is always the last (weakest) reference
+        masterDir = os.path.dirname(assetMasterPath)
+        masterInfoPath = self.core.getVersioninfoPath(
+            self.core.products.getVersionInfoPathFromProductFilepath(assetMasterPath)
+        )
+        sourceVersion = self.core.getConfig("sourceVersion", configPath=masterInfoPath)
+        usdContent = self._generateUsdReferenceFile(
+            relPath=masterRefs[-1],
+            defaultPrim=primMatch.group(1),
+            metadata=self._extractUsdMetadata(assetMasterPath),
+            sourceVersion=sourceVersion,
+            layerRefs=self._getUsdLayerMasterRefs(assetData, location, masterDir),
+        )
+
+        if usdContent == content:
+            logger.debug("ASSET aggregate is up to date: %s" % assetMasterPath)
+            return
+
+        with open(assetMasterPath, "w") as f:
+            f.write(usdContent)
+
+        sourcePath = os.path.normpath(os.path.join(masterDir, masterRefs[-1]))
+        self.recordMasterDependencies(assetMasterPath, sourcePath, dict(assetData, version=sourceVersion))
+        logger.debug("Updated ASSET aggregate master: %s" % assetMasterPath)
+        return assetMasterPath
+
+    def recordMasterDependencies(self, masterPath, sourcePath, data, refs=None):
+        """
+        Record a master, the version it points to and the files it references
+        in the project dependency index. Failures are logged and never block
+        the master update.
+        """
+        try:
+            entity = data.get("asset_path") or data.get("asset") or self.core.entities.getShotName(data)
+            self.dependencyIndex.recordMaster(
+                masterPath,
+                sourcePath,
+                data.get("version"),
+                product=data.get("product"),
+                entity=entity,
+                refs=refs,
+            )
+        except Exception as e:
+            logger.warning("Failed to update the master dependency index for %s: %s" % (masterPath, e))
+
+    @err_catcher(name=__name__)
+    def onPostExport(self, *args, **kwargs):
+        """Record every exported product version so stale masters can be queried."""
+        outputPath = kwargs.get("outputpath")
+        if not outputPath:
+            return
+
+        version = self.core.paths.getCachePathData(outputPath).get("version")
+        try:
+            self.dependencyIndex.recordVersion(outputPath, version)
+        except Exception as e:
+            logger.warning("Failed to record version in the dependency index for %s: %s" % (outputPath, e))
+
+    @err_catcher(name=__name__)
+    def getMasterDependents(self, path, recursive=True):
+        """
+        Return the masters (e.g. ASSET aggregates) that depend on a product
+        version, master or product folder, according to the dependency index.
+        """
+        return self.dependencyIndex.getDependents(path, recursive=recursive)
+
+    @err_catcher(name=__name__)
+    def getStaleMasters(self):
+        """Return the masters that point to an older version than the latest recorded one."""
+        return self.dependencyIndex.getStaleMasters()
+
+    def _getUsdLayerMasterRefs(self, entity, location, masterDir):
+        """
+        Collect relative paths (from masterDir) to the current master file of
+        every usdlayer_* product of the entity, sorted by product name.
+        """
+        products = self.core.products.getProductsFromEntity(entity) or []
+        layerNames = set()
+        for product in products:
+            name = product.get("product") if isinstance(product, dict) else product
+            if name and name.startswith("usdlayer_"):
+                layerNames.add(name)
+
+        refs = []
+        for layerName in sorted(layerNames):
+            layerData = entity.copy()
+            layerData["product"] = layerName
+            layerMasterPath = self.core.products.generateProductPath(
+                entity=layerData,
+                task=layerName,
+                extension=".usda",
+                version="master",
+                location=location,
+            )
+            layerMasterDir = os.path.dirname(layerMasterPath or "")
+            if not layerMasterPath or not os.path.isdir(layerMasterDir):
+                continue
+
+            # Masters created with USD references disabled keep the source extension
+            masterFile = None
+            if os.path.exists(layerMasterPath):
+                masterFile = layerMasterPath
+            else:
+                for file in sorted(os.listdir(layerMasterDir)):
+                    if os.path.splitext(file)[1].lower() in ['.usda', '.usdc', '.usd']:
+                        masterFile = os.path.join(layerMasterDir, file)
+                        break
+
+            if masterFile:
+                refs.append(os.path.relpath(masterFile, masterDir).replace("\\", "/"))
+
+        return refs
+
+    def _readUsdMasterReferences(self, content):
+        """
+        Return the asset paths of the references authored on the defaultPrim of
+        a master generated by _generateUsdReferenceFile.
+        """
+        match = re.search(r'prepend references = (\[[^\]]*\]|@[^@]*@)', content)
+        if not match:
+            return []
+
+        return re.findall(r'@([^@]*)@', match.group(1))
+
     def _extractUsdMetadata(self, usdPath):
         """
         Extract metadata from a USD file (fps, metersPerUnit, upAxis, etc.)
@@ -398,7 +693,7 @@ class Prism_MHExtension_Products:
 
         return metadata
 
-    def _generateUsdReferenceFile(self, relPath, defaultPrim, metadata, sourceVersion):
+    def _generateUsdReferenceFile(self, relPath, defaultPrim, metadata, sourceVersion, layerRefs=None):
         """
         Generate USD reference file content.
 
@@ -407,6 +702,8 @@ class Prism_MHExtension_Products:
             defaultPrim: Name of the default prim
             metadata: Dict with fps, metersPerUnit, upAxis, etc.
             sourceVersion: The source version number (e.g., "v0024")
+            layerRefs: Optional relative paths to usdlayer_* masters. They are
+                referenced before (stronger than) the versioned file.
 
         Returns:
             String containing the USD ASCII file content
@@ -416,6 +713,12 @@ class Prism_MHExtension_Products:
         timeCodesPerSecond = metadata.get("timeCodesPerSecond", 24)
         upAxis = metadata.get("upAxis", "Y")
 
+        if layerRefs:
+            refLines = ",\n".join("        @%s@" % ref for ref in list(layerRefs) + [relPath])
+            references = "[\n%s\n    ]" % refLines
+        else:
+            references = "@%s@" % relPath
+
         usdContent = f'''#usda 1.0
 (
     defaultPrim = "{defaultPrim}"
@@ -427,7 +730,7 @@ class Prism_MHExtension_Products:
 )
 
 def "{defaultPrim}" (
-    prepend references = @{relPath}@
+    prepend references = {references}
 )
 {{
 }}
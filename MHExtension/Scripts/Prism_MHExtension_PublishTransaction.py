@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#
+# MH Extension - Publish transaction
+# Records the scene and disk changes of a render publish so a failed
+# publish can be rolled back.
+#
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class MHPublishTransaction(object):
+    """
+    Undo log of a publish: attribute changes (scene properties, node paths),
+    created folders and written files, plus timing spans of its phases.
+
+    Changes are applied immediately and recorded. rollback() reverts them
+    in reverse order, commit() forgets them. Rolling back only removes
+    folders that are empty by then, so frames rendered before a failure
+    are never deleted, and keeps the written files (versioninfo) of the
+    folders holding such frames. Saving the scene can't be reverted and
+    is only timed.
+
+    Recording is thread safe, the version resolution workers record the
+    folders and versioninfo files they create.
+
+        with transaction:
+            transaction.setAttr(node, "base_path", path)
+            ...
+    """
+
+    def __init__(self, name=""):
+        self.name = name
+        self.lock = threading.Lock()
+        # [(description, undo callable)]
+        self.undoLog = []
+        # [(span name, seconds)]
+        self.timings = []
+        # Files written in trackFiles contexts, normalized
+        self.writtenFiles = set()
+        # Folder of the keepIfRendered context of each thread
+        self.guards = threading.local()
+        self.state = "open"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        if self.state != "open":
+            return False
+
+        if excType is None:
+            self.commit()
+        else:
+            self.rollback()
+
+        return False
+
+    @contextmanager
+    def span(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.timings.append((name, time.time() - start))
+
+    @contextmanager
+    def keepIfRendered(self, folder):
+        """
+        Undos recorded by this thread in the context are skipped by rollback
+        if the folder holds rendered files by then. A layer that got frames
+        before a failure keeps its paths, the next publish resumes into it.
+        """
+        self.guards.folder = folder
+        try:
+            yield
+        finally:
+            self.guards.folder = None
+
+    def recordUndo(self, description, undo):
+        folder = getattr(self.guards, "folder", None)
+        if folder:
+            undo = self.skipIfRendered(folder, undo)
+
+        with self.lock:
+            self.undoLog.append((description, undo))
+
+    def setAttr(self, obj, attr, value):
+        """Set an attribute and record its previous value. Unchanged values aren't recorded."""
+        old = getattr(obj, attr)
+        if old == value:
+            return
+
+        setattr(obj, attr, value)
+        self.recordUndo("%s.%s" % (getattr(obj, "name", obj), attr), lambda: setattr(obj, attr, old))
+
+    def makedirs(self, path):
+        """Create a folder and its missing parents, recording the created ones."""
+        missing = []
+        current = os.path.normpath(path)
+        while current and not os.path.exists(current):
+            missing.append(current)
+            parent = os.path.dirname(current)
+            if parent == current:
+                break
+
+            current = parent
+
+        if not missing:
+            return
+
+        os.makedirs(path, exist_ok=True)
+        # Deepest folder first when undoing, the undo log runs in reverse
+        for folder in reversed(missing):
+            self.recordUndo("mkdir " + folder, lambda folder=folder: self.removeEmptyDir(folder))
+
+    def removeEmptyDir(self, path):
+        if os.path.isdir(path) and not os.listdir(path):
+            os.rmdir(path)
+
+    @contextmanager
+    def trackFiles(self, folder):
+        """Record the files created in a folder while the context runs (e.g. versioninfo files)."""
+        before = set(os.listdir(folder)) if os.path.isdir(folder) else set()
+        yield
+        after = set(os.listdir(folder)) if os.path.isdir(folder) else set()
+        for filename in sorted(after - before):
+            path = os.path.normpath(os.path.join(folder, filename))
+            with self.lock:
+                self.writtenFiles.add(path)
+
+            self.recordUndo("write " + path, lambda path=path, folder=folder: self.removeWrittenFile(path, folder))
+
+    def skipIfRendered(self, folder, undo):
+        return lambda: self.hasRenderedFiles(folder) or undo()
+
+    def removeWrittenFile(self, path, folder):
+        # A folder that got frames before the failure is a version, it keeps its versioninfo
+        if os.path.isfile(path) and not self.hasRenderedFiles(folder):
+            os.remove(path)
+
+    def hasRenderedFiles(self, folder):
+        """Return True if the folder or its subfolders hold files the transaction didn't write."""
+        for root, dirs, files in os.walk(folder):
+            for filename in files:
+                if os.path.normpath(os.path.join(root, filename)) not in self.writtenFiles:
+                    return True
+
+        return False
+
+    def commit(self):
+        with self.lock:
+            self.undoLog = []
+            self.writtenFiles = set()
+            self.state = "committed"
+
+        logger.debug("publish %s committed: %s" % (self.name, self.formatTimings()))
+
+    def rollback(self):
+        """Revert all recorded changes, newest first. Returns the descriptions of the failed undos."""
+        with self.lock:
+            undoLog = self.undoLog
+            self.undoLog = []
+            self.state = "rolledback"
+
+        failed = []
+        for description, undo in reversed(undoLog):
+            try:
+                undo()
+            except Exception as e:
+                logger.warning("couldn't undo %s: %s" % (description, e))
+                failed.append(description)
+
+        logger.info("publish %s rolled back %s changes: %s" % (self.name, len(undoLog) - len(failed), self.formatTimings()))
+        return failed
+
+    def formatTimings(self):
+        return ", ".join("%s %.2fs" % (name, seconds) for name, seconds in self.timings)
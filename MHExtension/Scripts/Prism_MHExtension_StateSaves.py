@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+# MH Extension - Coalesced state saves
+# Serializes the State Manager states into the scene once per event loop
+# iteration instead of once per widget change.
+#
+
+import logging
+import weakref
+from contextlib import contextmanager
+
+from qtpy.QtCore import QTimer
+
+logger = logging.getLogger(__name__)
+
+# Schedulers of the open State Managers, see commitStateSaves
+_schedulers = weakref.WeakSet()
+
+
+class MHStateSaveScheduler(object):
+    """
+    Coalesces the saveStatesToScene calls of a State Manager.
+
+    request() only marks the states dirty and schedules a save on the next
+    event loop iteration, so a burst of widget signals or the layers of an
+    execute serialize the states once. commit() saves immediately if
+    dirty, for the points where the scene is written (publish, scene save).
+    Inside batch() no save runs until the outermost batch exits.
+
+    Requests are ignored while the State Manager has saving disabled (e.g.
+    while it loads the states), like saveStatesToScene does.
+    """
+
+    def __init__(self, stateManager):
+        self.stateManager = stateManager
+        self.dirty = False
+        self.scheduled = False
+        self.batchDepth = 0
+        self.requests = 0
+        self.saves = 0
+        _schedulers.add(self)
+
+    def request(self, *args):
+        """Mark the states dirty. Accepts and ignores signal arguments so it can be connected directly."""
+        if not getattr(self.stateManager, "saveEnabled", True):
+            return
+
+        self.requests += 1
+        self.dirty = True
+        if self.batchDepth or self.scheduled:
+            return
+
+        self.scheduled = True
+        QTimer.singleShot(0, self._onTick)
+
+    def _onTick(self):
+        self.scheduled = False
+        if self.batchDepth:
+            return
+
+        try:
+            self.commit()
+        except RuntimeError:
+            # The State Manager was closed before the event loop ran
+            logger.debug("state manager closed before the states were saved")
+
+    def commit(self):
+        """Save the states now if they are dirty. Returns True if they were saved."""
+        if not self.dirty:
+            return False
+
+        self.dirty = False
+        self.saves += 1
+        self.stateManager.saveStatesToScene()
+        logger.debug("states saved: %(requests)s requests, %(saves)s saves, %(avoided)s avoided" % self.getStats())
+        return True
+
+    @contextmanager
+    def batch(self):
+        self.batchDepth += 1
+        try:
+            yield self
+        finally:
+            self.batchDepth -= 1
+            if not self.batchDepth:
+                self.commit()
+
+    def getStats(self):
+        """Return {"requests", "saves", "avoided"}."""
+        return {
+            "requests": self.requests,
+            "saves": self.saves,
+            "avoided": max(0, self.requests - self.saves - int(self.dirty)),
+        }
+
+
+def getStateSaveScheduler(stateManager):
+    """Return the save scheduler of a State Manager, created on first use."""
+    scheduler = getattr(stateManager, "mhStateSaves", None)
+    if scheduler is None:
+        scheduler = MHStateSaveScheduler(stateManager)
+        stateManager.mhStateSaves = scheduler
+
+    return scheduler
+
+
+def commitStateSaves(*args, **kwargs):
+    """Save the dirty states of all State Managers, used before the scene is written."""
+    for scheduler in list(_schedulers):
+        try:
+            scheduler.commit()
+        except RuntimeError:
+            pass
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+# MH Extension - Version allocator
+# Publish scoped allocation of the next media version per identifier, from a
+# single listing of each render root.
+#
+
+import os
+import re
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class MHVersionAllocator(object):
+    """
+    Hands out the next version of every identifier rendered by one publish.
+
+    The render root of an entity (the folder holding the identifier folders)
+    is found by generating the path of a fixed version, which doesn't scan
+    the disk. The root is then listed once, and each existing identifier
+    folder once, on first use. All layers of the publish get their versions
+    from that snapshot, so the version folders created while the publish
+    runs don't change the result, and layers sharing an identifier get the
+    same version.
+
+    Thread safe, allocate() can be called from the version resolution workers.
+    """
+
+    def __init__(self, core):
+        self.core = core
+        self.lock = threading.Lock()
+        # {render root: set of identifier folder names}
+        self.roots = {}
+        # {identifier folder: highest int version or 0}
+        self.highest = {}
+        # {identifier folder: allocated version name}
+        self.allocated = {}
+        self.listings = 0
+
+    def getVersionName(self, intVersion):
+        versionFormat = getattr(self.core, "versionFormat", None) or "v%04d"
+        return versionFormat % intVersion
+
+    def getIntVersion(self, versionName):
+        getInt = getattr(getattr(self.core, "products", None), "getIntVersionFromVersionName", None)
+        if getInt:
+            try:
+                intVersion = getInt(versionName)
+            except Exception:
+                intVersion = None
+
+            if intVersion is not None:
+                return intVersion
+
+        match = re.match(r"^v(\d+)", versionName)
+        return int(match.group(1)) if match else None
+
+    def getIdentifierFolder(self, probePath, probeVersion):
+        """Return the identifier folder of a path generated for probeVersion, None if not found."""
+        path = os.path.normpath(os.path.expandvars(probePath))
+        while True:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return
+
+            if os.path.basename(path).startswith(probeVersion):
+                return parent
+
+            path = parent
+
+    def listDir(self, path):
+        self.listings += 1
+        try:
+            return [e.name for e in os.scandir(path) if e.is_dir()]
+        except OSError:
+            return []
+
+    def allocate(self, generatePath):
+        """
+        Return the version to use for a job, or None if the render root
+        couldn't be derived (Prism then resolves the version itself).
+
+        Args:
+            generatePath: Callable taking a version name and returning the
+                generateMediaProductPath details of the job for that version
+        """
+        probeVersion = self.getVersionName(1)
+        identifierFolder = self.getIdentifierFolder(generatePath(probeVersion)["path"], probeVersion)
+        if not identifierFolder:
+            logger.debug("couldn't derive the render root, using the default version resolution")
+            return
+
+        root, identifier = os.path.split(identifierFolder)
+        with self.lock:
+            if identifierFolder in self.allocated:
+                return self.allocated[identifierFolder]
+
+            if root not in self.roots:
+                self.roots[root] = set(self.listDir(root))
+
+            exists = identifier in self.roots[root]
+
+        if identifierFolder not in self.highest:
+            versions = []
+            if exists:
+                for name in self.listDir(identifierFolder):
+                    intVersion = self.getIntVersion(name)
+                    if intVersion is not None:
+                        versions.append(intVersion)
+
+            self.highest.setdefault(identifierFolder, max(versions or [0]))
+
+        with self.lock:
+            version = self.allocated.setdefault(
+                identifierFolder, self.getVersionName(self.highest[identifierFolder] + 1)
+            )
+
+        return version
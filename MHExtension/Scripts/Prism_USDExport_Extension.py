@@ -10,6 +10,8 @@ classname = "USDExportExtension"
 from qtpy.QtWidgets import *
 from qtpy.QtCore import *
 
+from Prism_MHExtension_StateSaves import getStateSaveScheduler
+
 
 class USDExportExtension:
     def __init__(self, core):
@@ -191,14 +193,14 @@ class USDExportExtension:
         lo.addWidget(state.gb_usd)
 
         # Save settings when any USD option changes
-        state.cb_usdFormat.currentIndexChanged.connect(lambda: state.stateManager.saveStatesToScene())
-        state.chb_usdMaterials.toggled.connect(lambda: state.stateManager.saveStatesToScene())
-        state.chb_usdUVMaps.toggled.connect(lambda: state.stateManager.saveStatesToScene())
-        state.chb_usdNormals.toggled.connect(lambda: state.stateManager.saveStatesToScene())
-        state.chb_usdAnimation.toggled.connect(lambda: state.stateManager.saveStatesToScene())
-        state.chb_usdHair.toggled.connect(lambda: state.stateManager.saveStatesToScene())
-        state.chb_usdInstancing.toggled.connect(lambda: state.stateManager.saveStatesToScene())
-        state.cb_usdEvalMode.currentIndexChanged.connect(lambda: state.stateManager.saveStatesToScene())
+        state.cb_usdFormat.currentIndexChanged.connect(lambda: getStateSaveScheduler(state.stateManager).request())
+        state.chb_usdMaterials.toggled.connect(lambda: getStateSaveScheduler(state.stateManager).request())
+        state.chb_usdUVMaps.toggled.connect(lambda: getStateSaveScheduler(state.stateManager).request())
+        state.chb_usdNormals.toggled.connect(lambda: getStateSaveScheduler(state.stateManager).request())
+        state.chb_usdAnimation.toggled.connect(lambda: getStateSaveScheduler(state.stateManager).request())
+        state.chb_usdHair.toggled.connect(lambda: getStateSaveScheduler(state.stateManager).request())
+        state.chb_usdInstancing.toggled.connect(lambda: getStateSaveScheduler(state.stateManager).request())
+        state.cb_usdEvalMode.currentIndexChanged.connect(lambda: getStateSaveScheduler(state.stateManager).request())
 
         # Connect to the output type change to show/hide USD settings
         state.cb_outType.currentIndexChanged.connect(lambda: self.updateUSDVisibility(state))
@@ -36,12 +36,14 @@ import os
 import sys
 import time
 import platform
+import inspect
 
 from qtpy.QtCore import *
 from qtpy.QtGui import *
 from qtpy.QtWidgets import *
 
 from PrismUtils.Decorators import err_catcher
+from Prism_MHExtension_StateSaves import getStateSaveScheduler
 
 
 class MHRenderClass(object):
@@ -60,6 +62,7 @@ class MHRenderClass(object):
 		self.cb_context.addItems(["From scenefile", "Custom"])
 		
 		self.pluginMHfunctions = self.core.getPlugin("MHExtension").blendFunctions
+		self.stateSaves = getStateSaveScheduler(self.stateManager)
 
 		self.curCam = None
 		self.renderingStarted = False
@@ -119,6 +122,7 @@ class MHRenderClass(object):
 		]
 
 		self.cb_format.addItems(self.outputFormats)
+		self.addLocalRenderWidget()
 
 		self.resolutionPresets = self.core.projects.getResolutionPresets()
 		if "Get from rendersettings" not in self.resolutionPresets:
@@ -137,6 +141,10 @@ class MHRenderClass(object):
 		self.nameChanged(state.text(0))
 
 		self.cb_manager.addItems([p.pluginName for p in self.core.plugins.getRenderfarmPlugins()])
+		if self.pluginMHfunctions.useFarmStandIn():
+			self.cb_manager.addItem(self.pluginMHfunctions.farmStandInName)
+
+		self.addFarmJobsWidget()
 		self.core.callback("onStateStartup", self)
 		if self.cb_manager.count() == 0:
 			self.gb_submit.setVisible(False)
@@ -178,7 +186,7 @@ class MHRenderClass(object):
 			idx = self.cb_renderPreset.findText(data["currentrenderpreset"])
 			if idx != -1:
 				self.cb_renderPreset.setCurrentIndex(idx)
-				self.stateManager.saveStatesToScene()
+				self.saveStates()
 		if "rangeType" in data:
 			idx = self.cb_rangeType.findText(data["rangeType"])
 			if idx != -1:
@@ -198,7 +206,7 @@ class MHRenderClass(object):
 			if idx != -1:
 				self.curCam = self.camlist[idx]
 				self.cb_cam.setCurrentIndex(idx)
-				self.stateManager.saveStatesToScene()
+				self.saveStates()
 		if "resoverride" in data:
 			res = eval(data["resoverride"])
 			self.chb_resOverride.setChecked(res[0])
@@ -216,7 +224,7 @@ class MHRenderClass(object):
 			idx = self.cb_renderLayer.findText(data["renderlayer"])
 			if idx != -1:
 				self.cb_renderLayer.setCurrentIndex(idx)
-				self.stateManager.saveStatesToScene()
+				self.saveStates()
 		if "outputFormat" in data:
 			idx = self.cb_format.findText(data["outputFormat"])
 			if idx != -1:
@@ -232,6 +240,8 @@ class MHRenderClass(object):
 			self.sp_rjPrio.setValue(int(data["rjprio"]))
 		if "rjframespertask" in data:
 			self.sp_rjFramesPerTask.setValue(int(data["rjframespertask"]))
+		if "splitlayerjobs" in data:
+			self.chb_splitLayerJobs.setChecked(eval(data["splitlayerjobs"]))
 		if "rjtimeout" in data:
 			self.sp_rjTimeout.setValue(int(data["rjtimeout"]))
 		if "rjsuspended" in data:
@@ -254,6 +264,17 @@ class MHRenderClass(object):
 			self.gpuDevicesChanged()
 		if "enablepasses" in data:
 			self.gb_passes.setChecked(eval(data["enablepasses"]))
+		if "localrendermode" in data:
+			idx = self.cb_localRender.findText(data["localrendermode"])
+			if idx != -1:
+				self.cb_localRender.setCurrentIndex(idx)
+		if "localworkers" in data:
+			self.sp_localWorkers.setValue(int(data["localworkers"]))
+		if "localchunksize" in data:
+			self.sp_localChunkSize.setValue(int(data["localchunksize"]))
+		if "skiprendered" in data:
+			self.chb_skipRendered.setChecked(eval(data["skiprendered"]))
+		self.localRenderModeChanged(save=False)
 		if "lastexportpath" in data:
 			lePath = self.core.fixPath(data["lastexportpath"])
 			self.l_pathLast.setText(lePath)
@@ -266,21 +287,26 @@ class MHRenderClass(object):
 
 		self.core.callback("onStateSettingsLoaded", self, data)
 
+	@err_catcher(name=__name__)
+	def saveStates(self, *args):
+		# Coalesced, the states are written to the scene once per event loop iteration
+		self.stateSaves.request()
+
 	@err_catcher(name=__name__)
 	def connectEvents(self):
 		self.e_name.textChanged.connect(self.nameChanged)
-		self.e_name.editingFinished.connect(self.stateManager.saveStatesToScene)
+		self.e_name.editingFinished.connect(self.saveStates)
 		self.cb_context.activated.connect(self.onContextTypeChanged)
 		self.b_context.clicked.connect(self.selectContextClicked)
 		self.b_changeTask.clicked.connect(self.changeTask)
 		self.chb_renderPreset.stateChanged.connect(self.presetOverrideChanged)
-		self.cb_renderPreset.activated.connect(self.stateManager.saveStatesToScene)
+		self.cb_renderPreset.activated.connect(self.saveStates)
 		self.cb_rangeType.activated.connect(self.rangeTypeChanged)
 		self.sp_rangeStart.editingFinished.connect(self.startChanged)
 		self.sp_rangeEnd.editingFinished.connect(self.endChanged)
 		self.le_frameExpression.textChanged.connect(self.frameExpressionChanged)
 		self.le_frameExpression.editingFinished.connect(
-			self.stateManager.saveStatesToScene
+			self.saveStates
 		)
 		self.le_frameExpression.setMouseTracking(True)
 		self.le_frameExpression.origMoveEvent = self.le_frameExpression.mouseMoveEvent
@@ -289,34 +315,34 @@ class MHRenderClass(object):
 		self.le_frameExpression.focusOutEvent = self.exprFocusOutEvent
 		self.cb_cam.activated.connect(self.setCam)
 		self.chb_resOverride.stateChanged.connect(self.resOverrideChanged)
-		self.sp_resWidth.editingFinished.connect(self.stateManager.saveStatesToScene)
-		self.sp_resHeight.editingFinished.connect(self.stateManager.saveStatesToScene)
+		self.sp_resWidth.editingFinished.connect(self.saveStates)
+		self.sp_resHeight.editingFinished.connect(self.saveStates)
 		self.b_resPresets.clicked.connect(self.showResPresets)
-		self.cb_master.activated.connect(self.stateManager.saveStatesToScene)
-		self.cb_outPath.activated.connect(self.stateManager.saveStatesToScene)
-		self.cb_renderLayer.activated.connect(self.stateManager.saveStatesToScene)
-		self.cb_format.activated.connect(self.stateManager.saveStatesToScene)
+		self.cb_master.activated.connect(self.saveStates)
+		self.cb_outPath.activated.connect(self.saveStates)
+		self.cb_renderLayer.activated.connect(self.saveStates)
+		self.cb_format.activated.connect(self.saveStates)
 		self.gb_submit.toggled.connect(self.rjToggled)
 		self.cb_manager.activated.connect(self.managerChanged)
-		self.sp_rjPrio.editingFinished.connect(self.stateManager.saveStatesToScene)
+		self.sp_rjPrio.editingFinished.connect(self.saveStates)
 		self.sp_rjFramesPerTask.editingFinished.connect(
-			self.stateManager.saveStatesToScene
+			self.saveStates
 		)
-		self.sp_rjTimeout.editingFinished.connect(self.stateManager.saveStatesToScene)
-		self.chb_rjSuspended.stateChanged.connect(self.stateManager.saveStatesToScene)
+		self.sp_rjTimeout.editingFinished.connect(self.saveStates)
+		self.chb_rjSuspended.stateChanged.connect(self.saveStates)
 		self.chb_osDependencies.stateChanged.connect(
-			self.stateManager.saveStatesToScene
+			self.saveStates
 		)
-		self.chb_osUpload.stateChanged.connect(self.stateManager.saveStatesToScene)
-		self.chb_osPAssets.stateChanged.connect(self.stateManager.saveStatesToScene)
-		self.e_osSlaves.editingFinished.connect(self.stateManager.saveStatesToScene)
+		self.chb_osUpload.stateChanged.connect(self.saveStates)
+		self.chb_osPAssets.stateChanged.connect(self.saveStates)
+		self.e_osSlaves.editingFinished.connect(self.saveStates)
 		self.b_osSlaves.clicked.connect(self.openSlaves)
 		self.sp_dlConcurrentTasks.editingFinished.connect(
-			self.stateManager.saveStatesToScene
+			self.saveStates
 		)
 		self.sp_dlGPUpt.editingFinished.connect(self.gpuPtChanged)
 		self.le_dlGPUdevices.editingFinished.connect(self.gpuDevicesChanged)
-		self.gb_passes.toggled.connect(self.stateManager.saveStatesToScene)
+		self.gb_passes.toggled.connect(self.saveStates)
 		# self.b_addPasses.clicked.connect(self.showPasses)
 		# self.lw_passes.customContextMenuRequested.connect(self.rclickPasses)
 		self.b_pathLast.clicked.connect(self.showLastPathMenu)
@@ -393,31 +419,31 @@ class MHRenderClass(object):
 	def setCustomContext(self, context):
 		self.customContext = context
 		self.refreshContext()
-		self.stateManager.saveStatesToScene()
+		self.saveStates()
 
 	@err_catcher(name=__name__)
 	def onContextTypeChanged(self, state):
 		self.refreshContext()
-		self.stateManager.saveStatesToScene()
+		self.saveStates()
 
 	@err_catcher(name=__name__)
 	def rangeTypeChanged(self, state):
 		self.updateUi()
-		self.stateManager.saveStatesToScene()
+		self.saveStates()
 
 	@err_catcher(name=__name__)
 	def startChanged(self):
 		if self.sp_rangeStart.value() > self.sp_rangeEnd.value():
 			self.sp_rangeEnd.setValue(self.sp_rangeStart.value())
 
-		self.stateManager.saveStatesToScene()
+		self.saveStates()
 
 	@err_catcher(name=__name__)
 	def endChanged(self):
 		if self.sp_rangeEnd.value() < self.sp_rangeStart.value():
 			self.sp_rangeStart.setValue(self.sp_rangeEnd.value())
 
-		self.stateManager.saveStatesToScene()
+		self.saveStates()
 
 	@err_catcher(name=__name__)
 	def frameExpressionChanged(self, text=None):
@@ -497,7 +523,7 @@ class MHRenderClass(object):
 	@err_catcher(name=__name__)
 	def setCam(self, index):
 		self.curCam = self.camlist[index]
-		self.stateManager.saveStatesToScene()
+		self.saveStates()
 
 	@err_catcher(name=__name__)
 	def nameChanged(self, text):
@@ -541,7 +567,7 @@ class MHRenderClass(object):
 		idx = self.cb_format.findText(fmt)
 		if idx != -1:
 			self.cb_format.setCurrentIndex(idx)
-			self.stateManager.saveStatesToScene()
+			self.saveStates()
 			return True
 
 		return False
@@ -595,12 +621,12 @@ class MHRenderClass(object):
 		if result == 1:
 			self.setTaskname(self.nameWin.e_item.text())
 			self.nameChanged(self.e_name.text())
-			self.stateManager.saveStatesToScene()
+			self.saveStates()
 
 	@err_catcher(name=__name__)
 	def presetOverrideChanged(self, checked):
 		self.cb_renderPreset.setEnabled(checked)
-		self.stateManager.saveStatesToScene()
+		self.saveStates()
 
 	@err_catcher(name=__name__)
 	def resOverrideChanged(self, checked):
@@ -608,7 +634,7 @@ class MHRenderClass(object):
 		self.sp_resHeight.setEnabled(checked)
 		self.b_resPresets.setEnabled(checked)
 
-		self.stateManager.saveStatesToScene()
+		self.saveStates()
 
 	@err_catcher(name=__name__)
 	def showResPresets(self):
@@ -628,7 +654,7 @@ class MHRenderClass(object):
 			pAct.triggered.connect(
 				lambda x=None, v=pheight: self.sp_resHeight.setValue(v)
 			)
-			pAct.triggered.connect(lambda: self.stateManager.saveStatesToScene())
+			pAct.triggered.connect(lambda: self.saveStates())
 			pmenu.addAction(pAct)
 
 		pmenu.exec_(QCursor.pos())
@@ -679,7 +705,7 @@ class MHRenderClass(object):
 		idx = self.cb_master.findText(master)
 		if idx != -1:
 			self.cb_master.setCurrentIndex(idx)
-			self.stateManager.saveStatesToScene()
+			self.saveStates()
 			return True
 
 		return False
@@ -693,7 +719,7 @@ class MHRenderClass(object):
 		idx = self.cb_outPath.findText(location)
 		if idx != -1:
 			self.cb_outPath.setCurrentIndex(idx)
-			self.stateManager.saveStatesToScene()
+			self.saveStates()
 			return True
 
 		return False
@@ -724,7 +750,7 @@ class MHRenderClass(object):
 			else:
 				self.curCam = None
 
-			self.stateManager.saveStatesToScene()
+			self.saveStates()
 
 		self.updateRange()
 
@@ -745,7 +771,7 @@ class MHRenderClass(object):
 			self.cb_renderLayer.setCurrentIndex(layerList.index(curLayer))
 		else:
 			self.cb_renderLayer.setCurrentIndex(0)
-			self.stateManager.saveStatesToScene()
+			self.saveStates()
 
 		self.refreshSubmitUi()
 		# getattr(self.core.appPlugin, "sm_render_refreshPasses", lambda x: None)(self)
@@ -790,7 +816,9 @@ class MHRenderClass(object):
 				self.gb_submit.layout().itemAt(idx).widget().setHidden(not submitChecked)
 
 			if submitChecked:
-				self.core.plugins.getRenderfarmPlugin(self.cb_manager.currentText()).sm_render_updateUI(self)
+				plugin = self.core.plugins.getRenderfarmPlugin(self.cb_manager.currentText())
+				if plugin:
+					plugin.sm_render_updateUI(self)
 
 	@err_catcher(name=__name__)
 	def updateRange(self):
@@ -892,17 +920,17 @@ class MHRenderClass(object):
 					selSlaves = selSlaves[:-2]
 
 			self.e_osSlaves.setText(selSlaves)
-			self.stateManager.saveStatesToScene()
+			self.saveStates()
 
 	@err_catcher(name=__name__)
 	def gpuPtChanged(self):
 		self.w_dlGPUdevices.setEnabled(self.sp_dlGPUpt.value() == 0)
-		self.stateManager.saveStatesToScene()
+		self.saveStates()
 
 	@err_catcher(name=__name__)
 	def gpuDevicesChanged(self):
 		self.w_dlGPUpt.setEnabled(self.le_dlGPUdevices.text() == "")
-		self.stateManager.saveStatesToScene()
+		self.saveStates()
 
 	# @err_catcher(name=__name__)
 	# def showPasses(self):
@@ -948,7 +976,7 @@ class MHRenderClass(object):
 	#             )
 
 	#     self.updateUi()
-	#     self.stateManager.saveStatesToScene()
+	#     self.saveStates()
 
 	# @err_catcher(name=__name__)
 	# def rclickPasses(self, pos):
@@ -972,10 +1000,239 @@ class MHRenderClass(object):
 	#         self.core.appPlugin.removeAOV(i.text())
 	#     self.updateUi()
 
+	@err_catcher(name=__name__)
+	def addLocalRenderWidget(self):
+		self.w_localRender = QWidget(self.gb_imageRender)
+		layout = QHBoxLayout(self.w_localRender)
+		layout.setContentsMargins(9, 0, 9, 0)
+
+		self.l_localRender = QLabel("Local Render:", self.w_localRender)
+		self.cb_localRender = QComboBox(self.w_localRender)
+		self.cb_localRender.addItems(["Current Session", "Background Processes"])
+		self.cb_localRender.setToolTip(
+			"Background Processes renders a copy of the scene in frame chunks with several\n"
+			"\"blender -b\" processes and skips frames that are already on disk."
+		)
+		self.l_localWorkers = QLabel("Processes:", self.w_localRender)
+		self.sp_localWorkers = QSpinBox(self.w_localRender)
+		self.sp_localWorkers.setRange(1, 64)
+		self.sp_localWorkers.setValue(2)
+		self.l_localChunkSize = QLabel("Frames per chunk:", self.w_localRender)
+		self.sp_localChunkSize = QSpinBox(self.w_localRender)
+		self.sp_localChunkSize.setRange(1, 100000)
+		self.sp_localChunkSize.setValue(10)
+		layout.addWidget(self.l_localRender)
+		layout.addWidget(self.cb_localRender)
+		layout.addStretch()
+		layout.addWidget(self.l_localWorkers)
+		layout.addWidget(self.sp_localWorkers)
+		layout.addWidget(self.l_localChunkSize)
+		layout.addWidget(self.sp_localChunkSize)
+
+		self.chb_skipRendered = QCheckBox("Skip complete frames", self.gb_imageRender)
+		self.chb_skipRendered.setChecked(True)
+		self.chb_skipRendered.setToolTip(
+			"Don't render frames whose output files of all layers already exist\n"
+			"and are valid EXRs, e.g. when re-running an interrupted render."
+		)
+
+		idx = self.verticalLayout_2.indexOf(self.w_outPath)
+		self.verticalLayout_2.insertWidget(idx + 1, self.w_localRender)
+		self.verticalLayout_2.insertWidget(idx + 2, self.chb_skipRendered)
+
+		self.cb_localRender.activated.connect(self.localRenderModeChanged)
+		self.sp_localWorkers.editingFinished.connect(self.saveStates)
+		self.sp_localChunkSize.editingFinished.connect(self.saveStates)
+		self.chb_skipRendered.stateChanged.connect(self.saveStates)
+		self.localRenderModeChanged(save=False)
+
+	@err_catcher(name=__name__)
+	def localRenderModeChanged(self, *args, save=True):
+		background = self.cb_localRender.currentText() == "Background Processes"
+		for widget in [self.l_localWorkers, self.sp_localWorkers, self.l_localChunkSize, self.sp_localChunkSize]:
+			widget.setVisible(background)
+
+		if save:
+			self.saveStates()
+
+	@err_catcher(name=__name__)
+	def getRenderFrames(self, rSettings)->list:
+		if rSettings["rangeType"] == "Expression":
+			return list(rSettings["frames"])
+
+		return list(range(int(rSettings["startFrame"]), int(rSettings["endFrame"]) + 1))
+
+	@err_catcher(name=__name__)
+	def submitWithFrameExpression(self, expression, submit):
+		# Farm plugins read the range from the state widgets, show them the remaining frames while submitting
+		if not expression:
+			return submit()
+
+		rangeType = self.cb_rangeType.currentText()
+		oldExpression = self.le_frameExpression.text()
+		widgets = [self.cb_rangeType, self.le_frameExpression]
+		blocked = [w.blockSignals(True) for w in widgets]
+		try:
+			self.cb_rangeType.setCurrentIndex(self.cb_rangeType.findText("Expression"))
+			self.le_frameExpression.setText(expression)
+			return submit()
+		finally:
+			self.cb_rangeType.setCurrentIndex(self.cb_rangeType.findText(rangeType))
+			self.le_frameExpression.setText(oldExpression)
+			for w, b in zip(widgets, blocked):
+				w.blockSignals(b)
+
+	@err_catcher(name=__name__)
+	def startChunkedLocalRender(self, frames, chunkSize, layernames=None, doneFrames=None):
+		# Render a copy of the scene with background processes, keeping the UI responsive
+		# The scheduler skips doneFrames, the frames of the resume scan
+		# With layernames only these view layers are enabled in the copy, and the
+		# frames complete for them are skipped too
+		doneFrames = set(doneFrames or [])
+		if layernames and self.chb_skipRendered.isChecked():
+			doneFrames |= self.pluginMHfunctions.scanRenderedFrames(layernames, frames)
+
+		if layernames:
+			with self.pluginMHfunctions.layerRenderScope(layernames):
+				scenePath = self.pluginMHfunctions.saveRenderSceneCopy(name="_".join(layernames))
+		else:
+			scenePath = self.pluginMHfunctions.saveRenderSceneCopy()
+
+		scheduler = self.pluginMHfunctions.createLocalRenderScheduler(
+			scenePath,
+			frames,
+			chunkSize=chunkSize,
+			workers=self.sp_localWorkers.value(),
+			isFrameDone=doneFrames.__contains__,
+		)
+		if not scheduler.frames:
+			return "Result=Success"
+
+		scheduler.start()
+		label = "Rendering %s frames" % len(scheduler.frames)
+		if layernames:
+			label += " of %s" % ", ".join(layernames)
+
+		progress = QProgressDialog(
+			label + "...",
+			"Cancel",
+			0,
+			len(scheduler.frames),
+			self.core.messageParent,
+		)
+		progress.setWindowTitle("Local Render")
+		progress.setMinimumDuration(0)
+		while scheduler.isRunning():
+			done, total = scheduler.getProgress()
+			progress.setValue(done)
+			QCoreApplication.processEvents()
+			if progress.wasCanceled():
+				scheduler.cancel()
+
+			time.sleep(0.1)
+
+		progress.close()
+		try:
+			os.remove(scenePath)
+		except OSError:
+			pass
+
+		return scheduler.getResult()
+
+	@err_catcher(name=__name__)
+	def addFarmJobsWidget(self):
+		self.chb_splitLayerJobs = QCheckBox("Submit one job per layer", self.gb_submit)
+		self.chb_splitLayerJobs.setToolTip(
+			"Submit a render job for each enabled MHrendLayer state, split in tasks of\n"
+			"\"Frames per task\" frames, and update the master version once all of them are done."
+		)
+		idx = self.gb_submit.layout().indexOf(self.f_rjWidgetsPerTask)
+		self.gb_submit.layout().insertWidget(idx + 1, self.chb_splitLayerJobs)
+		self.chb_splitLayerJobs.stateChanged.connect(self.saveStates)
+
+	@err_catcher(name=__name__)
+	def isFarmStandIn(self)->bool:
+		return self.cb_manager.currentText() == self.pluginMHfunctions.farmStandInName
+
+	@err_catcher(name=__name__)
+	def submitLayerJobs(self, parent, rSettings, details, handleMaster, sceneDescription=None):
+		"""
+		Submit one render job per enabled layer and a master job depending on
+		all of them. The stand-in manager runs the graph on this machine.
+		"""
+		layernames = list(self.getLayerStatesOptions(parent))
+		if not layernames:
+			return "no enabled MHrendLayer state to submit"
+
+		jobs = self.pluginMHfunctions.createFarmJobGraph(
+			self.getTaskname() or self.state.text(0),
+			layernames,
+			self.getRenderFrames(rSettings),
+			framesPerTask=self.sp_rjFramesPerTask.value(),
+			masterJob=bool(handleMaster),
+		)
+		self.lastFarmJobs = jobs
+		if self.isFarmStandIn():
+			manager = self.pluginMHfunctions.createLocalFarmManager({
+				"render": lambda job: self.startChunkedLocalRender(job.frames, job.framesPerTask, layernames=[job.layername]),
+				"master": lambda job: self.handleMasterVersion(os.path.expandvars(rSettings["outputName"])) or "Result=Success",
+			})
+			result = manager.submitJobs(jobs)
+			if "Result=Success" in result:
+				result = manager.run()
+
+			return result
+
+		plugin = self.core.plugins.getRenderfarmPlugin(self.cb_manager.currentText())
+		if "dependencies" not in inspect.signature(plugin.sm_render_submitJob).parameters:
+			# The master update would run before the other layer jobs are done
+			return (
+				"the %s plugin can't submit jobs with dependencies, which one job per layer needs. "
+				"Disable \"Submit one job per layer\"." % self.cb_manager.currentText()
+			)
+
+		manager = self.pluginMHfunctions.createPrismFarmManager(
+			plugin,
+			lambda job, dependencyIds, isLast: self.submitLayerJob(
+				plugin, parent, job, dependencyIds, rSettings, details, handleMaster if isLast else False, sceneDescription
+			),
+		)
+		try:
+			return manager.submitJobs(jobs)
+		finally:
+			# The layer jobs were submitted from saves with a single view layer enabled
+			self.core.saveScene(versionUp=False, prismReq=False)
+
+	@err_catcher(name=__name__)
+	def submitLayerJob(self, plugin, parent, job, dependencyIds, rSettings, details, handleMaster, sceneDescription=None):
+		# Farm plugins submit the saved scene, save it with only the layer of the job enabled
+		kwargs = {"handleMaster": handleMaster, "details": details, "sceneDescription": sceneDescription}
+		params = inspect.signature(plugin.sm_render_submitJob).parameters
+		if "jobnameSuffix" in params:
+			kwargs["jobnameSuffix"] = "_" + job.layername
+		if "dependencies" in params:
+			kwargs["dependencies"] = dependencyIds
+
+		with self.pluginMHfunctions.layerRenderScope([job.layername]):
+			self.stateSaves.commit()
+			self.core.saveScene(versionUp=False, prismReq=False)
+			result = self.submitWithFrameExpression(
+				rSettings.get("frameExpression"),
+				lambda: plugin.sm_render_submitJob(self, rSettings["outputName"], parent, **kwargs),
+			)
+
+		result = result or ""
+		jobId = None
+		for line in result.splitlines():
+			if line.startswith("JobID="):
+				jobId = line.split("=", 1)[1].strip()
+
+		return result, jobId
+
 	@err_catcher(name=__name__)
 	def rjToggled(self, checked):
 		self.refreshSubmitUi()
-		self.stateManager.saveStatesToScene()
+		self.saveStates()
 
 	@err_catcher(name=__name__)
 	def managerChanged(self, text=None):
@@ -983,7 +1240,7 @@ class MHRenderClass(object):
 		if plugin:
 			plugin.sm_render_managerChanged(self)
 
-		self.stateManager.saveStatesToScene()
+		self.saveStates()
 
 	@err_catcher(name=__name__)
 	def getContextStrFromEntity(self, entity):
@@ -1003,38 +1260,145 @@ class MHRenderClass(object):
 
 	
 	@err_catcher(name=__name__)
-	def checkLayersNodesExist(self, parent)->list:
-		sm = parent
-		nonodes=[]
-		for state in sm.states:
+	def getLayerStatesOptions(self, parent)->dict:
+		# {layername: output options} of the enabled MHrendLayer states
+		layerOptions = {}
+		for state in parent.states:
 			stateui = state.ui
-			if stateui.className == "MHrendLayer":
-				if not state.text(0).endswith(" - disabled"):
-					layerhasoutnodes = False
-					rlayername = stateui.cb_renderLayer.currentText()
-					layers = self.pluginMHfunctions.getRenderLayers()
-					if rlayername in layers:
-						outnodesdict:dict = self.pluginMHfunctions.getLayerOutNodes(rlayername)
-						for v in list(outnodesdict.values()):
-							if v:
-								layerhasoutnodes = True
-								break
-					if not layerhasoutnodes:
-						nonodes.append(rlayername)
-		
+			if stateui.className == "MHrendLayer" and not state.text(0).endswith(" - disabled"):
+				layername = stateui.cb_renderLayer.currentText()
+				if layername not in layerOptions:
+					layerOptions[layername] = stateui.getOutputOptions()
+
+		return layerOptions
+
+	@err_catcher(name=__name__)
+	def auditLayers(self, parent)->dict:
+		return self.pluginMHfunctions.auditRenderPasses(self.getLayerStatesOptions(parent))
+
+	@err_catcher(name=__name__)
+	def checkLayersNodesExist(self, parent, audit=None)->list:
+		if audit is None:
+			audit = self.auditLayers(parent)
+
+		# Layers of enabled states, including the ones missing from the scene
+		nonodes = []
+		for layername in self.getLayerStatesOptions(parent):
+			info = audit["layers"].get(layername)
+			if not info or not info["hasNodes"]:
+				nonodes.append(layername)
+
 		return nonodes
 	
 
 
 	@err_catcher(name=__name__)
-	def upSubmittedSaversVersions(self, parent, keepcurrentV=False)->None:
-		# Before Submitting, change version of elegible Savers.
-		sm = parent
-		for state in sm.states:
-			stateui = state.ui
-			if stateui.className == "MHrendLayer":
-				if not state.text(0).endswith(" - disabled"):
-					stateui.executeState(parent=parent, calledFromMHRender=True, keepcurrentV=keepcurrentV)
+	def getLayerStates(self, parent)->list:
+		# Enabled MHrendLayer states, in State Manager order
+		return [
+			state.ui for state in parent.states
+			if state.ui.className == "MHrendLayer" and not state.text(0).endswith(" - disabled")
+		]
+
+	@err_catcher(name=__name__)
+	def getPublisher(self, parent=None, hooks=None, withLayers=True):
+		# Headless publish of this state, the hooks plug in the State Manager parts
+		layerStates = self.getLayerStates(parent or self.stateManager) if withLayers else []
+		hooks = dict(hooks or {})
+		hooks.setdefault("state", self)
+		hooks["layerStates"] = dict(enumerate(layerStates))
+		hooks["onLayerApplied"] = lambda index, path, transaction: layerStates[index].setLastPath(
+			path, transaction=transaction, save=False
+		)
+		return self.pluginMHfunctions.createRenderPublisher(
+			self.getStateProps(),
+			[s.getStateProps() for s in layerStates],
+			comment=self.stateManager.publishComment,
+			hooks=hooks,
+		)
+
+	@err_catcher(name=__name__)
+	def getPublishHooks(self, parent)->dict:
+		hooks = {
+			"confirmMissingNodes": self.confirmMissingNodes,
+			"onOutputName": self.setLastPath,
+			"submit": lambda rSettings, details, handleMaster: self.submitRender(parent, rSettings, details, handleMaster),
+			"render": self.renderLocal,
+			"undoRenderSettings": lambda rSettings: self.core.appPlugin.sm_render_undoRenderSettings(self, rSettings),
+		}
+		if "RenderSettings" in self.stateManager.stateTypes:
+			hooks["applyRenderPreset"] = self.applyRenderPreset
+
+		if self.stateManager.actionSaveDuringPub.isChecked():
+			hooks["saveScene"] = self.saveSceneForPublish
+
+		return hooks
+
+	@err_catcher(name=__name__)
+	def confirmMissingNodes(self, layernames)->bool:
+		message = "layers: " + ", ".join(layernames)
+		message += " have no File Output nodes\nasociated with it/them.\n\nWould you like to continue?"
+		return self.core.popupQuestion(message, title="No nodes") != "No"
+
+	@err_catcher(name=__name__)
+	def setLastPath(self, path, transaction=None):
+		if transaction:
+			oldPath = self.l_pathLast.text()
+			transaction.recordUndo("last path", lambda: (self.l_pathLast.setText(oldPath), self.l_pathLast.setToolTip(oldPath)))
+
+		self.l_pathLast.setText(path)
+		self.l_pathLast.setToolTip(path)
+		self.saveStates()
+
+	@err_catcher(name=__name__)
+	def applyRenderPreset(self, rSettings):
+		rSettings["renderSettings"] = getattr(
+			self.core.appPlugin,
+			"sm_renderSettings_getCurrentSettings",
+			lambda x: {},
+		)(self)
+		self.stateManager.stateTypes["RenderSettings"].applyPreset(
+			self.core, self.renderPresets[self.cb_renderPreset.currentText()]
+		)
+
+	@err_catcher(name=__name__)
+	def saveSceneForPublish(self):
+		self.stateSaves.commit()
+		self.core.saveScene(versionUp=False, prismReq=False)
+
+	@err_catcher(name=__name__)
+	def submitRender(self, parent, rSettings, details, handleMaster):
+		if hasattr(self, "chb_redshift") and self.chb_redshift.isChecked() and not self.w_redshift.isHidden():
+			sceneDescription = "redshift"
+		else:
+			sceneDescription = None
+
+		if self.isFarmStandIn() or self.chb_splitLayerJobs.isChecked():
+			return self.submitLayerJobs(parent, rSettings, details, handleMaster, sceneDescription)
+
+		plugin = self.core.plugins.getRenderfarmPlugin(self.cb_manager.currentText())
+		return self.submitWithFrameExpression(
+			rSettings.get("frameExpression"),
+			lambda: plugin.sm_render_submitJob(
+				self,
+				rSettings["outputName"],
+				parent,
+				handleMaster=handleMaster,
+				details=details,
+				sceneDescription=sceneDescription
+			),
+		)
+
+	@err_catcher(name=__name__)
+	def renderLocal(self, rSettings):
+		if self.cb_localRender.currentText() == "Background Processes":
+			return self.startChunkedLocalRender(
+				self.getRenderFrames(rSettings), self.sp_localChunkSize.value(), doneFrames=rSettings.get("skippedFrames")
+			)
+
+		return self.core.appPlugin.sm_render_startLocalRender(
+			self, rSettings["outputName"], rSettings
+		)
 
 
 	@err_catcher(name=__name__)
@@ -1064,252 +1428,91 @@ class MHRenderClass(object):
 
 		if not self.gb_submit.isHidden() and self.gb_submit.isChecked():
 			plugin = self.core.plugins.getRenderfarmPlugin(self.cb_manager.currentText())
-			warnings += plugin.sm_render_preExecute(self)
+			if plugin:
+				warnings += plugin.sm_render_preExecute(self)
 
 		warnings += self.core.appPlugin.sm_render_preExecute(self)
 
+		audit = self.auditLayers(self.stateManager)
+		for layername, info in audit["layers"].items():
+			if info["notConnected"]:
+				warnings.append(["%s: passes enabled but not connected to an output node." % layername, ", ".join(info["notConnected"]), 2])
+			if info["disabledConnected"]:
+				warnings.append(["%s: output slots linked from disabled passes." % layername, ", ".join(info["disabledConnected"]), 2])
+			if info["pendingOps"]:
+				warnings.append(["%s: output nodes are out of date, use \"Setup Nodes\"." % layername, "", 2])
+
 		return [self.state.text(0), warnings]
 
 	@err_catcher(name=__name__)
 	def getOutputName(self, useVersion="next"):
-		if self.tasknameRequired and not self.getTaskname():
-			return
-
-		task = self.getTaskname()
-		extension = self.cb_format.currentText()
-		context = self.getCurrentContext()
-		framePadding = ""
-
-		if "type" not in context:
-			return
-
-		singleFrame = self.cb_rangeType.currentText() == "Single Frame"
-		location = self.cb_outPath.currentText()
-		outputPathData = self.core.mediaProducts.generateMediaProductPath(
-			entity=context,
-			task=task,
-			extension=extension,
-			framePadding=framePadding,
-			comment=self.stateManager.publishComment,
-			version=useVersion if useVersion != "next" else None,
-			location=location,
-			aov="JPGseq",
-			singleFrame=singleFrame,
-			returnDetails=True,
-			mediaType=self.mediaType,
-			state=self,
-		)
-
-		outputFolder = os.path.dirname(outputPathData["path"])
-		hVersion = outputPathData["version"]
-
-		return outputPathData["path"], outputFolder, hVersion
+		return self.getPublisher(withLayers=False).getOutputName(useVersion=useVersion)
 
 	@err_catcher(name=__name__)
 	def executeState(self, parent, useVersion="next", keepcurrentV=False):
-		rangeType = self.cb_rangeType.currentText()
-		frames = self.getFrameRange(rangeType)
-		if rangeType != "Expression":
-			startFrame = frames[0]
-			endFrame = frames[1]
-		else:
-			startFrame = None
-			endFrame = None
-
-		if frames is None or frames == [] or frames[0] is None:
-			return [self.state.text(0) + ": error - Framerange is invalid"]
-
-		if rangeType == "Single Frame":
-			endFrame = startFrame
-
-		updateMaster = True
-		fileName = self.core.getCurrentFileName()
-		context = self.getCurrentContext()
-		if not self.renderingStarted:
-			nonodes = self.checkLayersNodesExist(self.stateManager)
-			if len(nonodes) > 0:
-				message = "layers: "
-				for index, layer in enumerate(nonodes, start=1):
-					message += layer
-					if index != len(nonodes):
-						message += ", "
-				
-				message = " have no File Output nodes\nasociated with it/them.\n\nWould you like to continue?"
-				result = self.core.popupQuestion(message,title="No nodes")
-				if result == "No":
-					return [
-						self.state.text(0)
-						+ ": error - Some Layers had no nodes."
-					]
-			# Update the versions
-			if not useVersion=="next":
-				keepcurrentV = True
-			self.upSubmittedSaversVersions(self.stateManager, keepcurrentV=keepcurrentV)
-			#
-			if self.tasknameRequired and not self.getTaskname():
-				return [
-					self.state.text(0)
-					+ ": error - no identifier is given. Skipped the activation of this state."
-				]
-
-			if self.curCam is None or (
-				self.curCam != "Current View"
-				and not self.core.appPlugin.isNodeValid(self, self.curCam)
-			):
-				return [
-					self.state.text(0)
-					+ ": error - no camera is selected. Skipping activation of this state."
-				]
-
-			outputName, outputPath, hVersion = self.getOutputName(useVersion=useVersion)
-			expandedOutputPath = os.path.expandvars(outputPath)
-
-			outLength = len(outputName)
-			if platform.system() == "Windows" and os.getenv("PRISM_IGNORE_PATH_LENGTH") != "1" and outLength > 255:
-				return [
-					self.state.text(0)
-					+ " - error - The outputpath is longer than 255 characters (%s), which is not supported on Windows. Please shorten the outputpath by changing the comment, taskname or projectpath."
-					% outLength
-				]
-
-			if not os.path.exists(os.path.dirname(expandedOutputPath)):
-				os.makedirs(os.path.dirname(expandedOutputPath))
-
-			details = context.copy()
-			if "filename" in details:
-				del details["filename"]
-
-			if "extension" in details:
-				del details["extension"]
-
-			details["version"] = hVersion
-			details["sourceScene"] = fileName
-			details["identifier"] = self.getTaskname()
-			details["comment"] = self.stateManager.publishComment
-
-			if self.mediaType == "3drenders":
-				infopath = os.path.dirname(expandedOutputPath)
-			else:
-				infopath = expandedOutputPath
-
-			self.core.saveVersionInfo(
-				filepath=infopath, details=details
-			)
-
-			self.l_pathLast.setText(outputName)
-			self.l_pathLast.setToolTip(outputName)
-			self.stateManager.saveStatesToScene()
-
-			rSettings = {
-				"outputName": outputName,
-				"startFrame": startFrame,
-				"endFrame": endFrame,
-				"frames": frames,
-				"rangeType": rangeType,
-			}
-
-			if (
-				self.chb_renderPreset.isChecked()
-				and "RenderSettings" in self.stateManager.stateTypes
-			):
-				rSettings["renderSettings"] = getattr(
-					self.core.appPlugin,
-					"sm_renderSettings_getCurrentSettings",
-					lambda x: {},
-				)(self)
-				self.stateManager.stateTypes["RenderSettings"].applyPreset(
-					self.core, self.renderPresets[self.cb_renderPreset.currentText()]
-				)
-
-			self.pluginMHfunctions.sm_render_preSubmit(self, rSettings)
-
-			kwargs = {
-				"state": self,
-				"scenefile": fileName,
-				"settings": rSettings,
-			}
-
-			result = self.core.callback("preRender", **kwargs)
-			for res in result:
-				if isinstance(res, dict) and res.get("cancel", False):
-					return [
-						self.state.text(0)
-						+ " - error - %s" % res.get("details", "preRender hook returned False")
-					]
+		if self.renderingStarted:
+			return self.executePausedRender(parent)
 
-			if not os.path.exists(os.path.expandvars(os.path.dirname(rSettings["outputName"]))):
-				os.makedirs(os.path.expandvars(os.path.dirname(rSettings["outputName"])))
-
-			if self.stateManager.actionSaveDuringPub.isChecked():
-				self.core.saveScene(versionUp=False, prismReq=False)
-
-			if self.core.getConfig("globals", "backupScenesOnPublish", config="project"):
-				self.core.entities.backupScenefile(os.path.expandvars(os.path.dirname(rSettings["outputName"])), bufferMinutes=0)
+		# The states changed by the publish and its layers are written to the scene once, when it ends
+		with self.stateSaves.batch():
+			publisher = self.getPublisher(parent, hooks=self.getPublishHooks(parent))
+			try:
+				report = publisher.execute(useVersion=useVersion, keepcurrentV=keepcurrentV)
+			except Exception:
+				self.saveStates()
+				raise
 
-			if not self.gb_submit.isHidden() and self.gb_submit.isChecked():
-				handleMaster = "media" if self.isUsingMasterVersion() else False
-				plugin = self.core.plugins.getRenderfarmPlugin(self.cb_manager.currentText())
-				if hasattr(self, "chb_redshift") and self.chb_redshift.isChecked() and not self.w_redshift.isHidden():
-					sceneDescription = "redshift"
-				else:
-					sceneDescription = None
-
-				result = plugin.sm_render_submitJob(
-					self,
-					rSettings["outputName"],
-					parent,
-					handleMaster=handleMaster,
-					details=details,
-					sceneDescription=sceneDescription
-				)
-				updateMaster = False
-			else:
-				result = self.core.appPlugin.sm_render_startLocalRender(
-					self, rSettings["outputName"], rSettings
-				)
-		else:
-			rSettings = self.LastRSettings
-			result = self.core.appPlugin.sm_render_startLocalRender(
-				self, rSettings["outputName"], rSettings
-			)
-			outputName = rSettings["outputName"]
+			if report["rolledBack"]:
+				self.saveStates()
 
-		if not self.renderingStarted:
-			self.core.appPlugin.sm_render_undoRenderSettings(self, rSettings)
+		return self.getPublishResult(report)
 
+	def executePausedRender(self, parent):
+		rSettings = self.LastRSettings
+		result = self.core.appPlugin.sm_render_startLocalRender(
+			self, rSettings["outputName"], rSettings
+		)
 		if result == "publish paused":
 			return [self.state.text(0) + " - publish paused"]
-		else:
-			if updateMaster:
-				self.handleMasterVersion(os.path.expandvars(outputName))
 
-			kwargs = {
-				"state": self,
-				"scenefile": fileName,
-				"settings": rSettings,
-				"result": result,
-			}
+		self.getPublisher(parent, withLayers=False).updateLayerMasters(rSettings.get("layerMasters", []))
+		self.handleMasterVersion(os.path.expandvars(rSettings["outputName"]))
+		self.core.callback(
+			"postRender",
+			state=self,
+			scenefile=self.core.getCurrentFileName(),
+			settings=rSettings,
+			result=result,
+		)
+		status = "success" if "Result=Success" in result else "error"
+		return self.getPublishResult({"status": status, "result": result, "message": result})
 
-			self.core.callback("postRender", **kwargs)
+	@err_catcher(name=__name__)
+	def getPublishResult(self, report)->list:
+		if report["status"] == "paused":
+			return [self.state.text(0) + " - publish paused"]
 
-			if "Result=Success" in result:
-				return [self.state.text(0) + " - success"]
+		if report["status"] == "success":
+			return [self.state.text(0) + " - success"]
+
+		result = report["result"]
+		if result is not None and not result.startswith("Execute Canceled: "):
+			# The render or submission failed
+			if result == "unknown error (files do not exist)":
+				QMessageBox.warning(
+					self.core.messageParent,
+					"Warning",
+					"No files were created during the rendering. If you think this is a Prism bug please report it in the forum:\nwww.prism-pipeline.com/forum/\nor write a mail to contact@prism-pipeline.com",
+				)
 			else:
 				erStr = "%s ERROR - sm_default_imageRenderPublish %s:\n%s" % (
 					time.strftime("%d/%m/%y %X"),
 					self.core.version,
 					result,
 				)
-				if not result.startswith("Execute Canceled: "):
-					if result == "unknown error (files do not exist)":
-						QMessageBox.warning(
-							self.core.messageParent,
-							"Warning",
-							"No files were created during the rendering. If you think this is a Prism bug please report it in the forum:\nwww.prism-pipeline.com/forum/\nor write a mail to contact@prism-pipeline.com",
-						)
-					else:
-						self.core.writeErrorLog(erStr)
-				return [self.state.text(0) + " - error - " + result]
+				self.core.writeErrorLog(erStr)
+
+		return [self.state.text(0) + " - error - " + report["message"]]
 
 	@err_catcher(name=__name__)
 	def isUsingMasterVersion(self):
@@ -1379,6 +1582,7 @@ class MHRenderClass(object):
 			"rjmanager": str(self.cb_manager.currentText()),
 			"rjprio": self.sp_rjPrio.value(),
 			"rjframespertask": self.sp_rjFramesPerTask.value(),
+			"splitlayerjobs": str(self.chb_splitLayerJobs.isChecked()),
 			"rjtimeout": self.sp_rjTimeout.value(),
 			"rjsuspended": str(self.chb_rjSuspended.isChecked()),
 			"osdependencies": str(self.chb_osDependencies.isChecked()),
@@ -1390,6 +1594,10 @@ class MHRenderClass(object):
 			"dlgpudevices": self.le_dlGPUdevices.text(),
 			"lastexportpath": self.l_pathLast.text().replace("\\", "/"),
 			"enablepasses": str(self.gb_passes.isChecked()),
+			"localrendermode": self.cb_localRender.currentText(),
+			"localworkers": self.sp_localWorkers.value(),
+			"localchunksize": self.sp_localChunkSize.value(),
+			"skiprendered": str(self.chb_skipRendered.isChecked()),
 			"stateenabled": self.core.getCheckStateValue(self.state.checkState(0)),
 		}
 		self.core.callback("onStateGetSettings", self, stateProps)
@@ -42,6 +42,8 @@ from qtpy.QtGui import *
 from qtpy.QtWidgets import *
 
 from PrismUtils.Decorators import err_catcher
+from Prism_MHExtension_StateSaves import getStateSaveScheduler
+from Prism_BlenderMHExtension_UiRefresh import getLayerUiTracker, LAYERS, NODES
 
 
 class MHrendLayerClass(object):
@@ -60,7 +62,17 @@ class MHrendLayerClass(object):
         self.cb_context.addItems(["From scenefile", "Custom"])
         
         self.pluginMHfunctions = self.core.getPlugin("MHExtension").blendFunctions
+        self.stateSaves = getStateSaveScheduler(self.stateManager)
+        # Only the shown state does the full refresh, see updateUi
+        self.uiTracker = getLayerUiTracker()
+        self.uiGenerations = {}
+        self.uiDirty = True
+        self.uiRefreshScheduled = False
+        # Layer and tracker generations of the output mode tooltip, see updateOutputModeTooltip
+        self.outputModeTooltipKey = None
         self.dynamic_checkboxes = []
+        # {property name: QCheckBox}
+        self.propertyCheckboxes = {}
         self.layername = ""
         
         self.curCam = None
@@ -115,6 +127,10 @@ class MHrendLayerClass(object):
 
         masterItems = ["Set as master", "Add to master", "Don't update master"]
         self.cb_master.addItems(masterItems)
+        self.w_master.setToolTip(
+            "Applied by the MHRender state once the layer is rendered.\n"
+            "Executing this state alone only assigns the output paths and doesn't update the master."
+        )
         self.product_paths = self.core.paths.getRenderProductBasePaths()
         self.cb_outPath.addItems(list(self.product_paths.keys()))
         if len(self.product_paths) < 2:
@@ -134,6 +150,8 @@ class MHrendLayerClass(object):
         self.cb_renderLayer.addItems(layers)
         self.layername = self.cb_renderLayer.currentText()
 
+        self.addOutputModeWidget()
+
         self.resolutionPresets = self.core.projects.getResolutionPresets()
         if "Get from rendersettings" not in self.resolutionPresets:
             self.resolutionPresets.append("Get from rendersettings")
@@ -168,7 +186,12 @@ class MHrendLayerClass(object):
         elements = list(self.pluginMHfunctions.layerProperties.keys())
         self.addPropertyWidget(elements)
 
-        self.updateLayerProperties()
+        # Hidden states sync their properties when they are shown
+        if self.isUiShown():
+            self.updateLayerProperties()
+
+        self.uiTracker.addListener(self.onUiInvalidated)
+        self.stateManager.tw_export.currentItemChanged.connect(self.onCurrentStateChanged)
 
         # Check if the layer is selected and change it.
         self.on_RenderLayerCb_setup()
@@ -229,7 +252,7 @@ class MHrendLayerClass(object):
             idx = self.cb_renderPreset.findText(data["currentrenderpreset"])
             if idx != -1:
                 self.cb_renderPreset.setCurrentIndex(idx)
-                self.stateManager.saveStatesToScene()
+                self.saveStates()
         if "rangeType" in data:
             idx = self.cb_rangeType.findText(data["rangeType"])
             if idx != -1:
@@ -249,7 +272,7 @@ class MHrendLayerClass(object):
             if idx != -1:
                 self.curCam = self.camlist[idx]
                 self.cb_cam.setCurrentIndex(idx)
-                self.stateManager.saveStatesToScene()
+                self.saveStates()
         if "resoverride" in data:
             res = eval(data["resoverride"])
             self.chb_resOverride.setChecked(res[0])
@@ -267,7 +290,7 @@ class MHrendLayerClass(object):
             idx = self.cb_renderLayer.findText(data["renderlayer"])
             if idx != -1:
                 self.cb_renderLayer.setCurrentIndex(idx)
-                self.stateManager.saveStatesToScene()
+                self.saveStates()
         if "outputFormat" in data:
             idx = self.cb_format.findText(data["outputFormat"])
             if idx != -1:
@@ -316,24 +339,37 @@ class MHrendLayerClass(object):
                 )
         if "dontupdateversion" in data:
             self.chb_dontUpdateV.setChecked(eval(data["dontupdateversion"]))
+        if "outputmode" in data:
+            idx = self.cb_outputMode.findText(data["outputmode"])
+            if idx != -1:
+                self.cb_outputMode.setCurrentIndex(idx)
+        if "exrcodec" in data:
+            idx = self.cb_exrCodec.findText(data["exrcodec"])
+            if idx != -1:
+                self.cb_exrCodec.setCurrentIndex(idx)
             
         self.core.callback("onStateSettingsLoaded", self, data)
 
+    @err_catcher(name=__name__)
+    def saveStates(self, *args):
+        # Coalesced, the states are written to the scene once per event loop iteration
+        self.stateSaves.request()
+
     @err_catcher(name=__name__)
     def connectEvents(self):
         self.e_name.textChanged.connect(self.nameChanged)
-        self.e_name.editingFinished.connect(self.stateManager.saveStatesToScene)
+        self.e_name.editingFinished.connect(self.saveStates)
         self.cb_context.activated.connect(self.onContextTypeChanged)
         self.b_context.clicked.connect(self.selectContextClicked)
         self.b_changeTask.clicked.connect(self.changeTask)
         self.chb_renderPreset.stateChanged.connect(self.presetOverrideChanged)
-        self.cb_renderPreset.activated.connect(self.stateManager.saveStatesToScene)
+        self.cb_renderPreset.activated.connect(self.saveStates)
         self.cb_rangeType.activated.connect(self.rangeTypeChanged)
         self.sp_rangeStart.editingFinished.connect(self.startChanged)
         self.sp_rangeEnd.editingFinished.connect(self.endChanged)
         self.le_frameExpression.textChanged.connect(self.frameExpressionChanged)
         self.le_frameExpression.editingFinished.connect(
-            self.stateManager.saveStatesToScene
+            self.saveStates
         )
         self.le_frameExpression.setMouseTracking(True)
         self.le_frameExpression.origMoveEvent = self.le_frameExpression.mouseMoveEvent
@@ -342,34 +378,34 @@ class MHrendLayerClass(object):
         self.le_frameExpression.focusOutEvent = self.exprFocusOutEvent
         self.cb_cam.activated.connect(self.setCam)
         self.chb_resOverride.stateChanged.connect(self.resOverrideChanged)
-        self.sp_resWidth.editingFinished.connect(self.stateManager.saveStatesToScene)
-        self.sp_resHeight.editingFinished.connect(self.stateManager.saveStatesToScene)
+        self.sp_resWidth.editingFinished.connect(self.saveStates)
+        self.sp_resHeight.editingFinished.connect(self.saveStates)
         self.b_resPresets.clicked.connect(self.showResPresets)
-        self.cb_master.activated.connect(self.stateManager.saveStatesToScene)
-        self.cb_outPath.activated.connect(self.stateManager.saveStatesToScene)
+        self.cb_master.activated.connect(self.saveStates)
+        self.cb_outPath.activated.connect(self.saveStates)
         self.cb_renderLayer.activated.connect(self.on_RenderLayerCb_changed)
-        self.cb_format.activated.connect(self.stateManager.saveStatesToScene)
+        self.cb_format.activated.connect(self.saveStates)
         self.gb_submit.toggled.connect(self.rjToggled)
         self.cb_manager.activated.connect(self.managerChanged)
-        self.sp_rjPrio.editingFinished.connect(self.stateManager.saveStatesToScene)
+        self.sp_rjPrio.editingFinished.connect(self.saveStates)
         self.sp_rjFramesPerTask.editingFinished.connect(
-            self.stateManager.saveStatesToScene
+            self.saveStates
         )
-        self.sp_rjTimeout.editingFinished.connect(self.stateManager.saveStatesToScene)
-        self.chb_rjSuspended.stateChanged.connect(self.stateManager.saveStatesToScene)
+        self.sp_rjTimeout.editingFinished.connect(self.saveStates)
+        self.chb_rjSuspended.stateChanged.connect(self.saveStates)
         self.chb_osDependencies.stateChanged.connect(
-            self.stateManager.saveStatesToScene
+            self.saveStates
         )
-        self.chb_osUpload.stateChanged.connect(self.stateManager.saveStatesToScene)
-        self.chb_osPAssets.stateChanged.connect(self.stateManager.saveStatesToScene)
-        self.e_osSlaves.editingFinished.connect(self.stateManager.saveStatesToScene)
+        self.chb_osUpload.stateChanged.connect(self.saveStates)
+        self.chb_osPAssets.stateChanged.connect(self.saveStates)
+        self.e_osSlaves.editingFinished.connect(self.saveStates)
         self.b_osSlaves.clicked.connect(self.openSlaves)
         self.sp_dlConcurrentTasks.editingFinished.connect(
-            self.stateManager.saveStatesToScene
+            self.saveStates
         )
         self.sp_dlGPUpt.editingFinished.connect(self.gpuPtChanged)
         self.le_dlGPUdevices.editingFinished.connect(self.gpuDevicesChanged)
-        self.gb_passes.toggled.connect(self.stateManager.saveStatesToScene)
+        self.gb_passes.toggled.connect(self.saveStates)
         self.b_addPasses.clicked.connect(self.showPasses)
         self.lw_passes.customContextMenuRequested.connect(self.rclickPasses)
         self.b_pathLast.clicked.connect(self.showLastPathMenu)
@@ -397,7 +433,7 @@ class MHrendLayerClass(object):
                     self.gb_output.setStyleSheet("border: 1px solid #3498db;")
             
             self.state.setText(0, name)
-        self.stateManager.saveStatesToScene
+        self.saveStates
 
     @err_catcher(name=__name__)
     def initializeContextBasedSettings(self):
@@ -471,31 +507,31 @@ class MHrendLayerClass(object):
     def setCustomContext(self, context):
         self.customContext = context
         self.refreshContext()
-        self.stateManager.saveStatesToScene()
+        self.saveStates()
 
     @err_catcher(name=__name__)
     def onContextTypeChanged(self, state):
         self.refreshContext()
-        self.stateManager.saveStatesToScene()
+        self.saveStates()
 
     @err_catcher(name=__name__)
     def rangeTypeChanged(self, state):
         self.updateUi()
-        self.stateManager.saveStatesToScene()
+        self.saveStates()
 
     @err_catcher(name=__name__)
     def startChanged(self):
         if self.sp_rangeStart.value() > self.sp_rangeEnd.value():
             self.sp_rangeEnd.setValue(self.sp_rangeStart.value())
 
-        self.stateManager.saveStatesToScene()
+        self.saveStates()
 
     @err_catcher(name=__name__)
     def endChanged(self):
         if self.sp_rangeEnd.value() < self.sp_rangeStart.value():
             self.sp_rangeStart.setValue(self.sp_rangeEnd.value())
 
-        self.stateManager.saveStatesToScene()
+        self.saveStates()
 
     @err_catcher(name=__name__)
     def frameExpressionChanged(self, text=None):
@@ -575,7 +611,7 @@ class MHrendLayerClass(object):
     @err_catcher(name=__name__)
     def setCam(self, index):
         self.curCam = self.camlist[index]
-        self.stateManager.saveStatesToScene()
+        self.saveStates()
 
     @err_catcher(name=__name__)
     def nameChanged(self, text):
@@ -619,7 +655,7 @@ class MHrendLayerClass(object):
         idx = self.cb_format.findText(fmt)
         if idx != -1:
             self.cb_format.setCurrentIndex(idx)
-            self.stateManager.saveStatesToScene()
+            self.saveStates()
             return True
 
         return False
@@ -716,7 +752,8 @@ class MHrendLayerClass(object):
         #set the name of the state and the layername property on the state
         self.layerToTask()
         self.layername = self.cb_renderLayer.currentText()
-        self.stateManager.saveStatesToScene()
+        self.updateLayerProperties()
+        self.saveStates()
     
     @err_catcher(name=__name__)
     def ensureUniqueName(self, names):
@@ -764,7 +801,7 @@ class MHrendLayerClass(object):
             self.cb_renderLayer.addItems(layers)
             self.on_RenderLayerCb_setup()
             # self.setup(self.state, self.core, self.stateManager)
-            self.stateManager.saveStatesToScene()
+            self.saveStates()
 
     @err_catcher(name=__name__)
     def on_RenderLayerCb_setup(self):
@@ -779,7 +816,7 @@ class MHrendLayerClass(object):
 
                 self.layerToTask()
                 self.layername = self.cb_renderLayer.currentText()
-                self.stateManager.saveStatesToScene()
+                self.saveStates()
                         
             # if there are not, Modify the layer to be unusable (if possible delete it, but Idk how :) )
             else:
@@ -796,7 +833,7 @@ class MHrendLayerClass(object):
                     self.gb_layerProperties.setVisible(False)
                     self.gb_output.setVisible(False)
                     self.f_renderLayer.setVisible(False)
-                    self.stateManager.saveStatesToScene()
+                    self.saveStates()
 
             
     @err_catcher(name=__name__)
@@ -804,7 +841,7 @@ class MHrendLayerClass(object):
         layername = self.cb_renderLayer.currentText()
         self.setTaskname(layername)
         self.nameChanged(layername)
-        self.stateManager.saveStatesToScene()
+        self.saveStates()
 
     @err_catcher(name=__name__)
     def changeTask(self):
@@ -825,12 +862,12 @@ class MHrendLayerClass(object):
         if result == 1:
             self.setTaskname(self.nameWin.e_item.text())
             self.nameChanged(self.e_name.text())
-            self.stateManager.saveStatesToScene()
+            self.saveStates()
 
     @err_catcher(name=__name__)
     def presetOverrideChanged(self, checked):
         self.cb_renderPreset.setEnabled(checked)
-        self.stateManager.saveStatesToScene()
+        self.saveStates()
 
     @err_catcher(name=__name__)
     def resOverrideChanged(self, checked):
@@ -838,7 +875,7 @@ class MHrendLayerClass(object):
         self.sp_resHeight.setEnabled(checked)
         self.b_resPresets.setEnabled(checked)
 
-        self.stateManager.saveStatesToScene()
+        self.saveStates()
 
     @err_catcher(name=__name__)
     def showResPresets(self):
@@ -858,7 +895,7 @@ class MHrendLayerClass(object):
             pAct.triggered.connect(
                 lambda x=None, v=pheight: self.sp_resHeight.setValue(v)
             )
-            pAct.triggered.connect(lambda: self.stateManager.saveStatesToScene())
+            pAct.triggered.connect(lambda: self.saveStates())
             pmenu.addAction(pAct)
 
         pmenu.exec_(QCursor.pos())
@@ -909,7 +946,7 @@ class MHrendLayerClass(object):
         idx = self.cb_master.findText(master)
         if idx != -1:
             self.cb_master.setCurrentIndex(idx)
-            self.stateManager.saveStatesToScene()
+            self.saveStates()
             return True
 
         return False
@@ -923,7 +960,7 @@ class MHrendLayerClass(object):
         idx = self.cb_outPath.findText(location)
         if idx != -1:
             self.cb_outPath.setCurrentIndex(idx)
-            self.stateManager.saveStatesToScene()
+            self.saveStates()
             return True
 
         return False
@@ -952,30 +989,184 @@ class MHrendLayerClass(object):
             layout.addWidget(checkbox)
             
             self.dynamic_checkboxes.append(checkbox)
+            self.propertyCheckboxes[element] = checkbox
             self.verticalLayout_11.addWidget(container)
 
+    @err_catcher(name=__name__)
+    def addOutputModeWidget(self):
+        self.w_outputMode = QWidget(self.gb_imageRender)
+        layout = QHBoxLayout(self.w_outputMode)
+        layout.setContentsMargins(9, 0, 9, 0)
+
+        self.l_outputMode = QLabel("Output Mode:", self.w_outputMode)
+        self.cb_outputMode = QComboBox(self.w_outputMode)
+        self.cb_outputMode.addItems(self.pluginMHfunctions.layerOutputModes)
+        self.cb_outputMode.installEventFilter(self)
+        self.l_exrCodec = QLabel("Compression:", self.w_outputMode)
+        self.cb_exrCodec = QComboBox(self.w_outputMode)
+        self.cb_exrCodec.addItems(self.pluginMHfunctions.exrCodecs)
+        self.cb_exrCodec.setToolTip("EXR codec of the main and tech passes. Cryptomatte is always kept lossless.")
+        layout.addWidget(self.l_outputMode)
+        layout.addWidget(self.cb_outputMode)
+        layout.addStretch()
+        layout.addWidget(self.l_exrCodec)
+        layout.addWidget(self.cb_exrCodec)
+
+        idx = self.verticalLayout_2.indexOf(self.f_renderLayer)
+        self.verticalLayout_2.insertWidget(idx + 1, self.w_outputMode)
+
+        self.cb_outputMode.activated.connect(self.outputModeChanged)
+        self.cb_exrCodec.activated.connect(self.outputModeChanged)
+
+    @err_catcher(name=__name__)
+    def getOutputOptions(self)->dict:
+        return {
+            "outputMode": self.cb_outputMode.currentText(),
+            "codec": self.cb_exrCodec.currentText(),
+        }
+
+    @err_catcher(name=__name__)
+    def outputModeChanged(self, *args):
+        self.saveStates()
+        self.outputModeTooltipKey = None
+        # Only rebuild layers that were already set up
+        if self.pluginMHfunctions.getRLNode(self.cb_renderLayer.currentText(), cancreate=False):
+            self.setupNodes()
+
+    def eventFilter(self, obj, event):
+        # The output estimate describes the layer graph once per mode, only do it for a shown tooltip
+        if obj is self.cb_outputMode and event.type() == QEvent.ToolTip:
+            self.updateOutputModeTooltip()
+
+        return False
+
+    @err_catcher(name=__name__)
+    def updateOutputModeTooltip(self):
+        layername = self.cb_renderLayer.currentText()
+        key = (layername, tuple(sorted(self.uiTracker.getGenerations().items())))
+        if key == self.outputModeTooltipKey:
+            return
+
+        lines = []
+        for mode in self.pluginMHfunctions.layerOutputModes:
+            io = self.pluginMHfunctions.estimateLayerOutputIO(layername, outputMode=mode)
+            if not io:
+                lines = []
+                break
+
+            lines.append("%s: %s files / %.1f MB per frame (uncompressed)" % (mode, io["files"], io["bytes"] / 1024.0 / 1024.0))
+
+        self.cb_outputMode.setToolTip("\n".join(lines))
+        self.outputModeTooltipKey = key
+
     @err_catcher(name=__name__)
     def propertyStateChanged(self, state):
         checkbox = self.sender()
         element_name = checkbox.objectName().split("_", 1)[1]
         if element_name in self.pluginMHfunctions.layerProperties:
-            param = self.pluginMHfunctions.layerProperties[element_name]
-            self.pluginMHfunctions.setViewLayerPropertyState(param, self.cb_renderLayer.currentText(), enable=checkbox.isChecked())
-        # print(f"Checkbox '{element_name}' changed to {'checked' if state == Qt.Checked else 'unchecked'}")
+            self.pluginMHfunctions.pushLayerProperty(self.cb_renderLayer.currentText(), element_name, checkbox.isChecked())
+            # msgbus doesn't see changes made by Python
+            self.outputModeTooltipKey = None
 
     @err_catcher(name=__name__)
     def updateLayerProperties(self):
-        for chb in self.dynamic_checkboxes:
-            element_name = chb.objectName().split("_", 1)[1]
-            if element_name in self.pluginMHfunctions.layerProperties:
-                param = self.pluginMHfunctions.layerProperties[element_name]
-                layername = self.cb_renderLayer.currentText()
-                if not layername == "":
-                    ischecked = self.pluginMHfunctions.getViewLayerPropertyState(param, layername)
-                    chb.setChecked(ischecked)
+        layername = self.cb_renderLayer.currentText()
+        if not layername == "":
+            self.pluginMHfunctions.syncLayerPropertyWidgets(layername, self.propertyCheckboxes)
+
+    @err_catcher(name=__name__)
+    def isUiShown(self):
+        # The State Manager only shows the settings of the current state
+        return self.stateManager.tw_export.currentItem() is self.state
+
+    @err_catcher(name=__name__)
+    def onCurrentStateChanged(self, current, previous=None):
+        if current is self.state and (self.uiDirty or self.uiTracker.isStale(self.uiGenerations)):
+            self.updateUi()
+
+    def disconnectStateManager(self):
+        # Called when the state is deleted, the State Manager outlives it
+        self.uiTracker.removeListener(self.onUiInvalidated)
+        try:
+            self.stateManager.tw_export.currentItemChanged.disconnect(self.onCurrentStateChanged)
+        except (TypeError, RuntimeError):
+            pass
+
+    def onUiInvalidated(self, topic):
+        # Called from the Blender handlers. Hidden states only follow the
+        # layer list, pass changes wait until the state is shown.
+        # Deleted states remove the listener, see disconnectStateManager
+        if topic == NODES:
+            return
+
+        if topic == LAYERS or self.isUiShown():
+            self.scheduleUiRefresh()
 
     @err_catcher(name=__name__)
-    def updateUi(self):
+    def scheduleUiRefresh(self):
+        # A burst of notifications refreshes once on the next event loop iteration
+        if self.uiRefreshScheduled:
+            return
+
+        self.uiRefreshScheduled = True
+        QTimer.singleShot(0, self.runScheduledUiRefresh)
+
+    def runScheduledUiRefresh(self):
+        self.uiRefreshScheduled = False
+        try:
+            self.objectName()
+        except RuntimeError:
+            # The state was deleted before the event loop ran
+            return
+
+        self.updateUi()
+
+    @err_catcher(name=__name__)
+    def refreshLayerList(self)->bool:
+        # Returns False if the state has no layer left to use
+        if 'DELETE THIS STATE' in self.l_taskName.text():
+            self.cb_renderLayer.clear()
+            self.state.setText(0, '!! DELETE THIS STATE !!')
+            return False
+
+        curLayer = self.cb_renderLayer.currentText()
+        layerList = self.pluginMHfunctions.getRenderLayers()
+        # layerList = getattr(
+        #     self.core.appPlugin, "sm_render_getRenderLayer", lambda x: []
+        # )(self)
+
+        items = [self.cb_renderLayer.itemText(idx) for idx in range(self.cb_renderLayer.count())]
+        if items != layerList:
+            self.cb_renderLayer.clear()
+            self.cb_renderLayer.addItems(layerList)
+
+        if curLayer in layerList:
+            self.cb_renderLayer.setCurrentIndex(layerList.index(curLayer))
+        else:
+            self.cb_renderLayer.setCurrentIndex(0)
+            self.saveStates()
+
+        self.layername = self.cb_renderLayer.currentText()
+        return True
+
+    @err_catcher(name=__name__)
+    def updateSummary(self):
+        # Cheap refresh of a state whose settings aren't shown: layer list and item text
+        if self.refreshLayerList():
+            self.nameChanged(self.e_name.text())
+            self.isDontUpdateVersionToggled(self.chb_dontUpdateV.isChecked())
+
+    @err_catcher(name=__name__)
+    def updateUi(self, force=False):
+        # The passes, properties and submit settings are only refreshed for
+        # the shown state, the others are marked dirty and refresh when shown
+        if not force and not self.isUiShown():
+            self.uiDirty = True
+            self.updateSummary()
+            return True
+
+        self.uiDirty = False
+        self.uiGenerations = self.uiTracker.getGenerations()
         self.w_context.setHidden(not self.allowCustomContext)
         self.refreshContext()
 
@@ -998,7 +1189,7 @@ class MHrendLayerClass(object):
         #     else:
         #         self.curCam = None
 
-        #     self.stateManager.saveStatesToScene()
+        #     self.saveStates()
 
         # self.updateRange()
         
@@ -1008,35 +1199,15 @@ class MHrendLayerClass(object):
             self.w_master.setVisible(False)
 
         # update Render Layer
-        curLayer = self.cb_renderLayer.currentText()
-        self.cb_renderLayer.clear()
-
-        layerList = self.pluginMHfunctions.getRenderLayers()
-        # layerList = getattr(
-        #     self.core.appPlugin, "sm_render_getRenderLayer", lambda x: []
-        # )(self)
-
-        self.updateLayerProperties()
-
-        if 'DELETE THIS STATE' in self.l_taskName.text():
-            self.cb_renderLayer.clear()
-            self.state.setText(0, '!! DELETE THIS STATE !!')
-        else:
-            self.cb_renderLayer.addItems(layerList)
-
-            if curLayer in layerList:
-                self.cb_renderLayer.setCurrentIndex(layerList.index(curLayer))
-            else:
-                self.cb_renderLayer.setCurrentIndex(0)
-                self.stateManager.saveStatesToScene()
-            self.layername = self.cb_renderLayer.currentText()
+        if self.refreshLayerList():
+            self.updateLayerProperties()
 
             self.refreshSubmitUi()
             getattr(self.pluginMHfunctions, "sm_render_refreshPasses", lambda x: None)(self)
 
             self.nameChanged(self.e_name.text())            
             self.isDontUpdateVersionToggled(self.chb_dontUpdateV.isChecked())
-            self.stateManager.saveStatesToScene()
+            self.saveStates()
 
         return True
 
@@ -1179,22 +1350,22 @@ class MHrendLayerClass(object):
                     selSlaves = selSlaves[:-2]
 
             self.e_osSlaves.setText(selSlaves)
-            self.stateManager.saveStatesToScene()
+            self.saveStates()
 
     @err_catcher(name=__name__)
     def gpuPtChanged(self):
         self.w_dlGPUdevices.setEnabled(self.sp_dlGPUpt.value() == 0)
-        self.stateManager.saveStatesToScene()
+        self.saveStates()
 
     @err_catcher(name=__name__)
     def gpuDevicesChanged(self):
         self.w_dlGPUpt.setEnabled(self.le_dlGPUdevices.text() == "")
-        self.stateManager.saveStatesToScene()
+        self.saveStates()
 
     @err_catcher(name=__name__)
     def setupNodes(self):
         layername = self.cb_renderLayer.currentText()
-        self.pluginMHfunctions.createOutputFromRL(layername=layername)
+        self.pluginMHfunctions.createOutputFromRL(layername=layername, **self.getOutputOptions())
 
     @err_catcher(name=__name__)
     def showPasses(self):
@@ -1225,29 +1396,11 @@ class MHrendLayerClass(object):
         self.il.tw_steps.horizontalHeaderItem(0).setText("Name")
         self.il.tw_steps.setColumnHidden(1, True)
         self.il.buttonBox.button(QDialogButtonBox.Ok).setEnabled(True)
-        tech = []
-        main = []
-        crypto = []
-        for i in sorted(steps, key=lambda s: s.lower()):
-            passname:str = self.pluginMHfunctions.AOVDict[i.lower()]
-            if self.pluginMHfunctions.compareTechPass(passname):
-                tech.append(i)
-            elif 'crypto' in passname.lower():
-                crypto.append(i)
-            else:
-                main.append(i)
-        organizedsteps = tech + main + crypto
-        for i in organizedsteps:
+        for i, group in self.pluginMHfunctions.sortAOVsByGroup(steps):
             rc = self.il.tw_steps.rowCount()
             self.il.tw_steps.insertRow(rc)
-            item1 = QTableWidgetItem(i)            
-            passname:str = self.pluginMHfunctions.AOVDict[i.lower()]
-            if i in tech:
-                item1.setBackground(QColor("#995233"))
-            elif i in crypto:
-                item1.setBackground(QColor("#429933"))
-            else:
-                item1.setBackground(QColor("#365e99"))
+            item1 = QTableWidgetItem(i)
+            item1.setBackground(QColor(self.pluginMHfunctions.aovGroupColors[group]))
             self.il.tw_steps.setItem(rc, 0, item1)
 
         result = self.il.exec_()
@@ -1262,38 +1415,86 @@ class MHrendLayerClass(object):
                 )
 
         self.updateUi()
-        self.stateManager.saveStatesToScene()
+        self.saveStates()
         self.setupNodes()
 
     @err_catcher(name=__name__)
     def rclickPasses(self, pos):
-        if self.lw_passes.currentItem() is None or not getattr(
+        rcmenu = QMenu()
+
+        if self.lw_passes.currentItem() is not None and getattr(
             self.core.appPlugin, "canDeleteRenderPasses", True
         ):
-            return
+            delAct = QAction("Delete", self)
+            delAct.triggered.connect(self.deleteAOVs)
+            rcmenu.addAction(delAct)
 
-        rcmenu = QMenu()
+        setupAct = QAction("Setup Nodes For All Layers", self)
+        setupAct.triggered.connect(self.setupAllLayersNodes)
+        rcmenu.addAction(setupAct)
+
+        reportAct = QAction("Storage Report...", self)
+        reportAct.triggered.connect(self.showStorageReport)
+        rcmenu.addAction(reportAct)
 
-        delAct = QAction("Delete", self)
-        delAct.triggered.connect(self.deleteAOVs)
-        rcmenu.addAction(delAct)
+        auditAct = QAction("Audit Render Passes...", self)
+        auditAct.triggered.connect(self.showPassesAudit)
+        rcmenu.addAction(auditAct)
 
         rcmenu.exec_(QCursor.pos())
 
+    @err_catcher(name=__name__)
+    def getLayerStatesOptions(self):
+        # {layername: output options} of all enabled MHrendLayer states, in state order
+        layerOptions = {}
+        for state in self.stateManager.states:
+            if state.ui.className == "MHrendLayer" and not state.text(0).endswith(" - disabled"):
+                layername = state.ui.cb_renderLayer.currentText()
+                if layername not in layerOptions:
+                    layerOptions[layername] = state.ui.getOutputOptions()
+
+        return layerOptions
+
+    @err_catcher(name=__name__)
+    def setupAllLayersNodes(self):
+        # Build the nodes of all enabled MHrendLayer states with a single layout pass
+        layerOptions = self.getLayerStatesOptions()
+        layernames = list(layerOptions)
+        result = self.pluginMHfunctions.setupLayersOutputs(layernames, layerOptions=layerOptions)
+        self.updateUi()
+        msg = "Set up %s layers.\n\nCreated nodes: %s\nReused nodes: %s\nRemoved empty nodes: %s" % (
+            len(layernames), len(result["created"]), len(result["reused"]), len(result["removed"])
+        )
+        self.core.popup(msg, severity="info")
+
+    @err_catcher(name=__name__)
+    def showStorageReport(self):
+        layerOptions = self.getLayerStatesOptions()
+        report = self.pluginMHfunctions.getStorageReport(layerOptions)
+        if not report["rows"]:
+            self.core.popup("No Prism output nodes found for the enabled render layer states.", severity="info")
+            return
+
+        self.core.popup(self.pluginMHfunctions.formatStorageReport(report), title="Storage Report", severity="info")
+
+    @err_catcher(name=__name__)
+    def showPassesAudit(self):
+        audit = self.pluginMHfunctions.auditRenderPasses(self.getLayerStatesOptions())
+        self.core.popup(self.pluginMHfunctions.formatRenderPassAudit(audit), title="Render Passes Audit", severity="info")
+
     @err_catcher(name=__name__)
     def deleteAOVs(self):
         items = self.lw_passes.selectedItems()
-        for i in items:
-            self.pluginMHfunctions.removeAOV(i.text(), self.cb_renderLayer.currentText())
-        self.pluginMHfunctions.removeEmptyOutNodes(self.cb_renderLayer.currentText())
-        # self.pluginMHfunctions.repositionLayerOutNodes(self.cb_renderLayer.currentText())
-        self.pluginMHfunctions.repositionRenderLayerNodes()
+        with self.pluginMHfunctions.nodeTreeOperation():
+            for i in items:
+                self.pluginMHfunctions.removeAOV(i.text(), self.cb_renderLayer.currentText())
+            # Emptied nodes are removed and the layout runs once, when the operation ends
         self.updateUi()
 
     @err_catcher(name=__name__)
     def rjToggled(self, checked):
         self.refreshSubmitUi()
-        self.stateManager.saveStatesToScene()
+        self.saveStates()
 
     @err_catcher(name=__name__)
     def managerChanged(self, text=None):
@@ -1301,7 +1502,7 @@ class MHrendLayerClass(object):
         if plugin:
             plugin.sm_render_managerChanged(self)
 
-        self.stateManager.saveStatesToScene()
+        self.saveStates()
 
     @err_catcher(name=__name__)
     def getContextStrFromEntity(self, entity):
@@ -1354,41 +1555,70 @@ class MHrendLayerClass(object):
 
     @err_catcher(name=__name__)
     def getOutputName(self, useVersion="next"):
-        if self.tasknameRequired and not self.getTaskname():
+        job = self.getOutputJob(useVersion=useVersion)
+        if not job:
             return
 
-        task = self.getTaskname()
-        extension = self.cb_format.currentText()
-        context = self.getCurrentContext()
-        framePadding = ""
-
-        if "type" not in context:
-            return
-
-        singleFrame = self.cb_rangeType.currentText() == "Single Frame"
-        location = self.cb_outPath.currentText()
-        outputPathData = self.core.mediaProducts.generateMediaProductPath(
-            entity=context,
-            task=task,
-            extension=extension,
-            framePadding=framePadding,
-            comment=self.stateManager.publishComment,
-            version=useVersion if useVersion != "next" else None,
-            location=location,
-            singleFrame=singleFrame,
-            returnDetails=True,
-            mediaType=self.mediaType,
-            state=self,
-        )
-
+        outputPathData = self.generateOutputPath(job)
         outputFolder = os.path.dirname(outputPathData["path"])
         hVersion = outputPathData["version"]
 
         return outputPathData["path"], outputFolder, hVersion
 
+    @err_catcher(name=__name__)
+    def getPublisher(self):
+        # Headless publish functions, a layer state only uses the layer part
+        return self.pluginMHfunctions.createRenderPublisher(None, [], comment=self.stateManager.publishComment)
+
+    @err_catcher(name=__name__)
+    def getOutputJob(self, useVersion="next"):
+        # Everything the version resolution needs, read from the UI on the main thread
+        return self.getPublisher().getLayerJob(self.getStateProps(), useVersion=useVersion, state=self)
+
+    def generateOutputPath(self, job):
+        return self.getPublisher().generateLayerPath(job)
+
+    def resolveOutputJob(self, job, allocator=None, transaction=None):
+        # Thread safe, see MHRenderPublisher.resolveLayerJob
+        return self.getPublisher().resolveLayerJob(job, allocator=allocator, transaction=transaction)
+
+    @err_catcher(name=__name__)
+    def applyOutputJob(self, job, resolved, save=True, transaction=None):
+        """
+        Assign a resolved output path to the layer output nodes. Must run on
+        the main thread. The master version is updated by the MHRender
+        publish once the layer is rendered.
+
+        Returns:
+            "Result=Success" or " - error - <reason>"
+        """
+        result, path = self.getPublisher().applyLayerJob(job, resolved, transaction=transaction)
+        if path:
+            self.setLastPath(path, transaction=transaction, save=save)
+
+        return result
+
+    @err_catcher(name=__name__)
+    def setLastPath(self, path, transaction=None, save=True):
+        if transaction:
+            oldPath = self.l_pathLast.text()
+            transaction.recordUndo(
+                "last path of " + self.state.text(0),
+                lambda: (self.l_pathLast.setText(oldPath), self.l_pathLast.setToolTip(oldPath)),
+            )
+
+        self.l_pathLast.setText(path)
+        self.l_pathLast.setToolTip(path)
+        if save:
+            self.saveStates()
+
+    @err_catcher(name=__name__)
+    def updatesVersion(self, keepcurrentV=False)->bool:
+        # if dont update version is checked and there is a path already.
+        return not ((self.chb_dontUpdateV.isChecked() or keepcurrentV) and self.l_pathLast.text() != None)
+
     @err_catcher(name=__name__)
     def executeState(self, parent, useVersion="next", calledFromMHRender=False, keepcurrentV=False)->None:
-        willexecute = True
         layerhasoutnodes = False
         result = "Result=Success"
         # check if there are nodes asociated to this layer.
@@ -1404,92 +1634,29 @@ class MHrendLayerClass(object):
         else:
             layerhasoutnodes = True
         if layerhasoutnodes:
-            # if dont update version is checked and there is a path already.
-            print("l_pathLast.text(): ", self.l_pathLast.text())
-            if (self.chb_dontUpdateV.isChecked() or keepcurrentV) and self.l_pathLast.text() != None:
-                willexecute = False
-            
-            if willexecute:
-                updateMaster = True
-                fileName = self.core.getCurrentFileName()
-                context = self.getCurrentContext()
+            if self.updatesVersion(keepcurrentV):
                 if not self.renderingStarted:
-                    if self.tasknameRequired and not self.getTaskname():
+                    job = self.getOutputJob(useVersion=useVersion)
+                    if not job:
                         return [
                             self.state.text(0)
                             + ": error - no identifier is given. Skipped the activation of this state."
                         ]
-            
-                    outputName, outputPath, hVersion = self.getOutputName(useVersion=useVersion)
-                    print("outputName: ", outputName, "outputPath: ",outputPath, "hVersion: ", hVersion)
-                    expandedOutputPath = os.path.expandvars(outputPath)
-                    print("expanded output path: ", expandedOutputPath)
-                    outLength = len(outputName)
-                    if platform.system() == "Windows" and os.getenv("PRISM_IGNORE_PATH_LENGTH") != "1" and outLength > 255:
-                        return [
-                            self.state.text(0)
-                            + " - error - The outputpath is longer than 255 characters (%s), which is not supported on Windows. Please shorten the outputpath by changing the comment, taskname or projectpath."
-                            % outLength
-                        ]
-
-                    if not os.path.exists(os.path.dirname(expandedOutputPath)):
-                        os.makedirs(os.path.dirname(expandedOutputPath))
-
-                    details = context.copy()
-                    if "filename" in details:
-                        del details["filename"]
-
-                    if "extension" in details:
-                        del details["extension"]
-
-                    details["version"] = hVersion
-                    details["sourceScene"] = fileName
-                    details["identifier"] = self.getTaskname()
-                    details["comment"] = self.stateManager.publishComment
-
-                    if self.mediaType == "3drenders":
-                        infopath = os.path.dirname(expandedOutputPath)
-                    else:
-                        infopath = expandedOutputPath
 
-                    self.core.saveVersionInfo(
-                        filepath=infopath, details=details
-                    )
-                    
-                    self.pluginMHfunctions.setOutputsPaths(self.cb_renderLayer.currentText(), expandedOutputPath)
-                    
-                    # the aov is necesary for prism logic, we have to remove it fo some of our operations.
-                    outputpathnoaov = os.path.join(os.path.dirname(expandedOutputPath),os.path.basename(outputName))
-
-                    self.l_pathLast.setText(outputpathnoaov)
-                    self.l_pathLast.setToolTip(outputpathnoaov)
-                    self.stateManager.saveStatesToScene()
-
-                    pathassigned = True
-                    if rlayername in layers:
-                        outnodesdict:dict = self.pluginMHfunctions.getLayerOutNodes(rlayername)
-                        for node in list(outnodesdict.values()):
-                            if node:
-                                if not os.path.dirname(expandedOutputPath) in node.base_path:
-                                    pathassigned = False
-
-                    if pathassigned:
-                        result = "Result=Success"
-                    else:
-                        result = " - error - The outputpath was not assigned to nodes."
-                    
+                    with self.pluginMHfunctions.createPublishTransaction(self.state.text(0)) as transaction:
+                        resolved = self.resolveOutputJob(job, transaction=transaction)
+                        result = self.applyOutputJob(job, resolved, transaction=transaction)
+                        if "Result=Success" not in result:
+                            transaction.rollback()
+                            self.saveStates()
                 else:
                     result = "Result=Success"
 
-                if result == "publish paused":
-                    return [self.state.text(0) + " - publish paused"]
-                else:
-                    if updateMaster:
-                        self.handleMasterVersion(os.path.expandvars(outputName))
-                
                 if not calledFromMHRender:
                     if result=="Result=Success":
                         msgStr = "The Execution was successful."
+                        if self.isUsingMasterVersion():
+                            msgStr += "\nThe master version is updated when MHRender renders this layer."
                         self.core.popup(msgStr, title="Execute", severity="info",)
                     elif "error" in result:
                         msgStr = result.replace(" - error - ", "")
@@ -1506,7 +1673,10 @@ class MHrendLayerClass(object):
                 message = "This Layer has no File Output nodes\nasociated with it."
                 self.core.popup(message,title=None,severity="info",)
         
-        ### RETURN ###
+        return self.getExecuteResult(result)
+
+    @err_catcher(name=__name__)
+    def getExecuteResult(self, result):
         if "Result=Success" in result:
             return [self.state.text(0) + " - success"]
         else:
@@ -1600,6 +1770,8 @@ class MHrendLayerClass(object):
             "enablepasses": str(self.gb_passes.isChecked()),
             "stateenabled": self.core.getCheckStateValue(self.state.checkState(0)),
             "dontupdateversion":str(self.chb_dontUpdateV.isChecked()),
+            "outputmode": self.cb_outputMode.currentText(),
+            "exrcodec": self.cb_exrCodec.currentText(),
         }
         self.core.callback("onStateGetSettings", self, stateProps)
         return stateProps